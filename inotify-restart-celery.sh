@@ -1,7 +1,10 @@
 #! /usr/bin/env bash
 set -e
 
-celery -A app.workers.celery worker -l INFO -Ofair &
+# Queues consumed by this worker, every queue can be served by its own scaled service
+CELERY_QUEUES=${CELERY_QUEUES:-celery,ingest,convert,batch,pdf}
+
+celery -A app.workers.celery worker -l INFO -Ofair -Q "$CELERY_QUEUES" -n "${CELERY_QUEUES//,/-}@%h" &
 PID=$!
 
 # Listen to the directory for any changes
@@ -12,7 +15,7 @@ inotifywait -r -m /app -e modify,move,create,delete,attrib |
       # if the PID exists, kill it
       kill -s 0 $PID > /dev/null && kill $PID
       sleep 1
-      celery -A app.workers.celery worker -l INFO -Ofair &
+      celery -A app.workers.celery worker -l INFO -Ofair -Q "$CELERY_QUEUES" -n "${CELERY_QUEUES//,/-}@%h" &
       PID=$!
     fi
   done
@@ -1,4 +1,4 @@
-from .models import FilesTable
+from .models import FilesTable, FileOutputsTable, BlobsTable, ConversionsTable
 
 from .database import db_instance
 
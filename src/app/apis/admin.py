@@ -0,0 +1,28 @@
+# Packages
+import hmac
+from typing import Optional
+from fastapi import Body, Depends, Header, Response, status
+from fastapi.routing import APIRouter
+
+# Modules
+from app.config import ADMIN_TOKEN
+from app.usecases.admin import AdminUsecase
+from app.utils.exceptions import AdminTokenInvalid
+
+router = APIRouter(prefix="/admin")
+
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise AdminTokenInvalid(status.HTTP_403_FORBIDDEN, "Invalid admin token")
+
+
+@router.post("/profiling", dependencies=[Depends(verify_admin_token)])
+def set_profiling(
+        response: Response,
+        rate: float = Body(..., embed=True),
+        duration: Optional[float] = Body(None, embed=True),
+):
+    result = AdminUsecase.set_profiling(rate, duration)
+    response.status_code = result.status_code
+    return result
@@ -3,7 +3,11 @@ from fastapi import APIRouter
 
 # Modules
 from .files import router as files
+from .delivery import router as delivery
+from .admin import router as admin
 
 router = APIRouter(prefix="/api")
 
 router.include_router(files)
+router.include_router(delivery)
+router.include_router(admin)
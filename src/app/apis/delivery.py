@@ -0,0 +1,17 @@
+# Packages
+from fastapi import Depends, Request
+from fastapi.routing import APIRouter
+
+# Modules
+from app.usecases.delivery import DeliveryUsecase
+
+router = APIRouter(prefix="/delivery")
+
+
+@router.api_route("/{file_name}", methods=["GET", "HEAD"])
+async def get_file(
+        request: Request,
+        file_name: str,
+        delivery_usecase: DeliveryUsecase = Depends(DeliveryUsecase)
+):
+    return await delivery_usecase.get_file(file_name, request.headers, request.method)
@@ -1,8 +1,11 @@
 # Packages
-from typing import List
+import time
+from typing import List, Optional
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.routing import APIRouter
-from fastapi import Depends, Response, UploadFile, status
+from fastapi import Body, Depends, Form, Header, Query, Request, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
 
 # Modules
 from app.utils.exceptions import ExtensionNotAllowed
@@ -10,6 +13,8 @@ from app.config import ALLOWED_EXTENSIONS
 from app.database import db_instance
 from app.models import FilesTable
 from app.usecases.files import FilesUsecase
+from app.usecases.delivery import DeliveryUsecase
+from app.utils.metrics_helper import MetricsHelper
 
 router = APIRouter(prefix="/files")
 
@@ -25,10 +30,10 @@ def validate_content_type(files: List[UploadFile]):
 
 
 @router.get("/{file_id}")
-async def get_file_by_id(
+def get_file_by_id(
         response: Response,
         file_id: str,
-        db: Session = Depends(db_instance.initialize_session),
+        db: Session = Depends(db_instance.get_session),
         files_usecase: FilesUsecase = Depends(FilesUsecase)
 ):
     result = files_usecase.get_file_by_id(db, file_id, FilesTable)
@@ -38,22 +43,45 @@ async def get_file_by_id(
 
 @router.post("/upload")
 async def upload(
+        request: Request,
         response: Response,
         files: List[UploadFile],
+        profile: Optional[str] = Form(None),
+        formats: Optional[str] = Form(None),
+        x_tenant_id: Optional[str] = Header(None),
         _: None = Depends(validate_content_type),
-        db: Session = Depends(db_instance.initialize_session),
+        db: AsyncSession = Depends(db_instance.initialize_async_session),
         files_usecase: FilesUsecase = Depends(FilesUsecase),
 ):
-    result = files_usecase.upload(db, files, FilesTable)
+    # the multipart body is parsed before the endpoint is called
+    file_types = {file.content_type.split("/")[-1] for file in files}
+    MetricsHelper.observe("request_parse", time.perf_counter() - request.state.started_at, (
+        file_types.pop() if len(file_types) == 1 else "mixed",
+        MetricsHelper.get_size_bucket(int(request.headers.get("content-length", 0)) or None)
+    ))
+    result = await files_usecase.upload(db, files, FilesTable, profile, formats, x_tenant_id)
+    response.status_code = result.status_code
+    return result
+
+
+@router.post("/status")
+def get_files_status(
+        response: Response,
+        file_ids: Optional[List[str]] = Body(None, embed=True),
+        pdf_id: Optional[str] = Body(None, embed=True),
+        db: Session = Depends(db_instance.get_session),
+        files_usecase: FilesUsecase = Depends(FilesUsecase)
+):
+    result = files_usecase.get_files_status(db, file_ids, pdf_id, FilesTable)
     response.status_code = result.status_code
     return result
 
 
 @router.get("/{file_id}/status")
-async def get_file_status(
+def get_file_status(
         response: Response,
         file_id: str,
-        db: Session = Depends(db_instance.initialize_session),
+        db: Session = Depends(db_instance.get_session),
         files_usecase: FilesUsecase = Depends(FilesUsecase)
 ):
     result = files_usecase.get_file_status(db, file_id, FilesTable)
@@ -61,13 +89,62 @@ async def get_file_status(
     return result
 
 
+@router.get("/{file_id}/events")
+async def get_file_events(
+        request: Request,
+        response: Response,
+        file_id: str,
+        db: AsyncSession = Depends(db_instance.initialize_async_session),
+        files_usecase: FilesUsecase = Depends(FilesUsecase)
+):
+    result = await files_usecase.get_file_events(db, file_id, FilesTable, request.is_disconnected)
+    if not result.status:
+        response.status_code = result.status_code
+        return result
+
+    return StreamingResponse(result.data, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/{file_id}/derivative")
+async def get_derivative(
+        request: Request,
+        response: Response,
+        file_id: str,
+        width: int,
+        height: int,
+        mode: str = "fit",
+        fmt: str = Query("png", alias="format"),
+        db: AsyncSession = Depends(db_instance.initialize_async_session),
+        files_usecase: FilesUsecase = Depends(FilesUsecase)
+):
+    result = await files_usecase.get_derivative(db, file_id, FilesTable, width, height, mode, fmt)
+    if not result.status:
+        response.status_code = result.status_code
+        return result
+
+    return DeliveryUsecase.serve_file(result.data, request.headers, request.method)
+
+
 @router.get("/{file_id}/paths")
-async def get_file_paths(
+def get_file_paths(
         response: Response,
         file_id: str,
-        db: Session = Depends(db_instance.initialize_session),
+        db: Session = Depends(db_instance.get_session),
         files_usecase: FilesUsecase = Depends(FilesUsecase)
 ):
     result = files_usecase.get_file_paths(db, file_id, FilesTable)
     response.status_code = result.status_code
     return result
+
+
+@router.delete("/{file_id}")
+def delete_file(
+        response: Response,
+        file_id: str,
+        db: Session = Depends(db_instance.get_session),
+        files_usecase: FilesUsecase = Depends(FilesUsecase)
+):
+    result = files_usecase.delete_file(db, file_id, FilesTable)
+    response.status_code = result.status_code
+    return result
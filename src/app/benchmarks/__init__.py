@@ -0,0 +1,6 @@
+"""Benchmarks of the ingest and convert pipeline
+
+python -m app.benchmarks.e2e      uploads a generated corpus and times it until completed
+python -m app.benchmarks.micro    times conversion, probing and encoding helpers
+python -m app.benchmarks.compare  reports regressions between two result files
+"""
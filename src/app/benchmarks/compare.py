@@ -0,0 +1,101 @@
+"""Compare two benchmark results and report regressions
+
+Usage: python -m app.benchmarks.compare baseline.json current.json [--threshold 0.1]
+
+Exits with status 1 if any metric regressed by more than the threshold.
+"""
+# Packages
+import sys
+import json
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+# Summary keys where lower is better, keys ending in _per_s are higher is better
+LOWER_IS_BETTER = ("mean", "p50", "p90", "p95", "p99")
+
+
+def flatten(metrics: Dict, prefix: str = "") -> Dict[str, float]:
+    """
+    Flatten nested metrics into dotted keys of numeric values
+
+    Args:
+        metrics: metrics of result
+        prefix: prefix of keys
+
+    Returns:
+        dict: numeric metrics by dotted key
+    """
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def get_change(key: str, baseline: float, current: float) -> Optional[float]:
+    """
+    Get relative change of metric, positive values are regressions
+
+    Args:
+        key: dotted key of metric
+        baseline: baseline value
+        current: current value
+
+    Returns:
+        float: relative change or None if metric has no direction
+    """
+    name = key.rsplit(".", 1)[-1]
+    if not baseline:
+        return None
+    if name.endswith("_per_s"):
+        return (baseline - current) / baseline
+    if name in LOWER_IS_BETTER or name.endswith("_bytes"):
+        return (current - baseline) / baseline
+    return None
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[Tuple[str, float, float, float, bool]]:
+    """
+    Compare metrics of two results
+
+    Args:
+        baseline: baseline result
+        current: current result
+        threshold: relative change counted as regression
+
+    Returns:
+        list: key, baseline value, current value, change and whether it regressed
+    """
+    baseline_metrics = flatten(baseline["metrics"])
+    current_metrics = flatten(current["metrics"])
+    rows = []
+    for key in sorted(baseline_metrics.keys() & current_metrics.keys()):
+        change = get_change(key, baseline_metrics[key], current_metrics[key])
+        if change is not None:
+            rows.append((key, baseline_metrics[key], current_metrics[key], change, change > threshold))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as regression")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+
+    print(f"{baseline.get('commit')} -> {current.get('commit')}")
+    rows = compare(baseline, current, args.threshold)
+    for key, old, new, change, regressed in rows:
+        print(f"{'REGRESSED ' if regressed else '          '}{key}: {old} -> {new} ({change:+.1%})")
+    sys.exit(1 if any(regressed for *_, regressed in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
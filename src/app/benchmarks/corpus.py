@@ -0,0 +1,138 @@
+"""Generated corpus of png, jpeg and pdf inputs across size classes"""
+# Packages
+import os
+import zlib
+import random
+from dataclasses import dataclass
+from typing import AnyStr, List, Tuple
+
+# Modules
+from app.utils.wand_helper import Image
+
+# Pixel dimensions of images per size class
+IMAGE_SIZES = {"small": (320, 240), "medium": (1600, 1200), "large": (4000, 3000)}
+# Pdf pages are letter sized, size classes differ in page count
+PDF_PAGE_SIZE = (612, 792)
+PDF_PAGES = {"small": 1, "medium": 8, "large": 32}
+FORMATS = {"png": "png", "jpeg": "jpg", "pdf": "pdf"}
+DEFAULT_MIX = "png:small:40,jpeg:small:40,png:medium:10,jpeg:medium:10,jpeg:large:2,pdf:small:4,pdf:medium:2"
+# Coarse noise upscaled to full size gives photo like gradients, neither
+# trivially compressible nor pure noise
+NOISE_SCALE = 4
+
+
+@dataclass(frozen=True)
+class CorpusFile:
+    path: str
+    format: str
+    size_class: str
+    width: int
+    height: int
+    pages: int
+
+    @property
+    def content_type(self) -> AnyStr:
+        return "application/pdf" if self.format == "pdf" else f"image/{self.format}"
+
+
+def parse_mix(value: str) -> List[Tuple[str, str, int]]:
+    """
+    Parse corpus mix (e.g. png:small:40,pdf:medium:2)
+
+    Args:
+        value: comma separated format:size class:count entries
+
+    Returns:
+        list: format, size class and number of uploads
+
+    Raises:
+        ValueError: unknown format or size class, or malformed entry
+    """
+    mix = []
+    for entry in value.split(","):
+        try:
+            fmt, size_class, count = entry.strip().split(":")
+            count = int(count)
+        except ValueError:
+            raise ValueError(f"Invalid mix entry {entry}, expected format:size_class:count")
+        if fmt not in FORMATS or size_class not in IMAGE_SIZES:
+            raise ValueError(f"Invalid mix entry {entry}. Formats are {', '.join(FORMATS)}, "
+                             f"size classes are {', '.join(IMAGE_SIZES)}")
+        mix.append((fmt, size_class, count))
+    return mix
+
+
+def render_image(width: int, height: int, seed: int) -> Image:
+    """
+    Render deterministic test image
+
+    Args:
+        width: width of image
+        height: height of image
+        seed: seed of noise
+
+    Returns:
+        Image: wand image, to be closed by the caller
+    """
+    rng = random.Random(seed)
+    noise_width, noise_height = max(width // NOISE_SCALE, 1), max(height // NOISE_SCALE, 1)
+    blob = rng.randbytes(noise_width * noise_height * 3)
+    img = Image(blob=blob, format="rgb", width=noise_width, height=noise_height, depth=8)
+    img.resize(width, height, filter="triangle")
+    return img
+
+
+def generate_file(directory: str, fmt: str, size_class: str) -> CorpusFile:
+    """
+    Generate input file of format and size class, files already in the
+    corpus directory are reused
+
+    Args:
+        directory: corpus directory
+        fmt: png, jpeg or pdf
+        size_class: small, medium or large
+
+    Returns:
+        CorpusFile: generated file
+    """
+    width, height = PDF_PAGE_SIZE if fmt == "pdf" else IMAGE_SIZES[size_class]
+    pages = PDF_PAGES[size_class] if fmt == "pdf" else 1
+    path = os.path.join(directory, f"{fmt}_{size_class}.{FORMATS[fmt]}")
+    corpus_file = CorpusFile(path, fmt, size_class, width, height, pages)
+    if os.path.exists(path):
+        return corpus_file
+
+    os.makedirs(directory, exist_ok=True)
+    seed = zlib.crc32(f"{fmt}:{size_class}".encode())
+    temporary_path = f"{path}.tmp"
+    if fmt == "pdf":
+        with Image() as document:
+            for page in range(pages):
+                with render_image(width, height, seed + page) as img:
+                    document.sequence.append(img)
+            document.save(filename=f"pdf:{temporary_path}")
+    else:
+        with render_image(width, height, seed) as img:
+            if fmt == "jpeg":
+                img.compression_quality = 90
+            img.save(filename=f"{fmt}:{temporary_path}")
+    os.replace(temporary_path, path)
+    return corpus_file
+
+
+def build_corpus(directory: str, mix: List[Tuple[str, str, int]]) -> List[CorpusFile]:
+    """
+    Build list of uploads of mix, every format and size class is generated once
+
+    Args:
+        directory: corpus directory
+        mix: format, size class and number of uploads
+
+    Returns:
+        list: corpus file of every upload
+    """
+    uploads = []
+    for fmt, size_class, count in mix:
+        corpus_file = generate_file(directory, fmt, size_class)
+        uploads.extend([corpus_file] * count)
+    return uploads
@@ -0,0 +1,327 @@
+"""End to end benchmark of the ingest and convert pipeline
+
+Uploads a generated corpus to a running stack and polls every file until it
+is completed. Reports upload latency, time to completed per file and per pdf
+page, status and paths latency, worker throughput and peak RSS of workers.
+
+Usage: python -m app.benchmarks.e2e [--url http://localhost:8000] [--mix png:small:40,pdf:medium:2]
+       python -m app.benchmarks.e2e --serve   # API with in-process (eager) tasks as stand-in for workers
+"""
+# Packages
+import os
+import sys
+import time
+import uuid
+import asyncio
+import argparse
+import subprocess
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import aiohttp
+
+# Modules
+from app.benchmarks.corpus import CorpusFile, DEFAULT_MIX, build_corpus, parse_mix
+from app.benchmarks.stats import RssSampler, summarize, write_result
+from app.config import MAX_STATUS_BATCH_SIZE
+
+TERMINAL_STATUSES = ("completed", "failure")
+SERVE_PORT = 8765
+
+
+@dataclass
+class Upload:
+    corpus_file: CorpusFile
+    started: float
+    uploaded: float = None
+    file_id: str = None
+    status: str = None
+    finished: float = None
+    pages: Dict[str, float] = field(default_factory=dict)
+
+
+def get_status(item: Dict) -> str:
+    # ChoiceType statuses are encoded as code and value
+    value = item["status"]
+    return value["code"] if isinstance(value, dict) else value
+
+
+def read_upload(corpus_file: CorpusFile, salt: Optional[str], cache: Dict[str, bytes]) -> bytes:
+    """
+    Read contents of upload. A salt appended after the end of the image
+    makes the contents of every upload unique, so uploads are converted
+    instead of deduplicated against earlier runs.
+
+    Args:
+        corpus_file: corpus file
+        salt: unique suffix of upload, None to upload the file unchanged
+        cache: contents of corpus files by path
+
+    Returns:
+        bytes: contents of upload
+    """
+    if corpus_file.path not in cache:
+        with open(corpus_file.path, "rb") as file:
+            cache[corpus_file.path] = file.read()
+    data = cache[corpus_file.path]
+    return data + f"\n%{salt}\n".encode() if salt else data
+
+
+async def upload_file(
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        corpus_file: CorpusFile,
+        data: bytes,
+        args: argparse.Namespace
+) -> Upload:
+    """
+    Upload single file
+
+    Args:
+        session: http session
+        semaphore: bounds concurrent uploads
+        corpus_file: corpus file
+        data: contents of upload
+        args: command line arguments
+
+    Returns:
+        Upload: timings and file id of upload
+    """
+    form = aiohttp.FormData()
+    form.add_field("files", data, filename=os.path.basename(corpus_file.path),
+                   content_type=corpus_file.content_type)
+    if args.profile:
+        form.add_field("profile", args.profile)
+    if args.formats:
+        form.add_field("formats", args.formats)
+    headers = {"X-Tenant-Id": args.tenant} if args.tenant else {}
+
+    async with semaphore:
+        upload = Upload(corpus_file, time.perf_counter())
+        async with session.post("/api/files/upload", data=form, headers=headers) as response:
+            body = await response.json()
+        upload.uploaded = time.perf_counter()
+
+    if response.status != 200:
+        upload.status = "failure"
+        upload.finished = upload.uploaded
+        print(f"Upload of {corpus_file.path} failed: {body}", file=sys.stderr)
+    else:
+        upload.file_id = body["data"][0]["file_id"]
+    return upload
+
+
+async def poll_files(
+        session: aiohttp.ClientSession,
+        uploads: List[Upload],
+        args: argparse.Namespace,
+        status_latencies: List[float]
+) -> None:
+    """
+    Poll status of files until every file and pdf page finished or the
+    timeout passed. Statuses of files are polled in batches, pages of pdf
+    files by pdf id.
+
+    Args:
+        session: http session
+        uploads: uploads to poll
+        args: command line arguments
+        status_latencies: latencies of status requests are appended to it
+    """
+    deadline = time.perf_counter() + args.timeout
+    by_id = {upload.file_id: upload for upload in uploads if upload.file_id}
+
+    async def post_status(body: Dict) -> List[Dict]:
+        started = time.perf_counter()
+        async with session.post("/api/files/status", json=body) as response:
+            result = await response.json()
+        status_latencies.append(time.perf_counter() - started)
+        return result.get("data") or []
+
+    while time.perf_counter() < deadline:
+        pending = [file_id for file_id, upload in by_id.items() if upload.finished is None]
+        pending_pdfs = [upload for upload in by_id.values()
+                        if upload.corpus_file.format == "pdf"
+                        and len(upload.pages) < upload.corpus_file.pages]
+        if not pending and not pending_pdfs:
+            return
+
+        now = time.perf_counter()
+        for i in range(0, len(pending), MAX_STATUS_BATCH_SIZE):
+            for item in await post_status({"file_ids": pending[i:i + MAX_STATUS_BATCH_SIZE]}):
+                status = get_status(item)
+                upload = by_id[item["file_id"]]
+                if status in TERMINAL_STATUSES and upload.finished is None:
+                    upload.status, upload.finished = status, now
+
+        for upload in pending_pdfs:
+            for item in await post_status({"pdf_id": upload.file_id}):
+                if get_status(item) in TERMINAL_STATUSES:
+                    upload.pages.setdefault(item["file_id"], now)
+            if upload.status == "failure":
+                # pages of failed pdf files never complete
+                upload.pages.update({str(i): now for i in range(upload.corpus_file.pages)})
+
+        await asyncio.sleep(args.poll_interval)
+
+    print(f"Timed out after {args.timeout}s", file=sys.stderr)
+
+
+async def get_paths(session: aiohttp.ClientSession, uploads: List[Upload]) -> List[float]:
+    """
+    Request paths of every completed file
+
+    Args:
+        session: http session
+        uploads: uploads
+
+    Returns:
+        list: latencies of paths requests
+    """
+    latencies = []
+    for upload in uploads:
+        if upload.status == "completed":
+            started = time.perf_counter()
+            async with session.get(f"/api/files/{upload.file_id}/paths") as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    """
+    Run benchmark against stack at args.url
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        dict: metrics of run
+    """
+    corpus = build_corpus(args.corpus_dir, parse_mix(args.mix))
+    run_id = uuid.uuid4().hex
+    cache: Dict[str, bytes] = {}
+    contents = [read_upload(corpus_file, None if args.dedup else f"{run_id}-{i}", cache)
+                for i, corpus_file in enumerate(corpus)]
+
+    sampler = RssSampler(args.rss_match, args.rss_pid).start()
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(args.url, timeout=timeout) as session:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        started = time.perf_counter()
+        uploads = await asyncio.gather(*(upload_file(session, semaphore, corpus_file, data, args)
+                                         for corpus_file, data in zip(corpus, contents)))
+        status_latencies: List[float] = []
+        await poll_files(session, uploads, args, status_latencies)
+        finished = time.perf_counter()
+        paths_latencies = await get_paths(session, uploads)
+    rss = sampler.stop()
+
+    completed = [upload for upload in uploads if upload.status == "completed"]
+    elapsed = max((upload.finished for upload in completed), default=finished) - started
+    pages = sum(upload.corpus_file.pages for upload in completed)
+    pixels = sum(upload.corpus_file.width * upload.corpus_file.height * upload.corpus_file.pages
+                 for upload in completed)
+
+    metrics = {
+        "files": len(uploads),
+        "completed": len(completed),
+        "failed": sum(upload.status == "failure" for upload in uploads),
+        "timed_out": sum(upload.finished is None for upload in uploads),
+        "elapsed_seconds": round(elapsed, 3),
+        "upload_seconds": summarize(upload.uploaded - upload.started for upload in uploads),
+        "status_seconds": summarize(status_latencies),
+        "paths_seconds": summarize(paths_latencies),
+        "completed_seconds": summarize(upload.finished - upload.started for upload in completed),
+        "page_completed_seconds": summarize(
+            page_finished - upload.started
+            for upload in completed if upload.corpus_file.format == "pdf"
+            for page_finished in upload.pages.values()
+        ),
+        "throughput": {"files_per_s": round(len(completed) / elapsed, 3) if elapsed else 0,
+                       "pages_per_s": round(pages / elapsed, 3) if elapsed else 0,
+                       "megapixels_per_s": round(pixels / elapsed / 1e6, 3) if elapsed else 0},
+        "rss": rss,
+    }
+
+    # per class time to completed, e.g. jpeg:large
+    for key in sorted({f"{u.corpus_file.format}:{u.corpus_file.size_class}" for u in completed}):
+        metrics[f"completed_seconds[{key}]"] = summarize(
+            upload.finished - upload.started for upload in completed
+            if f"{upload.corpus_file.format}:{upload.corpus_file.size_class}" == key
+        )
+    return metrics
+
+
+def serve(args: argparse.Namespace) -> subprocess.Popen:
+    """
+    Start API whose celery tasks run eagerly in its own process, a stand-in
+    for RabbitMQ and the workers. Postgres is still required.
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        Popen: API process
+    """
+    env = {**os.environ,
+           "CELERY_TASK_ALWAYS_EAGER": "true",
+           "RABBITMQ_URL": "memory://",
+           # batches need a consuming worker
+           "BATCH_SIZE": "1"}
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app",
+                                "--port", str(SERVE_PORT), "--log-level", "warning"], env=env)
+    args.url = f"http://127.0.0.1:{SERVE_PORT}"
+    args.rss_pid.append(process.pid)
+
+    async def wait_ready():
+        async with aiohttp.ClientSession(args.url) as session:
+            for _ in range(300):
+                try:
+                    async with session.get("/") as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientConnectionError:
+                    pass
+                await asyncio.sleep(0.1)
+        raise RuntimeError("API did not start")
+
+    asyncio.run(wait_ready())
+    return process
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("BENCHMARK_URL", "http://localhost:8000"))
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="format:size_class:count entries")
+    parser.add_argument("--corpus-dir", default=os.path.join(os.path.dirname(__file__), "corpus"))
+    parser.add_argument("--concurrency", type=int, default=8, help="uploads in flight")
+    parser.add_argument("--profile", help="conversion profile of uploads")
+    parser.add_argument("--formats", help="output formats of uploads")
+    parser.add_argument("--tenant", help="X-Tenant-Id of uploads")
+    parser.add_argument("--dedup", action="store_true", help="upload identical contents (dedup path)")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--rss-match", default="celery", help="command line pattern of worker processes")
+    parser.add_argument("--rss-pid", type=int, action="append", default=[], help="pid of worker process")
+    parser.add_argument("--serve", action="store_true", help="start API with eager tasks as stand-in")
+    parser.add_argument("--results-dir", help="directory of result files")
+    args = parser.parse_args()
+
+    process = serve(args) if args.serve else None
+    try:
+        metrics = asyncio.run(run(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("results_dir", "corpus_dir")}
+    path = write_result("e2e", config, metrics, *([args.results_dir] if args.results_dir else []))
+    for key, value in metrics.items():
+        print(f"{key}: {value}")
+    print(f"Result written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Micro benchmarks of conversion, probing and encoding helpers
+
+Usage: python -m app.benchmarks.micro [--repeat 20] [--classes small,medium]
+"""
+# Packages
+import os
+import argparse
+import tempfile
+import tracemalloc
+from typing import Callable, Dict
+
+# Modules
+from app.benchmarks.corpus import IMAGE_SIZES, generate_file
+from app.benchmarks.stats import summarize, timed, write_result
+from app.config import MAGICK_BYTES_PER_PIXEL
+from app.utils.conversion_profile import OutputFormat, get_conversion_profile
+from app.utils.helper import Helper
+from app.utils.probe_helper import ProbeHelper
+from app.utils.profiling_helper import MagickUsageSampler
+from app.utils.wand_helper import WandHelper
+
+# Conversions of small images take milliseconds, ImageMagick usage is
+# sampled more often than when profiling
+ALLOCATION_SAMPLE_INTERVAL = 0.001
+
+
+def measure(func: Callable[[], object], repeat: int, warmup: int = 1, size: int = None) -> Dict:
+    """
+    Measure function over repeated calls
+
+    Args:
+        func: function without arguments
+        repeat: number of measured calls
+        warmup: number of calls before measuring
+        size: bytes processed per call, adds throughput to the summary
+
+    Returns:
+        dict: summary of seconds per call
+    """
+    for _ in range(warmup):
+        func()
+    seconds = [timed(func)[0] for _ in range(repeat)]
+    summary = summarize(seconds)
+    if size and summary["p50"]:
+        summary["megabytes_per_s"] = round(size / summary["p50"] / 1e6, 3)
+    return summary
+
+
+def measure_allocations(func: Callable[[], object], warmup: int = 1) -> Dict:
+    """
+    Measure peak allocations of a call, Python objects traced by
+    tracemalloc and ImageMagick memory and map resources which tracemalloc
+    does not see
+
+    Args:
+        func: function without arguments
+        warmup: number of calls before measuring
+
+    Returns:
+        dict: peak bytes of Python and ImageMagick allocations
+    """
+    for _ in range(warmup):
+        func()
+    tracemalloc.start()
+    try:
+        with MagickUsageSampler(ALLOCATION_SAMPLE_INTERVAL) as sampler:
+            func()
+        python_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"python_peak_bytes": python_peak,
+            "magick_memory_peak_bytes": sampler.peaks["memory"],
+            "magick_map_peak_bytes": sampler.peaks["map"]}
+
+
+def run(args: argparse.Namespace) -> Dict:
+    """
+    Run micro benchmarks on generated png and jpeg inputs of every size class
+
+    Args:
+        args: command line arguments
+
+    Returns:
+        dict: summary per benchmark and input, allocations of conversions
+        along with the size of one decoded raster and of the output they
+        are expected to stay close to
+    """
+    profile = get_conversion_profile(args.profile)
+    metrics = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size_class in args.classes:
+            repeat = max(args.repeat // (4 if size_class == "large" else 1), 3)
+            for fmt in ("png", "jpeg"):
+                corpus_file = generate_file(args.corpus_dir, fmt, size_class)
+                key = f"{fmt}:{size_class}"
+                outputs = [(OutputFormat("png"), os.path.join(directory, f"{fmt}_{size_class}.png"))]
+
+                metrics[f"convert_file[{key}]"] = measure(
+                    lambda: WandHelper.convert_file(corpus_file.path, outputs, profile), repeat
+                )
+                allocations = measure_allocations(lambda: WandHelper.convert_file(corpus_file.path, outputs, profile))
+                allocations["decoded_raster_bytes"] = corpus_file.width * corpus_file.height * MAGICK_BYTES_PER_PIXEL
+                allocations["output_bytes"] = os.path.getsize(outputs[0][1])
+                metrics[f"convert_file_allocations[{key}]"] = allocations
+                metrics[f"get_resolution[{key}]"] = measure(
+                    lambda: WandHelper.get_resolution(corpus_file.path), args.repeat * 5
+                )
+                metrics[f"probe[{key}]"] = measure(
+                    lambda: ProbeHelper.probe(corpus_file.path), args.repeat * 5
+                )
+
+            data = Helper.read_file(corpus_file.path)
+            encoded = Helper.encode_bytes_to_base64_string(data)
+            metrics[f"base64_encode[jpeg:{size_class}]"] = measure(
+                lambda: Helper.encode_bytes_to_base64_string(data), args.repeat * 5, size=len(data)
+            )
+            metrics[f"base64_decode[jpeg:{size_class}]"] = measure(
+                lambda: Helper.decode_base64_string_to_bytes(encoded), args.repeat * 5, size=len(data)
+            )
+    return metrics
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="measured calls per benchmark")
+    parser.add_argument("--classes", default="small,medium,large", type=lambda value: value.split(","),
+                        help=f"size classes, of {', '.join(IMAGE_SIZES)}")
+    parser.add_argument("--profile", help="conversion profile, defaults to CONVERSION_PROFILE")
+    parser.add_argument("--corpus-dir", default=os.path.join(os.path.dirname(__file__), "corpus"))
+    parser.add_argument("--results-dir", help="directory of result files")
+    args = parser.parse_args()
+
+    metrics = run(args)
+    config = {"repeat": args.repeat, "classes": args.classes, "profile": args.profile}
+    path = write_result("micro", config, metrics, *([args.results_dir] if args.results_dir else []))
+    for key, value in metrics.items():
+        if "p50" in value:
+            print(f"{key}: p50 {value['p50']:.6f}s p95 {value['p95']:.6f}s")
+        else:
+            print(f"{key}: " + " ".join(f"{name} {count}" for name, count in value.items()))
+    print(f"Result written to {path}")
+
+
+if __name__ == "__main__":
+    main()
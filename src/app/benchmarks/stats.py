@@ -0,0 +1,221 @@
+"""Statistics, RSS sampling and result files shared by the benchmarks"""
+# Packages
+import os
+import json
+import time
+import socket
+import platform
+import threading
+import subprocess
+from datetime import datetime, timezone
+from typing import AnyStr, Dict, Iterable, List, Optional, Tuple
+
+RESULTS_DIR = os.getenv("BENCHMARK_RESULTS_DIR", os.path.join(os.path.dirname(__file__), "results"))
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Percentile of sorted values with linear interpolation
+
+    Args:
+        values: sorted values
+        q: percentile between 0 and 100
+
+    Returns:
+        float: percentile of values
+    """
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(values: Iterable[float]) -> Dict:
+    """
+    Summarize measurements
+
+    Args:
+        values: measurements, e.g. seconds
+
+    Returns:
+        dict: count, mean, min, max and percentiles of values
+    """
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+
+    summary = {"count": len(values), "mean": sum(values) / len(values), "min": values[0]}
+    for q in PERCENTILES:
+        summary[f"p{q}"] = percentile(values, q)
+    summary["max"] = values[-1]
+    return {key: round(value, 6) if isinstance(value, float) else value for key, value in summary.items()}
+
+
+def read_rss(pid: int) -> Tuple[int, int]:
+    """
+    Read resident set size of process
+
+    Args:
+        pid: process id
+
+    Returns:
+        tuple: current and peak (high water mark) RSS in bytes, zeros if
+        the process is gone
+    """
+    rss = peak = 0
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return rss, peak
+
+
+def find_pids(pattern: str) -> List[int]:
+    """
+    Find processes whose command line contains pattern
+
+    Args:
+        pattern: substring of command line, e.g. "celery"
+
+    Returns:
+        list: process ids, excluding this process
+    """
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as cmdline:
+                if pattern.encode() in cmdline.read().replace(b"\0", b" "):
+                    pids.append(int(entry))
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return pids
+
+
+class RssSampler:
+    """
+    Samples RSS of matching processes in a background thread. Processes
+    are looked up on every sample, so forked and restarted workers are
+    included.
+    """
+
+    def __init__(self, pattern: str = None, pids: List[int] = None, interval: float = 0.5):
+        self._pattern = pattern
+        self._pids = pids or []
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._peak_total = 0
+        self._peaks: Dict[int, int] = {}
+
+    def start(self) -> "RssSampler":
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Dict:
+        """
+        Stop sampling
+
+        Returns:
+            dict: peak RSS summed over processes, peak RSS of the largest
+            process and number of processes seen
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+        return {"peak_total_rss_bytes": self._peak_total,
+                "peak_process_rss_bytes": max(self._peaks.values(), default=0),
+                "processes": len(self._peaks)}
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            self._sample()
+
+    def _sample(self) -> None:
+        pids = set(self._pids)
+        if self._pattern:
+            pids.update(find_pids(self._pattern))
+
+        total = 0
+        for pid in pids:
+            rss, peak = read_rss(pid)
+            total += rss
+            if rss or peak:
+                self._peaks[pid] = max(self._peaks.get(pid, 0), rss, peak)
+        self._peak_total = max(self._peak_total, total)
+
+
+def git_revision() -> Dict:
+    """
+    Get commit of working tree the benchmark ran on
+
+    Returns:
+        dict: commit hash and whether the tree has local changes, None if
+        git is not available
+    """
+    def git(*args: str) -> AnyStr:
+        return subprocess.run(["git", *args], cwd=os.path.dirname(__file__), capture_output=True,
+                              text=True, check=True).stdout.strip()
+
+    try:
+        return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def write_result(benchmark: str, config: Dict, metrics: Dict, directory: str = RESULTS_DIR) -> AnyStr:
+    """
+    Write machine readable result of benchmark, named after time and commit
+    so results of consecutive commits sort next to each other
+
+    Args:
+        benchmark: name of benchmark
+        config: parameters of the run
+        metrics: measurements
+        directory: directory of result files
+
+    Returns:
+        AnyStr: path of result file
+    """
+    revision = git_revision()
+    started = datetime.now(timezone.utc)
+    result = {"benchmark": benchmark,
+              "timestamp": started.isoformat(),
+              **revision,
+              "host": {"name": socket.gethostname(), "platform": platform.platform(),
+                       "python": platform.python_version(), "cpus": os.cpu_count()},
+              "config": config,
+              "metrics": metrics}
+
+    os.makedirs(directory, exist_ok=True)
+    commit = (revision["commit"] or "unknown")[:10]
+    path = os.path.join(directory, f"{benchmark}-{started.strftime('%Y%m%dT%H%M%S')}-{commit}.json")
+    with open(path, "w") as file:
+        json.dump(result, file, indent=2)
+    return path
+
+
+def timed(func, *args, **kwargs) -> Tuple[float, object]:
+    """
+    Call function and measure its duration
+
+    Args:
+        func: function to call
+        *args: arguments of function
+        **kwargs: keyword arguments of function
+
+    Returns:
+        tuple: seconds and return value of function
+    """
+    started = time.perf_counter()
+    value = func(*args, **kwargs)
+    return time.perf_counter() - started, value
@@ -1,6 +1,118 @@
 # Packages
 import os
+import multiprocessing
 
 ALLOWED_EXTENSIONS = ["png", "jpeg", "jpg", "pdf"]
 STATIC_FILES_DIR = os.getenv("STATIC_FILES_DIR", "scratch")
 CONVERTED_IMAGE_RESOLUTION = os.getenv("CONVERTED_IMAGE_RESOLUTION", "3500x3500")
+# Conversion profile: target pixel size (empty keeps the original size),
+# resize mode (fit, fill, exact) and resampling filter override
+CONVERSION_PROFILE = os.getenv("CONVERSION_PROFILE", "quality")
+CONVERTED_IMAGE_SIZE = os.getenv("CONVERTED_IMAGE_SIZE") or None
+RESIZE_MODE = os.getenv("RESIZE_MODE", "fit")
+RESAMPLING_FILTER = os.getenv("RESAMPLING_FILTER") or None
+# Output formats written from one decode, e.g. "webp:80,png" (quality of lossy formats)
+OUTPUT_FORMAT_CHOICES = ["png", "jpeg", "webp", "avif"]
+OUTPUT_FORMATS = os.getenv("OUTPUT_FORMATS", "png")
+OUTPUT_QUALITY = int(os.getenv("OUTPUT_QUALITY", 85))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_STATUS_BATCH_SIZE = int(os.getenv("MAX_STATUS_BATCH_SIZE", 1000))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 4))
+FUSED_PROCESSING = os.getenv("FUSED_PROCESSING", "true").lower() == "true"
+CONTENT_HASH_ALGORITHM = os.getenv("CONTENT_HASH_ALGORITHM", "sha256")
+# Tasks are prioritized by estimated cost (bytes x pages): jobs up to SMALL_JOB_COST
+# get QUEUE_MAX_PRIORITY - 1, every 4x more cost one level less. Tenants lose one
+# more level every time their in-flight files double beyond TENANT_FAIR_SHARE.
+QUEUE_MAX_PRIORITY = int(os.getenv("QUEUE_MAX_PRIORITY", 10))
+SMALL_JOB_COST = int(os.getenv("SMALL_JOB_COST", 1024 * 1024))
+TENANT_FAIR_SHARE = int(os.getenv("TENANT_FAIR_SHARE", 20))
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+# Images up to BATCH_MAX_PIXELS are converted in batches of up to BATCH_SIZE,
+# a batch waits at most BATCH_MAX_WAIT_MS for more images. BATCH_SIZE 1 disables batching.
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 16))
+BATCH_MAX_WAIT_MS = int(os.getenv("BATCH_MAX_WAIT_MS", 100))
+BATCH_MAX_PIXELS = int(os.getenv("BATCH_MAX_PIXELS", 1024 * 1024))
+# Queues consumed by the worker, see inotify-restart-celery.sh
+WORKER_QUEUES = os.getenv("CELERY_QUEUES", "celery,ingest,convert,batch,pdf").split(",")
+EXECUTOR_MAX_WORKERS = int(os.getenv("EXECUTOR_MAX_WORKERS", 4))
+# Metrics of processes forked by gunicorn or the prefork pool are aggregated
+# through PROMETHEUS_MULTIPROC_DIR, workers export them on WORKER_METRICS_PORT (0 disables)
+METRICS_MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 9808))
+# Opt-in profiling: traces are written to PROFILE_DIR. PROFILE_SAMPLE_RATE is the share of
+# tasks profiled from worker start, admin routes and the X-Profile header need ADMIN_TOKEN.
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 2))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+# Connections of a worker process, defaults to the tasks it runs at once
+WORKER_DB_POOL_SIZE = int(os.getenv("WORKER_DB_POOL_SIZE", 0))
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", 10))
+ASYNC_DB_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", 20))
+EVENTS_HEARTBEAT_INTERVAL = int(os.getenv("EVENTS_HEARTBEAT_INTERVAL", 15))
+# Responses of completed files are cached until evicted, others for FILE_CACHE_TTL seconds
+FILE_CACHE_SIZE = int(os.getenv("FILE_CACHE_SIZE", 10000))
+FILE_CACHE_TTL = float(os.getenv("FILE_CACHE_TTL", 5))
+# Delivery of stored files: "direct" streams them from the app (zero-copy when the
+# server supports it), "x-accel-redirect" or "x-sendfile" hand them to a fronting proxy
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "direct")
+DELIVERY_ACCEL_PREFIX = os.getenv("DELIVERY_ACCEL_PREFIX", "/protected")
+DELIVERY_MAX_AGE = int(os.getenv("DELIVERY_MAX_AGE", 365 * 24 * 3600))
+# Storage of originals and outputs, paths of files are storage URIs. "local" keeps them in
+# STATIC_FILES_DIR (file:///...), a volume shared by API and workers. "s3" keeps them in
+# S3_BUCKET (s3://...) of AWS or an S3 compatible store at S3_ENDPOINT_URL (e.g. MinIO),
+# credentials are read from the usual AWS_* variables.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+S3_BUCKET = os.getenv("S3_BUCKET", "image-converter")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+# Connections of a process, shared by its tasks and their transfer threads
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 32))
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv("S3_MULTIPART_CHUNK_SIZE", 8 * 1024 * 1024))
+S3_TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", 4))
+# Objects read from S3 are kept on local disk, least recently used ones are
+# removed once the cache outgrows STORAGE_CACHE_SIZE bytes
+STORAGE_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR", "/tmp/storage-cache")
+STORAGE_CACHE_SIZE = int(os.getenv("STORAGE_CACHE_SIZE", 4 * 1024 ** 3))
+# Derivatives (thumbnails, previews) are rendered on request into a size bounded LRU cache
+DERIVATIVE_FORMATS = ["png", "jpeg", "webp"]
+DERIVATIVE_CACHE_DIR = os.getenv("DERIVATIVE_CACHE_DIR", os.path.join(STATIC_FILES_DIR, "derivatives"))
+DERIVATIVE_CACHE_SIZE = int(os.getenv("DERIVATIVE_CACHE_SIZE", 1024 ** 3))
+DERIVATIVE_MAX_SIZE = int(os.getenv("DERIVATIVE_MAX_SIZE", 4096))
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", 85))
+# Internal location of DERIVATIVE_CACHE_DIR in x-accel-redirect mode. Without it derivatives
+# outside STATIC_FILES_DIR are sent by the app.
+DELIVERY_DERIVATIVE_ACCEL_PREFIX = os.getenv("DELIVERY_DERIVATIVE_ACCEL_PREFIX") or None
+
+# ImageMagick resources, sizes are in bytes. Q16 builds keep 4 channels of
+# 16 bits per pixel in the pixel cache.
+MAGICK_BYTES_PER_PIXEL = 8
+WORKER_MEMORY_BUDGET = int(os.getenv("WORKER_MEMORY_BUDGET", 2 * 1024 ** 3))
+IMAGE_PIXEL_BUDGET = int(os.getenv("IMAGE_PIXEL_BUDGET", 3500 * 3500))
+LARGE_IMAGE_PIXELS = int(os.getenv("LARGE_IMAGE_PIXELS", 50 * 1000 * 1000))
+MAGICK_DISK_LIMIT = int(os.getenv("MAGICK_DISK_LIMIT", 16 * 1024 ** 3))
+MAGICK_THREAD_LIMIT = int(os.getenv("MAGICK_THREAD_LIMIT", 1))
+MAGICK_TEMPORARY_PATH = os.getenv("MAGICK_TEMPORARY_PATH", "/tmp")
+# Conversions running at once per worker, each gets an equal share of the budget
+CONVERSION_SLOTS = int(os.getenv("CONVERSION_SLOTS", 0)) or max(1, min(
+    multiprocessing.cpu_count(),
+    WORKER_MEMORY_BUDGET // (IMAGE_PIXEL_BUDGET * MAGICK_BYTES_PER_PIXEL)
+))
+# Celery execution pool. Tasks of a threads pool overlap their database, storage
+# and broker I/O with the conversions of others, Wand releases the GIL in ImageMagick.
+# A prefork pool runs one task per child process, every child gets an equal share of
+# WORKER_MEMORY_BUDGET and a single conversion slot.
+WORKER_POOL = os.getenv("WORKER_POOL", "threads")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 0)) or (
+    CONVERSION_SLOTS if WORKER_POOL == "prefork" else CONVERSION_SLOTS * 4
+)
+WORKER_PROCESSES = WORKER_CONCURRENCY if WORKER_POOL == "prefork" else 1
+PROCESS_MEMORY_BUDGET = WORKER_MEMORY_BUDGET // WORKER_PROCESSES
+PROCESS_CONVERSION_SLOTS = 1 if WORKER_POOL == "prefork" else CONVERSION_SLOTS
+IMAGE_MEMORY_LIMIT = PROCESS_MEMORY_BUDGET // PROCESS_CONVERSION_SLOTS
+# pigz threads of one png, each conversion slot gets an equal share of the cores
+PARALLEL_DEFLATE_THREADS = int(os.getenv("PARALLEL_DEFLATE_THREADS", 0)) or max(
+    1, multiprocessing.cpu_count() // (WORKER_PROCESSES * PROCESS_CONVERSION_SLOTS)
+)
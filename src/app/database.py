@@ -1,31 +1,68 @@
 import os
 import urllib.parse
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator
 
 from sqlalchemy.orm import DeclarativeMeta, sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.engine import create_engine
 
+from app.config import ASYNC_DB_POOL_SIZE, ASYNC_DB_MAX_OVERFLOW, DB_POOL_SIZE, DB_MAX_OVERFLOW
+
 
 class DatabaseInstance:
     _base: DeclarativeMeta = None
+    _engine = None
 
     def __init__(self):
         self._base = declarative_base()
-        self._engine = create_engine(
-            self.get_database_url(),
-            max_overflow=20,
+        self.configure_engine(DB_POOL_SIZE, DB_MAX_OVERFLOW)
+
+        # asyncpg engine used by the request handlers running on the event loop
+        self._async_engine = create_async_engine(
+            self.get_database_url(driver="postgresql+asyncpg", with_ssl_mode=False),
+            max_overflow=ASYNC_DB_MAX_OVERFLOW,
             pool_recycle=3600,
-            pool_size=2,
-            pool_pre_ping=True
+            pool_size=ASYNC_DB_POOL_SIZE,
+            pool_pre_ping=True,
+            connect_args={"ssl": os.getenv("POSTGRES_SSLMODE", "prefer")},
+        )
+        self._async_session_maker = sessionmaker(
+            bind=self._async_engine, class_=AsyncSession, expire_on_commit=False
         )
-        self._session_maker = sessionmaker(autocommit=False, bind=self._engine)
 
     @property
     def base(self) -> DeclarativeMeta:
         return self._base
 
+    def configure_engine(self, pool_size: int, max_overflow: int, dispose: bool = True) -> None:
+        """
+        Create the sync engine with a pool of given size. Workers size it to
+        the tasks a process runs at once.
+
+        Args:
+            pool_size: number of pooled connections
+            max_overflow: connections allowed beyond pool_size
+            dispose: close connections of the previous engine, must be False
+                in forked processes whose connections belong to the parent
+        """
+        if self._engine is not None and dispose:
+            self._engine.dispose()
+
+        self._engine = create_engine(
+            self.get_database_url(),
+            max_overflow=max_overflow,
+            pool_recycle=3600,
+            pool_size=pool_size,
+            pool_pre_ping=True,
+            # executemany of updates and inserts is sent in pages, not row by row
+            executemany_mode="values_plus_batch",
+        )
+        self._session_maker = sessionmaker(autocommit=False, bind=self._engine)
+
     @staticmethod
-    def get_database_url() -> str:
+    def get_database_url(driver: str = "postgresql", with_ssl_mode: bool = True) -> str:
         db_name = os.getenv("POSTGRES_DB")
         db_host = os.getenv("POSTGRES_HOST")
         db_port = os.getenv("POSTGRES_PORT")
@@ -34,10 +71,39 @@ class DatabaseInstance:
         db_user = urllib.parse.quote(os.getenv("POSTGRES_USER"))
         db_password = urllib.parse.quote(os.getenv("POSTGRES_PASSWORD"))
 
-        return f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}?sslmode={db_ssl_mode}"
+        url = f"{driver}://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+        if with_ssl_mode:
+            url = f"{url}?sslmode={db_ssl_mode}"
+        return url
 
     def initialize_session(self) -> Session:
         return self._session_maker()
 
+    @contextmanager
+    def session_scope(self) -> Iterator[Session]:
+        """Session committed on success, rolled back on error and always closed"""
+        session = self._session_maker()
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_session(self) -> Iterator[Session]:
+        """Session dependency which is closed once the request is served"""
+        session = self._session_maker()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    async def initialize_async_session(self) -> AsyncIterator[AsyncSession]:
+        """Async session dependency which is closed once the request is served"""
+        async with self._async_session_maker() as session:
+            yield session
+
 
 db_instance = DatabaseInstance()
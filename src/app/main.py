@@ -1,7 +1,10 @@
 # Packages
+import hmac
+import time
+import threading
 from traceback import print_exception
 from fastapi import FastAPI, Request, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.routing import APIRoute
 from fastapi.middleware import Middleware
 from fastapi.staticfiles import StaticFiles
@@ -11,11 +14,19 @@ from sqlalchemy import create_engine
 
 # Modules
 from app.utils.helper import ReturnValue
-from app.config import STATIC_FILES_DIR
+from app.config import STATIC_FILES_DIR, ADMIN_TOKEN
 from app.apis.apis import router
 from app.database import db_instance
 from app.workers.celery import celery_app
 from app.workers.tasks import run_test_task
+from app.workers.events import event_subscriber
+from app.usecases.files import FilesUsecase
+from app.utils.cache_helper import file_cache
+from app.utils.metrics_helper import MetricsHelper, QueueDepthCollector, IN_FLIGHT
+from app.utils.profiling_helper import ProfilingHelper, PROFILE_HEADER
+
+# One profiled request per process, others requesting a profile meanwhile run unprofiled
+profile_lock = threading.Lock()
 
 
 async def root():
@@ -49,6 +60,17 @@ async def celery_send_test_task():
     return "Check worker_1 logs."
 
 
+async def cache_stats():
+    """Hit, miss and eviction counters of the file response cache of this process"""
+    return file_cache.stats()
+
+
+def metrics():
+    """Prometheus metrics of API processes, along with depth of broker queues"""
+    body, content_type = MetricsHelper.render()
+    return Response(body, media_type=content_type)
+
+
 async def healthcheck():
     """Basic healthcheck endpoint.
     Connects to DB for alembic version string and pings Celery worker(s) for 'pong' alive response.
@@ -64,6 +86,32 @@ async def healthcheck():
     return health_response
 
 
+async def metrics_middleware(request: Request, call_next):
+    request.state.started_at = time.perf_counter()
+    IN_FLIGHT.labels("request").inc()
+    try:
+        return await call_next(request)
+    finally:
+        IN_FLIGHT.labels("request").dec()
+
+
+async def profiling_middleware(request: Request, call_next):
+    token = request.headers.get(PROFILE_HEADER)
+    if not ADMIN_TOKEN or not token or not hmac.compare_digest(token, ADMIN_TOKEN) \
+            or not profile_lock.acquire(blocking=False):
+        return await call_next(request)
+
+    # the event loop thread is profiled, along with other requests it serves meanwhile
+    try:
+        with ProfilingHelper.profile("request", f"{request.method} {request.url.path}",
+                                     ProfilingHelper.find_file_id(request.url.path)) as summary:
+            response = await call_next(request)
+            summary["status_code"] = response.status_code
+        return response
+    finally:
+        profile_lock.release()
+
+
 async def catch_exceptions_middleware(request: Request, call_next):
     try:
         return await call_next(request)
@@ -79,6 +127,8 @@ routes = [
     APIRoute("/", endpoint=root, methods=["GET"]),
     APIRoute("/health", endpoint=healthcheck, methods=["GET"]),
     APIRoute("/test-task", endpoint=celery_send_test_task, methods=["GET"]),
+    APIRoute("/cache-stats", endpoint=cache_stats, methods=["GET"]),
+    APIRoute("/metrics", endpoint=metrics, methods=["GET"]),
 ]
 
 middleware = Middleware(CORSMiddleware)
@@ -91,5 +141,15 @@ app.mount("/static", StaticFiles(directory=STATIC_FILES_DIR), name="static")
 # Including router endpoints
 app.include_router(router)
 
+# Consuming worker status events for streaming endpoints and cache invalidation
+event_subscriber.add_listener(FilesUsecase.invalidate_cache)
+app.add_event_handler("startup", event_subscriber.start)
+app.add_event_handler("shutdown", event_subscriber.stop)
+
+# Depth of broker queues is read on scrape
+MetricsHelper.register(QueueDepthCollector(celery_app, [queue.name for queue in celery_app.conf.task_queues]))
+
 # Adding custom exception as middleware
 app.middleware('http')(catch_exceptions_middleware)
+app.middleware('http')(profiling_middleware)
+app.middleware('http')(metrics_middleware)
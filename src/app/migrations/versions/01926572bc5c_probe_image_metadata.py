@@ -0,0 +1,28 @@
+"""Probe image metadata on upload
+
+Revision ID: 01926572bc5c
+Revises: a2d9b10b6c6f
+Create Date: 2026-10-18 17:08:04.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "01926572bc5c"
+down_revision = "a2d9b10b6c6f"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("width", "height", "page_count")
+
+
+def upgrade():
+    columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("files")}
+    for name in COLUMNS:
+        if name not in columns:
+            op.add_column("files", sa.Column(name, sa.Integer))
+
+
+def downgrade():
+    for name in COLUMNS:
+        op.drop_column("files", name)
@@ -0,0 +1,50 @@
+"""Conversion profiles and output dimensions
+
+Revision ID: 073f6464108f
+Revises: 01926572bc5c
+Create Date: 2026-10-18 17:08:04.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "073f6464108f"
+down_revision = "01926572bc5c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    files_columns = {column["name"] for column in inspector.get_columns("files")}
+    for column in (sa.Column("output_width", sa.Integer),
+                   sa.Column("output_height", sa.Integer),
+                   sa.Column("output_profile", sa.Text)):
+        if column.name not in files_columns:
+            op.add_column("files", column)
+
+    conversions_columns = {column["name"] for column in inspector.get_columns("conversions")}
+    if "profile" not in conversions_columns:
+        # conversions of earlier releases match no profile and are only released
+        op.add_column("conversions", sa.Column("profile", sa.Text, nullable=False, server_default=""))
+        op.alter_column("conversions", "profile", server_default=None)
+    for name in ("output_width", "output_height"):
+        if name not in conversions_columns:
+            op.add_column("conversions", sa.Column(name, sa.Integer))
+
+    constraints = {constraint["name"] for constraint in inspector.get_unique_constraints("conversions")}
+    if "conversions_content_hash_resolution_format_key" in constraints:
+        op.drop_constraint("conversions_content_hash_resolution_format_key", "conversions")
+    if "conversions_content_hash_resolution_format_profile_key" not in constraints:
+        op.create_unique_constraint("conversions_content_hash_resolution_format_profile_key", "conversions",
+                                    ["content_hash", "resolution", "format", "profile"])
+
+
+def downgrade():
+    op.drop_constraint("conversions_content_hash_resolution_format_profile_key", "conversions")
+    op.create_unique_constraint("conversions_content_hash_resolution_format_key", "conversions",
+                                ["content_hash", "resolution", "format"])
+    for name in ("output_height", "output_width", "profile"):
+        op.drop_column("conversions", name)
+    for name in ("output_profile", "output_height", "output_width"):
+        op.drop_column("files", name)
@@ -0,0 +1,27 @@
+"""Tenant of files for fair-share priorities
+
+Revision ID: 24cd33f12050
+Revises: 8ab077f5c2b9
+Create Date: 2026-10-18 17:08:04.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "24cd33f12050"
+down_revision = "8ab077f5c2b9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "tenant_id" not in {column["name"] for column in inspector.get_columns("files")}:
+        op.add_column("files", sa.Column("tenant_id", sa.Text))
+    if "ix_files_tenant_id_status" not in {index["name"] for index in inspector.get_indexes("files")}:
+        op.create_index("ix_files_tenant_id_status", "files", ["tenant_id", "status"])
+
+
+def downgrade():
+    op.drop_index("ix_files_tenant_id_status", table_name="files")
+    op.drop_column("files", "tenant_id")
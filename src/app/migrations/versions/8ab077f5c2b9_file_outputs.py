@@ -0,0 +1,43 @@
+"""Outputs of files, one per format
+
+Revision ID: 8ab077f5c2b9
+Revises: b1f208ec7bb9
+Create Date: 2026-10-18 17:08:04.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "8ab077f5c2b9"
+down_revision = "b1f208ec7bb9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table("file_outputs"):
+        return
+
+    op.create_table(
+        "file_outputs",
+        sa.Column(
+            "id",
+            postgresql.UUID,
+            primary_key=True,
+            server_default=sa.text("uuid_generate_v4()"),
+        ),
+        sa.Column("file_id", postgresql.UUID, sa.ForeignKey("files.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("format", sa.Text, nullable=False),
+        sa.Column("quality", sa.Integer),
+        sa.Column("path", sa.Text, nullable=False),
+        sa.Column("resolution", sa.Text),
+        sa.Column("width", sa.Integer),
+        sa.Column("height", sa.Integer),
+        sa.Column("profile", sa.Text),
+        sa.UniqueConstraint("file_id", "format", name="file_outputs_file_id_format_key"),
+    )
+
+
+def downgrade():
+    op.drop_table("file_outputs")
@@ -0,0 +1,60 @@
+"""Deduplicate uploads by content hash
+
+Revision ID: a2d9b10b6c6f
+Revises: c4f1de9fd1e1
+Create Date: 2026-10-18 17:08:04.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "a2d9b10b6c6f"
+down_revision = "c4f1de9fd1e1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # importing the models runs create_all, so tables and columns new to
+    # this revision may exist already and are only created when missing
+    inspector = sa.inspect(op.get_bind())
+    if "content_hash" not in {column["name"] for column in inspector.get_columns("files")}:
+        op.add_column("files", sa.Column("content_hash", sa.Text))
+    if "ix_files_content_hash" not in {index["name"] for index in inspector.get_indexes("files")}:
+        op.create_index("ix_files_content_hash", "files", ["content_hash"])
+
+    if not inspector.has_table("blobs"):
+        op.create_table(
+            "blobs",
+            sa.Column("content_hash", sa.Text, primary_key=True),
+            sa.Column("path", sa.Text, nullable=False),
+            sa.Column("ref_count", sa.Integer, nullable=False),
+        )
+
+    if not inspector.has_table("conversions"):
+        op.create_table(
+            "conversions",
+            sa.Column(
+                "id",
+                postgresql.UUID,
+                primary_key=True,
+                server_default=sa.text("uuid_generate_v4()"),
+            ),
+            sa.Column("content_hash", sa.Text, nullable=False),
+            sa.Column("resolution", sa.Text, nullable=False),
+            sa.Column("format", sa.Text, nullable=False),
+            sa.Column("output_path", sa.Text, nullable=False),
+            sa.Column("ref_count", sa.Integer, nullable=False),
+            sa.UniqueConstraint(
+                "content_hash", "resolution", "format",
+                name="conversions_content_hash_resolution_format_key",
+            ),
+        )
+
+
+def downgrade():
+    op.drop_table("conversions")
+    op.drop_table("blobs")
+    op.drop_index("ix_files_content_hash", table_name="files")
+    op.drop_column("files", "content_hash")
@@ -0,0 +1,23 @@
+"""Index pages of pdf files
+
+Revision ID: b1f208ec7bb9
+Revises: 073f6464108f
+Create Date: 2026-10-18 17:08:04.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "b1f208ec7bb9"
+down_revision = "073f6464108f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if "ix_files_pdf_id_page_num" not in {index["name"] for index in sa.inspect(op.get_bind()).get_indexes("files")}:
+        op.create_index("ix_files_pdf_id_page_num", "files", ["pdf_id", "page_num"])
+
+
+def downgrade():
+    op.drop_index("ix_files_pdf_id_page_num", table_name="files")
@@ -2,7 +2,7 @@
 from uuid import uuid4
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy import text as sqlalchemy_text
-from sqlalchemy import Column, Text, ForeignKey
+from sqlalchemy import Column, Text, ForeignKey, Integer, Index, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy_utils import ChoiceType
 
@@ -33,6 +33,12 @@ FILE_TYPE = [
 
 class FilesTable(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        # child lookups of pdf files
+        Index("ix_files_pdf_id_page_num", "pdf_id", "page_num"),
+        # in-flight files of tenant for fair-share priorities
+        Index("ix_files_tenant_id_status", "tenant_id", "status"),
+    )
 
     id = Column(
         UUID,
@@ -44,9 +50,70 @@ class FilesTable(Base):
     path = Column(Text)
     type = Column(ChoiceType(FILE_TYPE), nullable=False)
     resolution = Column(Text)
+    width = Column(Integer)
+    height = Column(Integer)
+    page_count = Column(Integer)
     status = Column(ChoiceType(STATUS_TYPES), nullable=False, default="uploading")
     output_path = Column(Text)
     output_resolution = Column(Text)
+    output_width = Column(Integer)
+    output_height = Column(Integer)
+    output_profile = Column(Text)
     page_num = Column(Text)
     pdf_id = Column(UUID, ForeignKey("files.id"))
+    content_hash = Column(Text, index=True)
+    tenant_id = Column(Text)
     files = relationship("FilesTable", backref=backref("parent", remote_side="FilesTable.id"))
+    outputs = relationship("FileOutputsTable", cascade="all, delete-orphan", passive_deletes=True)
+
+
+class FileOutputsTable(Base):
+    """Encoded outputs of a file, one per format. The first requested format
+    is also recorded in the output columns of the file."""
+    __tablename__ = "file_outputs"
+    __table_args__ = (UniqueConstraint("file_id", "format"),)
+
+    id = Column(
+        UUID,
+        primary_key=True,
+        default=string_uuid,
+        server_default=sqlalchemy_text("uuid_generate_v4()"),
+    )
+    file_id = Column(UUID, ForeignKey("files.id", ondelete="CASCADE"), nullable=False)
+    format = Column(Text, nullable=False)
+    quality = Column(Integer)
+    path = Column(Text, nullable=False)
+    resolution = Column(Text)
+    width = Column(Integer)
+    height = Column(Integer)
+    profile = Column(Text)
+
+
+class BlobsTable(Base):
+    """Content addressed originals shared by files with identical content"""
+    __tablename__ = "blobs"
+
+    content_hash = Column(Text, primary_key=True)
+    path = Column(Text, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+
+
+class ConversionsTable(Base):
+    """Converted outputs keyed by content hash, resolution, format and profile"""
+    __tablename__ = "conversions"
+    __table_args__ = (UniqueConstraint("content_hash", "resolution", "format", "profile"),)
+
+    id = Column(
+        UUID,
+        primary_key=True,
+        default=string_uuid,
+        server_default=sqlalchemy_text("uuid_generate_v4()"),
+    )
+    content_hash = Column(Text, nullable=False)
+    resolution = Column(Text, nullable=False)
+    format = Column(Text, nullable=False)
+    profile = Column(Text, nullable=False)
+    output_path = Column(Text, nullable=False)
+    output_width = Column(Integer)
+    output_height = Column(Integer)
+    ref_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,40 @@
+# Packages
+from typing import Optional
+from fastapi import status
+
+# Modules
+from app.utils.helper import ReturnValue
+from app.workers.celery import celery_app
+
+CONTROL_REPLY_TIMEOUT = 1.0
+
+
+class AdminUsecase:
+    """
+    This class implements runtime switches of workers
+    """
+
+    @staticmethod
+    def set_profiling(rate: float, duration: Optional[float] = None) -> ReturnValue:
+        """
+        Profile share of tasks on every worker through the set_profiling
+        control command
+
+        Args:
+            rate: share of tasks between 0 (off) and 1 (every task)
+            duration: seconds after which profiling switches off, None for no limit
+
+        Returns:
+            ReturnValue: replies of workers by worker name
+        """
+        if not 0 <= rate <= 1:
+            return ReturnValue(False, status.HTTP_400_BAD_REQUEST, "Rate must be between 0 and 1")
+
+        arguments = {"rate": rate, **({"duration": duration} if duration else {})}
+        replies = celery_app.control.broadcast(
+            "set_profiling", arguments=arguments, reply=True, timeout=CONTROL_REPLY_TIMEOUT
+        )
+        data = {worker: reply for item in replies or [] for worker, reply in item.items()}
+        if not data:
+            return ReturnValue(False, status.HTTP_503_SERVICE_UNAVAILABLE, "No worker replied")
+        return ReturnValue(True, status.HTTP_200_OK, "Profiling updated", data=data)
@@ -0,0 +1,172 @@
+# Packages
+import os
+import mimetypes
+from typing import Callable, Mapping, Optional
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.responses import Response
+
+# Modules
+from app.utils.helper import ReturnValue
+from app.utils.async_helper import AsyncHelper
+from app.utils.delivery_helper import DeliveryHelper, SendfileResponse, StorageResponse
+from app.utils.storage_helper import StorageHelper, StorageStat
+from app.config import (
+    STATIC_FILES_DIR, DERIVATIVE_CACHE_DIR, DELIVERY_MODE, DELIVERY_ACCEL_PREFIX,
+    DELIVERY_DERIVATIVE_ACCEL_PREFIX, DELIVERY_MAX_AGE,
+)
+
+# Not known to the mimetypes module of older python versions
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+# Directories of served files and their internal locations in x-accel-redirect mode
+ACCEL_ROOTS = [(STATIC_FILES_DIR, DELIVERY_ACCEL_PREFIX), (DERIVATIVE_CACHE_DIR, DELIVERY_DERIVATIVE_ACCEL_PREFIX)]
+
+
+class DeliveryUsecase:
+    """
+    This class implements delivery of stored originals and converted outputs
+    """
+
+    @staticmethod
+    def _error(status_code: int, message: str, headers: Mapping = None) -> JSONResponse:
+        rv = ReturnValue(False, status_code, message)
+        return JSONResponse(rv.to_dict(), status_code=status_code, headers=headers)
+
+    @staticmethod
+    async def get_file(file_name: str, headers: Mapping, method: str = "GET") -> Response:
+        """
+        Serve file of storage by name, from STATIC_FILES_DIR or from the
+        object store of STORAGE_BACKEND
+
+        Args:
+            file_name: name of file in storage
+            headers: request headers
+            method: request method, HEAD responses have no body
+
+        Returns:
+            Response: file, partial file or not modified response
+        """
+        if os.path.basename(file_name) != file_name or file_name.startswith("."):
+            return DeliveryUsecase._error(status.HTTP_404_NOT_FOUND, "File not found")
+
+        if StorageHelper.is_local():
+            return DeliveryUsecase.serve_file(os.path.join(STATIC_FILES_DIR, file_name), headers, method)
+        return await DeliveryUsecase.serve_object(StorageHelper.get_uri(file_name), headers, method)
+
+    @staticmethod
+    def serve_file(file_path: str, headers: Mapping, method: str = "GET") -> Response:
+        """
+        Serve file with etag validation and byte ranges. The body is sent
+        with sendfile, or left to the fronting proxy in the x-accel-redirect
+        and x-sendfile delivery modes.
+
+        Args:
+            file_path: path of file below STATIC_FILES_DIR or DERIVATIVE_CACHE_DIR
+            headers: request headers
+            method: request method, HEAD responses have no body
+
+        Returns:
+            Response: file, partial file or not modified response
+        """
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return DeliveryUsecase._error(status.HTTP_404_NOT_FOUND, "File not found")
+
+        return DeliveryUsecase._respond(
+            os.path.basename(file_path), stat, headers, method,
+            lambda *args: SendfileResponse(file_path, *args), file_path
+        )
+
+    @staticmethod
+    async def serve_object(uri: str, headers: Mapping, method: str = "GET") -> Response:
+        """
+        Serve object of remote storage with etag validation and byte ranges.
+        The body is streamed with a ranged read of the requested bytes.
+
+        Args:
+            uri: storage uri of object
+            headers: request headers
+            method: request method, HEAD responses have no body
+
+        Returns:
+            Response: object, partial object or not modified response
+        """
+        try:
+            stat = await AsyncHelper.run_in_executor(StorageHelper.stat, uri)
+        except FileNotFoundError:
+            return DeliveryUsecase._error(status.HTTP_404_NOT_FOUND, "File not found")
+
+        return DeliveryUsecase._respond(
+            os.path.basename(uri), stat, headers, method,
+            lambda *args: StorageResponse(uri, *args)
+        )
+
+    @staticmethod
+    def _respond(
+            file_name: str,
+            stat: StorageStat,
+            headers: Mapping,
+            method: str,
+            body: Callable[..., Response],
+            file_path: Optional[str] = None
+    ) -> Response:
+        """
+        Answer conditional and range requests of stored file
+
+        Args:
+            file_name: name of file
+            stat: size and modification time of file
+            headers: request headers
+            method: request method, HEAD responses have no body
+            body: builds response of offset, count, status code, headers and send_body
+            file_path: local path of file, proxy delivery modes need it
+
+        Returns:
+            Response: file, partial file or not modified response
+        """
+        etag = DeliveryHelper.get_etag(file_name, stat)
+        if DeliveryHelper.is_content_addressed(file_name):
+            cache_control = f"public, max-age={DELIVERY_MAX_AGE}, immutable"
+        else:
+            cache_control = "public, no-cache"
+        response_headers = {"etag": etag, "cache-control": cache_control, "accept-ranges": "bytes"}
+
+        if DeliveryHelper.etag_matches(headers.get("if-none-match"), etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=response_headers)
+
+        response_headers["content-type"] = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        accel_path = None
+        if file_path and DELIVERY_MODE == "x-accel-redirect":
+            accel_path = DeliveryHelper.get_accel_path(file_path, ACCEL_ROOTS)
+        if accel_path:
+            # nginx serves the internal location, including ranges, files
+            # outside of its locations are sent below
+            response_headers["x-accel-redirect"] = accel_path
+            return Response(headers=response_headers)
+        if file_path and DELIVERY_MODE == "x-sendfile":
+            response_headers["x-sendfile"] = os.path.abspath(file_path)
+            return Response(headers=response_headers)
+
+        # Range is ignored when If-Range does not match the current etag
+        range_header = headers.get("range")
+        if_range = headers.get("if-range")
+        if if_range and if_range != etag:
+            range_header = None
+
+        try:
+            byte_range = DeliveryHelper.parse_range(range_header, stat.st_size)
+        except ValueError:
+            return DeliveryUsecase._error(status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                                          "Range not satisfiable",
+                                          {"content-range": f"bytes */{stat.st_size}"})
+
+        send_body = method != "HEAD"
+        if byte_range is None:
+            return body(0, stat.st_size, status.HTTP_200_OK, response_headers, send_body)
+
+        first, last = byte_range
+        response_headers["content-range"] = f"bytes {first}-{last}/{stat.st_size}"
+        return body(first, last - first + 1, status.HTTP_206_PARTIAL_CONTENT, response_headers, send_body)
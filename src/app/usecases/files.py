@@ -1,17 +1,34 @@
 # Packages
-import os
-from typing import List, Type, Dict
+import json
+import time
+import asyncio
+import functools
+from typing import AsyncIterator, Callable, List, Type, Dict, Tuple, Optional
+from celery import Signature
+from sqlalchemy import insert, select, cast, Integer
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import UploadFile, status
 from fastapi.encoders import jsonable_encoder
-from wand.image import Image
 
 # Modules
-from app.workers.tasks import upload_file, convert_to_png
-from app.models import FilesTable
+from app.workers.celery import celery_app
+from app.workers.tasks import Tasks, upload_file, convert_to_png, split_pdf, process_image, process_image_batch
+from app.workers.events import EventPublisher, event_subscriber, TERMINAL_STATUSES
+from app.models import FilesTable, FileOutputsTable, string_uuid
 from app.utils.helper import ReturnValue, Helper
-from app.utils.wand_helper import WandHelper
-from app.config import STATIC_FILES_DIR
+from app.utils.probe_helper import ProbeHelper
+from app.utils.async_helper import AsyncHelper
+from app.utils.cache_helper import file_cache
+from app.utils.derivative_helper import DerivativeHelper, derivative_cache
+from app.utils.priority_helper import PriorityHelper
+from app.utils.metrics_helper import MetricsHelper
+from app.utils.dedup_helper import DedupHelper
+from app.utils.storage_helper import StorageHelper
+from app.utils.conversion_profile import ConversionProfile, OutputFormat, PROFILES, RESIZE_MODES, \
+    get_conversion_profile, parse_output_formats
+from app.config import FUSED_PROCESSING, MAX_STATUS_BATCH_SIZE, EVENTS_HEARTBEAT_INTERVAL, \
+    FILE_CACHE_TTL, DERIVATIVE_FORMATS, DERIVATIVE_MAX_SIZE, DEFAULT_TENANT, BATCH_SIZE, BATCH_MAX_PIXELS
 
 
 class FilesUsecase:
@@ -19,105 +36,320 @@ class FilesUsecase:
     This class implements files related use cases
     """
 
+    @staticmethod
+    async def _spool_upload(file: UploadFile) -> Dict:
+        """
+        Stream uploaded file to local disk, probe its metadata and store it
+        under its content addressed uri unless the contents are stored
+        already, without blocking the event loop
+
+        Args:
+            file: UploadFile instance
+
+        Returns:
+            dict: file, filename, spooled path, size, content hash, metadata,
+            content addressed uri and whether the file was stored
+        """
+        filename = f"{Helper.generate_random_text()}_{file.filename}"
+        file_path = StorageHelper.get_spool_path(filename)
+        started = time.perf_counter()
+        size, content_hash = await Helper.spool_file_async(file, file_path)
+        spooled = time.perf_counter()
+        metadata = await AsyncHelper.run_in_executor(ProbeHelper.probe, file_path)
+        probed = time.perf_counter()
+        content_uri = DedupHelper.get_content_uri(content_hash, Helper.get_file_extension(file))
+        stored = await AsyncHelper.run_in_executor(StorageHelper.store, file_path, content_uri)
+        labels = (Helper.get_file_extension(file), MetricsHelper.get_size_bucket(size))
+        MetricsHelper.observe("spool", spooled - started, labels)
+        MetricsHelper.observe("probe", probed - spooled, labels)
+        MetricsHelper.observe("store", time.perf_counter() - probed, labels)
+        return {"file": file, "filename": filename, "file_path": file_path, "size": size,
+                "content_hash": content_hash, "metadata": metadata,
+                "content_uri": content_uri, "stored": stored}
+
     @staticmethod
     def _upload_images(
             db: Session,
-            file: UploadFile,
-            file_model: Type[FilesTable]
-    ) -> Dict:
+            upload: Dict,
+            profile: ConversionProfile,
+            outputs: List[OutputFormat],
+            priority: int
+    ) -> Tuple[Dict, List[Dict], Optional[Signature]]:
         """
-        Upload images (png, jpeg, etc.) and convert them into png with
-        configured resolution.
+        Upload images (png, jpeg, etc.) and convert them into requested
+        output formats with configured resolution. Identical contents are
+        stored once and existing conversions are reused, only missing
+        output formats are queued for the worker.
 
         Args:
             db: sqlalchemy instance
-            file: UploadFile instance
-            file_model: FilesTable instance
+            upload: spooled upload
+            profile: conversion profile
+            outputs: requested output formats, the first one is primary
+            priority: priority of celery task
 
         Returns:
-            dict: a dictionary of filename, new_filename and file_id
+            tuple: files record and file_outputs records to be inserted and
+            celery task to be published once the records are committed
+            (None if every conversion already exists)
         """
-        filename = f"{Helper.generate_random_text()}_{file.filename}"
-        file_path = os.path.join(STATIC_FILES_DIR, filename)
-        file_data = file.file.read()
-
-        file_type = Helper.get_file_extension(file)
-        resolution = WandHelper.get_resolution(file_data)
-        file_ = file_model(name=filename, type=file_type,
-                           resolution=resolution)
-        db.add(file_)
-        db.commit()
-        db.refresh(file_)
-        file_id = file_.id
+        content_hash = upload["content_hash"]
+        metadata = upload["metadata"]
+        file_type = Helper.get_file_extension(upload["file"])
+        file_path, upload["fresh"] = DedupHelper.acquire_blob(db, content_hash, upload["content_uri"])
+        upload["blob_path"] = file_path
+        conversions = [(output, DedupHelper.acquire_conversion(
+            db, content_hash, profile.resolution, output.key, profile.key
+        )) for output in outputs]
+
+        file_id = string_uuid()
+        record = {"id": file_id, "name": upload["filename"], "path": file_path,
+                  "type": file_type, "resolution": metadata.resolution,
+                  "width": metadata.width, "height": metadata.height,
+                  "page_count": metadata.page_count,
+                  "content_hash": content_hash, "status": "uploading",
+                  "output_path": None, "output_resolution": None,
+                  "output_width": None, "output_height": None, "output_profile": None}
+
+        output_records = [{"id": string_uuid(), "file_id": file_id, "format": output.format,
+                           "quality": output.quality, "path": conversion.output_path,
+                           "resolution": profile.resolution, "width": conversion.output_width,
+                           "height": conversion.output_height, "profile": profile.key}
+                          for output, conversion in conversions if conversion]
+        primary = conversions[0][1]
+        if primary:
+            record.update({"output_path": primary.output_path,
+                           "output_resolution": profile.resolution,
+                           "output_width": primary.output_width,
+                           "output_height": primary.output_height,
+                           "output_profile": profile.key})
+
+        missing = [output.key for output, conversion in conversions if not conversion]
+        if not missing:
+            record["status"] = "completed"
+            return record, output_records, None
+
+        # labels queue wait of the task
+        headers = MetricsHelper.get_headers(file_type, upload["size"])
 
         # Celery task
-        upload_file.apply_async(
-            (file_id, Helper.encode_bytes_to_base64_string(file_data), file_path),
-            link=convert_to_png.si(file_id)
-        )
-        return {"filename": file.filename, "new_filename": filename, "file_id": file_id}
+        if FUSED_PROCESSING:
+            pixels = Tasks.estimate_pixels(metadata.width, metadata.height)
+            # small images are converted in batches by the batch queue
+            batched = BATCH_SIZE > 1 and pixels is not None and pixels <= BATCH_MAX_PIXELS
+            if batched:
+                # batches do not see message headers, they travel as last argument
+                task = process_image_batch.si(file_id, file_path, pixels, profile.name, missing, headers)
+            else:
+                task = process_image.si(file_id, file_path, pixels, profile.name, missing)
+            task = task.set(priority=priority, headers=headers)
+        else:
+            task = upload_file.si(file_id, file_path).set(
+                priority=priority, headers=headers,
+                link=convert_to_png.si(file_id, profile.name, missing).set(priority=priority, headers=headers)
+            )
+        return record, output_records, task
 
     @staticmethod
     def _upload_pdf_file(
             db: Session,
-            file: UploadFile,
-            file_model: Type[FilesTable]
-    ) -> List:
+            upload: Dict,
+            profile: ConversionProfile,
+            outputs: List[OutputFormat],
+            priority: int
+    ) -> Tuple[Dict, List[Dict], Optional[Signature]]:
         """
-        Upload pdf file and convert extracted images into png with
-        configured resolution.
+        Upload pdf file. Pages are extracted and converted into requested
+        output formats with configured resolution by the split_pdf worker
+        pipeline.
 
         Args:
             db: sqlalchemy instance
-            file: UploadFile instance
-            file_model: FilesTable instance
+            upload: spooled upload
+            profile: conversion profile
+            outputs: requested output formats of pages
+            priority: priority of celery task
 
         Returns:
-            list: list of dictionaries containing filename, new_filename and file_id
+            tuple: files record to be inserted, no file_outputs records and
+            celery task to be published once the record is committed
         """
-        files_id = []
-        pdf_filename = f"{Helper.generate_random_text()}_{file.filename}"
-        file_path = os.path.join(STATIC_FILES_DIR, pdf_filename)
-        file_data = file.file.read()
-
-        file_type = Helper.get_file_extension(file)
-        file_ = file_model(name=pdf_filename, type=file_type)
-        db.add(file_)
-        db.commit()
-        db.refresh(file_)
-        pdf_file_id = file_.id
-        files_id.append({"filename": file.filename,
-                         "new_filename": pdf_filename,
-                         "file_id": pdf_file_id})
+        content_hash = upload["content_hash"]
+        metadata = upload["metadata"]
+        file_type = Helper.get_file_extension(upload["file"])
+        pdf_file_path, upload["fresh"] = DedupHelper.acquire_blob(db, content_hash, upload["content_uri"])
+        upload["blob_path"] = pdf_file_path
+
+        pdf_file_id = string_uuid()
+        record = {"id": pdf_file_id, "name": upload["filename"], "path": pdf_file_path,
+                  "type": file_type, "resolution": metadata.resolution,
+                  "width": metadata.width, "height": metadata.height,
+                  "page_count": metadata.page_count,
+                  "content_hash": content_hash, "status": "uploading",
+                  "output_path": None, "output_resolution": None,
+                  "output_width": None, "output_height": None, "output_profile": None}
 
         # Celery task
-        upload_file.apply_async(
-            (pdf_file_id, Helper.encode_bytes_to_base64_string(file_data), file_path)
+        task = split_pdf.si(pdf_file_id, pdf_file_path, profile.name,
+                            [output.key for output in outputs]).set(
+            priority=priority, headers=MetricsHelper.get_headers(file_type, upload["size"])
         )
+        return record, [], task
+
+    def _create_records(
+            self,
+            db: Session,
+            uploads: List[Dict],
+            file_model: Type[FilesTable],
+            profile: ConversionProfile,
+            outputs: List[OutputFormat],
+            tenant_id: str
+    ) -> Tuple[List, List]:
+        """
+        Create files records of spooled uploads with a single multi-row
+        INSERT ... RETURNING, followed by records of reused outputs. Tasks
+        are prioritized by estimated cost and backlog of the tenant, every
+        file of the batch adds to the backlog.
+
+        Args:
+            db: sqlalchemy instance
+            uploads: list of spooled uploads
+            file_model: FilesTable instance
+            profile: conversion profile
+            outputs: requested output formats
+            tenant_id: tenant id
 
-        with Image(blob=file_data) as pdf:
-            images = pdf.sequence
-            for i, image in enumerate(images):
-                filename = f"{pdf_filename.split('.pdf')[0]}_image_{i + 1}.png"
-                file_path = os.path.join(STATIC_FILES_DIR, filename)
-                file_data = WandHelper.get_blob(image)
-                resolution = f"{int(image.resolution[0])}x{int(image.resolution[1])}"
-                file_ = file_model(name=filename, type="png",
-                                   resolution=resolution, page_num=i + 1,
-                                   pdf_id=pdf_file_id)
-                db.add(file_)
-                db.commit()
-                db.refresh(file_)
-                file_id = file_.id
-                files_id.append({"filename": None, "new_filename": filename, "file_id": file_id})
-
-                # call celery task here for images
-                upload_file.apply_async(
-                    (file_id, Helper.encode_bytes_to_base64_string(file_data), file_path),
-                    link=convert_to_png.si(file_id)
-                )
-
-        return files_id
+        Returns:
+            tuple: inserted records and celery tasks to be published
+        """
+        records = []
+        output_records = []
+        tasks = []
+        backlog = PriorityHelper.get_tenant_backlog(db, file_model, tenant_id)
+        for i, upload in enumerate(uploads):
+            priority = PriorityHelper.get_priority(upload["size"], upload["metadata"].page_count, backlog + i)
+            if "pdf" in upload["file"].content_type:
+                record, outputs_, task = self._upload_pdf_file(db, upload, profile, outputs, priority)
+            else:
+                record, outputs_, task = self._upload_images(db, upload, profile, outputs, priority)
+
+            record["tenant_id"] = tenant_id
+            records.append(record)
+            output_records.extend(outputs_)
+            if task is not None:
+                tasks.append(task)
+
+        result = db.execute(insert(file_model).values(records).returning(file_model.id))
+        for record, file_id in zip(records, result.scalars().all()):
+            record["id"] = file_id
+        if output_records:
+            db.execute(insert(FileOutputsTable).values(output_records))
+
+        return records, tasks
+
+    @staticmethod
+    def _settle_uploads(uploads: List[Dict]) -> None:
+        """
+        Settle stored originals of committed uploads and discard their
+        spooled files
+
+        Args:
+            uploads: list of spooled uploads
+        """
+        for upload in uploads:
+            DedupHelper.settle_blob(upload["file_path"], upload["content_uri"], upload["stored"],
+                                    upload["blob_path"], upload["fresh"])
+
+    @staticmethod
+    def _publish(tasks: List[Signature]) -> None:
+        """
+        Publish celery tasks using a single pooled producer connection
+
+        Args:
+            tasks: list of celery tasks
+        """
+        with celery_app.producer_or_acquire() as producer:
+            for task in tasks:
+                task.apply_async(producer=producer)
+
+    @staticmethod
+    def _release_storage(db: Session, file: FilesTable) -> None:
+        """
+        Release stored original and converted output of file. Content
+        addressed files are reference counted, pdf pages are owned by their
+        record and removed directly.
+
+        Args:
+            db: sqlalchemy instance
+            file: FilesTable instance
+        """
+        if file.content_hash:
+            DedupHelper.release_blob(db, file.content_hash)
+            for output in file.outputs:
+                DedupHelper.release_conversion(db, file.content_hash, output.resolution,
+                                               OutputFormat(output.format, output.quality).key,
+                                               output.profile)
+            if file.output_path and not file.outputs:
+                # converted before outputs were recorded per format
+                DedupHelper.release_conversion(db, file.content_hash, file.output_resolution,
+                                               "png", file.output_profile)
+        else:
+            StorageHelper.remove(file.path)
+            StorageHelper.remove(file.output_path)
+            for output in file.outputs:
+                StorageHelper.remove(output.path)
+
+    @staticmethod
+    def _get_outputs(db: Session, file_ids: List[str]) -> Dict[str, List[Dict]]:
+        """
+        Get converted outputs of files with a single query
+
+        Args:
+            db: sqlalchemy instance
+            file_ids: list of file ids
+
+        Returns:
+            dict: list of format, quality, path, width and height per file id
+        """
+        outputs = {}
+        if not file_ids:
+            return outputs
+
+        rows = db.query(FileOutputsTable).filter(FileOutputsTable.file_id.in_(file_ids)).all()
+        for row in rows:
+            outputs.setdefault(row.file_id, []).append({
+                "format": row.format, "quality": row.quality, "path": row.path,
+                "width": row.width, "height": row.height,
+            })
+        return outputs
+
+    @staticmethod
+    def _get_cache_ttl(file: FilesTable) -> Optional[float]:
+        """
+        Completed files never change again (pdf files complete after all of
+        their pages), so they are cached until evicted or deleted
+
+        Args:
+            file: FilesTable instance
+
+        Returns:
+            float: ttl in seconds or None to cache indefinitely
+        """
+        return None if file.status == "completed" else FILE_CACHE_TTL
+
+    @staticmethod
+    def invalidate_cache(event: Dict) -> None:
+        """
+        Drop cached responses of file, and of its pdf file, on status event
+
+        Args:
+            event: status event published by workers
+        """
+        keys = []
+        for file_id in (event.get("file_id"), event.get("pdf_id")):
+            if file_id:
+                keys.extend([("file", file_id), ("paths", file_id)])
+        file_cache.invalidate(*keys)
 
     @staticmethod
     def get_file_by_id(
@@ -126,7 +358,7 @@ class FilesUsecase:
             file_model: Type[FilesTable]
     ) -> ReturnValue:
         """
-        Get file details by id
+        Get file details by id, served from file_cache when possible
         Args:
             db: sqlalchemy instance
             file_id: file id
@@ -135,16 +367,28 @@ class FilesUsecase:
         Returns:
             ReturnValue: file details
         """
+        key = ("file", file_id)
+        data = file_cache.get(key)
+        if data is not None:
+            return ReturnValue(data=data)
 
+        generation = file_cache.generation
         file = db.query(file_model).filter(file_model.id == file_id).first()
         if not file:
             return ReturnValue(False, status.HTTP_404_NOT_FOUND, "File not found")
 
         data = jsonable_encoder(file)
         if file.type == "pdf":
-            images = db.query(file_model).filter(file_model.pdf_id == file.id).all()
+            images = db.query(file_model).filter(file_model.pdf_id == file.id) \
+                .order_by(cast(file_model.page_num, Integer)).all()
+            outputs = FilesUsecase._get_outputs(db, [image.id for image in images])
             data["images"] = jsonable_encoder(images)
+            for image in data["images"]:
+                image["outputs"] = outputs.get(image["id"], [])
+        else:
+            data["outputs"] = FilesUsecase._get_outputs(db, [file.id]).get(file.id, [])
 
+        file_cache.set(key, data, FilesUsecase._get_cache_ttl(file), generation)
         return ReturnValue(data=data)
 
     @staticmethod
@@ -164,42 +408,283 @@ class FilesUsecase:
             ReturnValue: file status
         """
 
-        file = db.query(file_model).filter(file_model.id == file_id).first()
+        file = db.query(file_model.status).filter(file_model.id == file_id).first()
         if not file:
             return ReturnValue(False, status.HTTP_404_NOT_FOUND, "File not found")
 
         return ReturnValue(data=jsonable_encoder(file.status))
 
-    def upload(
-            self,
+    @staticmethod
+    def get_files_status(
             db: Session,
-            files: List[UploadFile],
+            file_ids: Optional[List[str]],
+            pdf_id: Optional[str],
             file_model: Type[FilesTable]
     ) -> ReturnValue:
         """
-        Upload list of files
+        Get status of many files, or of every page of pdf file, with a
+        single indexed query selecting only id and status
         Args:
             db: sqlalchemy instance
+            file_ids: list of file ids
+            pdf_id: pdf file id
+            file_model: FilesTable instance
+
+        Returns:
+            ReturnValue: list of file ids and statuses
+        """
+        if not file_ids and not pdf_id:
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY, "Please provide file_ids or pdf_id")
+
+        file_ids = file_ids or []
+        if len(file_ids) > MAX_STATUS_BATCH_SIZE:
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY,
+                               f"At most {MAX_STATUS_BATCH_SIZE} file ids are allowed")
+
+        if not all(Helper.is_valid_uuid(id_) for id_ in [*file_ids, *([pdf_id] if pdf_id else [])]):
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY, "Invalid file id")
+
+        query = db.query(file_model.id, file_model.status)
+        if pdf_id:
+            query = query.filter(file_model.pdf_id == pdf_id).order_by(cast(file_model.page_num, Integer))
+        else:
+            query = query.filter(file_model.id.in_(file_ids))
+
+        data = [{"file_id": row.id, "status": row.status} for row in query.all()]
+        return ReturnValue(data=jsonable_encoder(data))
+
+    @staticmethod
+    async def _stream_events(
+            file_id: str,
+            file_status: str,
+            queue: asyncio.Queue,
+            is_disconnected: Callable
+    ) -> AsyncIterator[str]:
+        """
+        Stream status events of file as server-sent events until the file
+        reaches a terminal status or the client disconnects. Events of pdf
+        pages are streamed along with the events of the pdf file.
+
+        Args:
+            file_id: file id
+            file_status: current status of file
+            queue: subscribed queue of file
+            is_disconnected: coroutine function telling if client is gone
+
+        Returns:
+            AsyncIterator: server-sent events
+        """
+        try:
+            yield f"data: {json.dumps({'file_id': file_id, 'status': file_status, 'pdf_id': None})}\n\n"
+            if file_status in TERMINAL_STATUSES:
+                return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        return
+                    # comment line keeps proxies from closing idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield f"data: {json.dumps(event)}\n\n"
+                if event["file_id"] == file_id and event["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            event_subscriber.unsubscribe(file_id, queue)
+
+    async def get_file_events(
+            self,
+            db: AsyncSession,
+            file_id: str,
+            file_model: Type[FilesTable],
+            is_disconnected: Callable
+    ) -> ReturnValue:
+        """
+        Subscribe to status transitions of file or pdf file published by
+        workers, so clients do not have to poll the database
+        Args:
+            db: sqlalchemy async instance
+            file_id: file id
+            file_model: FilesTable instance
+            is_disconnected: coroutine function telling if client is gone
+
+        Returns:
+            ReturnValue: async iterator of server-sent events
+        """
+        if not Helper.is_valid_uuid(file_id):
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY, "Invalid file id")
+
+        # Subscribe before reading the status so no transition is missed
+        queue = event_subscriber.subscribe(file_id)
+        file_status = (await db.execute(
+            select(file_model.status).where(file_model.id == file_id)
+        )).scalar_one_or_none()
+        # Release the connection, the stream can stay open for minutes
+        await db.close()
+        if file_status is None:
+            event_subscriber.unsubscribe(file_id, queue)
+            return ReturnValue(False, status.HTTP_404_NOT_FOUND, "File not found")
+
+        return ReturnValue(data=self._stream_events(file_id, file_status.code, queue, is_disconnected))
+
+    async def get_derivative(
+            self,
+            db: AsyncSession,
+            file_id: str,
+            file_model: Type[FilesTable],
+            width: int,
+            height: int,
+            mode: str = "fit",
+            fmt: str = "png"
+    ) -> ReturnValue:
+        """
+        Get resized copy of image or pdf page. Derivatives are rendered on
+        first request from the smallest sufficient source and kept in the
+        disk cache.
+        Args:
+            db: sqlalchemy async instance
+            file_id: file id
+            file_model: FilesTable instance
+            width: target width
+            height: target height
+            mode: resize mode (fit, fill, exact)
+            fmt: format of derivative (png, jpeg, webp)
+
+        Returns:
+            ReturnValue: path of derivative
+        """
+        if not Helper.is_valid_uuid(file_id):
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY, "Invalid file id")
+        if not (0 < width <= DERIVATIVE_MAX_SIZE and 0 < height <= DERIVATIVE_MAX_SIZE):
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY,
+                               f"Width and height must be between 1 and {DERIVATIVE_MAX_SIZE}")
+        if mode not in RESIZE_MODES:
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY,
+                               f"Unknown mode. Available modes are {', '.join(RESIZE_MODES)}")
+        if fmt not in DERIVATIVE_FORMATS:
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY,
+                               f"Unknown format. Available formats are {', '.join(DERIVATIVE_FORMATS)}")
+
+        file = (await db.execute(select(file_model).where(file_model.id == file_id))).scalar_one_or_none()
+        # Release the connection, rendering can take a while
+        await db.close()
+        if not file:
+            return ReturnValue(False, status.HTTP_404_NOT_FOUND, "File not found")
+        if file.type == "pdf":
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY,
+                               "Derivatives are rendered for images and pdf pages")
+        if not file.path:
+            return ReturnValue(False, status.HTTP_409_CONFLICT, "File is still being processed")
+
+        file_name = DerivativeHelper.get_file_name(file, width, height, mode, fmt)
+        path = await derivative_cache.get_or_render(
+            file_name, functools.partial(DerivativeHelper.render, file, width, height, mode, fmt)
+        )
+        return ReturnValue(data=path)
+
+    async def upload(
+            self,
+            db: AsyncSession,
+            files: List[UploadFile],
+            file_model: Type[FilesTable],
+            profile_name: str = None,
+            formats: str = None,
+            tenant_id: str = None
+    ) -> ReturnValue:
+        """
+        Upload list of files. Files are spooled concurrently, blocking work
+        runs in the bounded executor and database calls go through asyncpg,
+        so the event loop is never blocked.
+
+        Args:
+            db: sqlalchemy async instance
             files: list of UploadFile instance
             file_model: FilesTable instance
+            profile_name: name of conversion profile, defaults to CONVERSION_PROFILE
+            formats: comma separated output formats (e.g. webp:80,png), defaults to OUTPUT_FORMATS
+            tenant_id: tenant id used for fair-share priorities, defaults to DEFAULT_TENANT
 
         Returns:
             ReturnValue: list of files id after added into db
         """
-        files_id = []
-        for file in files:
-            if "pdf" in file.content_type:
-                file_ids = self._upload_pdf_file(db, file, file_model)
-                files_id.extend(file_ids)
-            else:
-                file_id = self._upload_images(db, file, file_model)
-                files_id.append(file_id)
-
-        if not files_id:
+        if not files:
             return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY, "Please select files to upload")
 
+        if profile_name and profile_name not in PROFILES:
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY,
+                               f"Unknown profile. Available profiles are {', '.join(PROFILES)}")
+        profile = get_conversion_profile(profile_name)
+        try:
+            outputs = parse_output_formats(formats)
+        except ValueError as e:
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY, str(e))
+        if tenant_id is not None and not 0 < len(tenant_id) <= 64:
+            return ReturnValue(False, status.HTTP_422_UNPROCESSABLE_ENTITY, "Invalid tenant id")
+
+        uploads = await asyncio.gather(*(self._spool_upload(file) for file in files))
+        file_types = {Helper.get_file_extension(upload["file"]) for upload in uploads}
+        labels = (file_types.pop() if len(file_types) == 1 else "mixed",
+                  MetricsHelper.get_size_bucket(sum(upload["size"] for upload in uploads)))
+
+        # All records are created in a single transaction and tasks are
+        # published only after it is committed
+        started = time.perf_counter()
+        records, tasks = await db.run_sync(self._create_records, uploads, file_model, profile, outputs,
+                                           tenant_id or DEFAULT_TENANT)
+        await db.commit()
+        committed = time.perf_counter()
+        await AsyncHelper.run_in_executor(self._settle_uploads, uploads)
+        await AsyncHelper.run_in_executor(self._publish, tasks)
+        MetricsHelper.observe("db_insert", committed - started, labels)
+        MetricsHelper.observe("publish", time.perf_counter() - committed, labels)
+
+        files_id = [{"filename": upload["file"].filename,
+                     "new_filename": record["name"],
+                     "file_id": record["id"]}
+                    for upload, record in zip(uploads, records)]
         return ReturnValue(True, status.HTTP_200_OK, "File is uploaded", data=files_id)
 
+    def delete_file(
+            self,
+            db: Session,
+            file_id: str,
+            file_model: Type[FilesTable]
+    ) -> ReturnValue:
+        """
+        Delete file along with pdf pages. Shared originals and conversions
+        are removed from storage only once the last file referencing them
+        is deleted.
+
+        Args:
+            db: sqlalchemy instance
+            file_id: file id
+            file_model: FilesTable instance
+
+        Returns:
+            ReturnValue: deleted file id
+        """
+        file = db.query(file_model).filter(file_model.id == file_id).first()
+        if not file:
+            return ReturnValue(False, status.HTTP_404_NOT_FOUND, "File not found")
+
+        if file.status not in ("completed", "failure"):
+            return ReturnValue(False, status.HTTP_409_CONFLICT, "File is still being processed")
+
+        deleted = [(file_.id, file_.pdf_id) for file_ in [*file.files, file]]
+        for file_ in [*file.files, file]:
+            self._release_storage(db, file_)
+            db.delete(file_)
+
+        db.commit()
+        # Cached responses are dropped by every api process
+        for id_, pdf_id in deleted:
+            self.invalidate_cache({"file_id": id_, "pdf_id": pdf_id})
+            EventPublisher.publish_status(id_, "deleted", pdf_id)
+        return ReturnValue(True, status.HTTP_200_OK, "File is deleted", data=file_id)
+
     @staticmethod
     def get_file_paths(
             db: Session,
@@ -207,7 +692,7 @@ class FilesUsecase:
             file_model: Type[FilesTable]
     ) -> ReturnValue:
         """
-        Get file input/output file path
+        Get file input/output file path, served from file_cache when possible
         Args:
             db: sqlalchemy instance
             file_id: file id
@@ -216,10 +701,16 @@ class FilesUsecase:
         Returns:
             ReturnValue: file paths
         """
+        key = ("paths", file_id)
+        paths = file_cache.get(key)
+        if paths is not None:
+            return ReturnValue(data=paths)
 
+        generation = file_cache.generation
         file = db.query(file_model).filter(file_model.id == file_id).first()
         if not file:
             return ReturnValue(False, status.HTTP_404_NOT_FOUND, "File not found")
+        ttl = FilesUsecase._get_cache_ttl(file)
 
         paths = {"file_id": file_id,
                  "file_type": file.type,
@@ -227,16 +718,28 @@ class FilesUsecase:
                  "output_path": file.output_path,
                  "resolution": file.resolution,
                  "output_resolution": file.output_resolution,
+                 "output_width": file.output_width,
+                 "output_height": file.output_height,
+                 "outputs": [],
                  "images": []}
 
         if file.type == "pdf":
-            files = db.query(file_model).filter(file_model.pdf_id == file_id).all()
+            files = db.query(file_model).filter(file_model.pdf_id == file_id) \
+                .order_by(cast(file_model.page_num, Integer)).all()
+            outputs = FilesUsecase._get_outputs(db, [file.id for file in files])
             for file in files:
                 paths["images"].append({
                     "path": file.path,
                     "output_path": file.output_path,
                     "resolution": file.resolution,
                     "output_resolution": file.output_resolution,
+                    "output_width": file.output_width,
+                    "output_height": file.output_height,
+                    "outputs": outputs.get(file.id, []),
                 })
+        else:
+            paths["outputs"] = FilesUsecase._get_outputs(db, [file.id]).get(file.id, [])
 
-        return ReturnValue(data=jsonable_encoder(paths))
+        paths = jsonable_encoder(paths)
+        file_cache.set(key, paths, ttl, generation)
+        return ReturnValue(data=paths)
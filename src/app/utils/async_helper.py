@@ -0,0 +1,34 @@
+# Packages
+import asyncio
+import functools
+from typing import Any, Callable
+from concurrent.futures import ThreadPoolExecutor
+
+# Modules
+from app.config import EXECUTOR_MAX_WORKERS
+
+# Bounded pool for blocking and CPU bound work issued from the event loop
+executor = ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS, thread_name_prefix="blocking")
+
+
+class AsyncHelper:
+    """
+    Helper class for running blocking code from coroutines
+    """
+
+    @staticmethod
+    async def run_in_executor(func: Callable, *args, **kwargs) -> Any:
+        """
+        Run blocking function in bounded executor without blocking the
+        event loop
+
+        Args:
+            func: blocking function
+            *args: positional arguments of function
+            **kwargs: keyword arguments of function
+
+        Returns:
+            Any: return value of function
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,134 @@
+# Packages
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# Modules
+from app.config import FILE_CACHE_SIZE, FILE_CACHE_TTL
+
+
+class LruCache:
+    """
+    Thread safe in-process LRU cache whose entries either expire after a
+    ttl or live until they are evicted or invalidated.
+
+    Every invalidation bumps a generation counter and records it for the
+    invalidated keys. Loaders read the generation before querying and pass
+    it to set, so a value loaded before a concurrent invalidation of its
+    key is never stored, while invalidations of other keys do not affect
+    it. Records of the oldest invalidations are dropped beyond max_size,
+    values loaded before them are then not stored for any key.
+    """
+
+    def __init__(self, max_size: int = FILE_CACHE_SIZE, ttl: Optional[float] = FILE_CACHE_TTL):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        # generation of the latest invalidation by key, and the generation
+        # before which loaded values are not stored at all
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._oldest_generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get cached value
+
+        Args:
+            key: cache key
+
+        Returns:
+            Any: cached value or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(
+            self,
+            key: Hashable,
+            value: Any,
+            ttl: Optional[float] = -1,
+            generation: int = None
+    ) -> None:
+        """
+        Store value
+
+        Args:
+            key: cache key
+            value: value to store
+            ttl: seconds to keep the value, None keeps it until evicted and
+                a negative value uses the default ttl
+            generation: generation read before the value was loaded
+        """
+        if ttl is not None and ttl < 0:
+            ttl = self._ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+
+        with self._lock:
+            if generation is not None and (generation < self._oldest_generation
+                                           or self._invalidated.get(key, -1) > generation):
+                return
+
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """
+        Remove values of keys
+
+        Args:
+            keys: cache keys
+        """
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+                self._invalidated[key] = self._generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self._max_size:
+                _, generation = self._invalidated.popitem(last=False)
+                self._oldest_generation = generation
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._invalidated.clear()
+            self._oldest_generation = self._generation
+
+    def stats(self) -> Dict:
+        """
+        Get hit, miss and eviction counters
+
+        Returns:
+            dict: counters and number of cached entries
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._entries), "max_size": self._max_size,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+file_cache = LruCache()
@@ -0,0 +1,129 @@
+# Packages
+from typing import AnyStr, Dict, List, Optional, Tuple, Union
+from dataclasses import dataclass
+
+# Modules
+from app.config import (
+    CONVERSION_PROFILE, CONVERTED_IMAGE_RESOLUTION, CONVERTED_IMAGE_SIZE,
+    RESIZE_MODE, RESAMPLING_FILTER, OUTPUT_FORMAT_CHOICES, OUTPUT_FORMATS, OUTPUT_QUALITY,
+)
+
+RESIZE_MODES = ["fit", "fill", "exact"]
+
+
+@dataclass(frozen=True)
+class ConversionProfile:
+    """ConversionProfile describes how an image is converted
+    Args:
+        name: name of profile
+        resolution: density written into the output (e.g. 3500x3500)
+        size: target pixel dimensions (e.g. 800x600), None keeps original size
+        resize_mode: fit inside size, fill and crop to size or exact size
+        filter: ImageMagick resampling filter
+        jpeg_size_hint: let libjpeg downscale by 1/2, 1/4 or 1/8 while decoding
+        png_compression_level: zlib level 0-9, None keeps ImageMagick default
+        png_filter: png filter type 0-4 (none, sub, up, average, paeth) or 5 (adaptive)
+        png_bit_depth: bit depth per channel of output
+        png_colors: quantize output into palette of this many colors
+        parallel_deflate: compress image data with multithreaded pigz when installed
+    """
+    name: str
+    resolution: str = CONVERTED_IMAGE_RESOLUTION
+    size: Optional[str] = CONVERTED_IMAGE_SIZE
+    resize_mode: str = RESIZE_MODE
+    filter: str = "lanczos"
+    jpeg_size_hint: bool = False
+    png_compression_level: Optional[int] = None
+    png_filter: Optional[int] = None
+    png_bit_depth: Optional[int] = None
+    png_colors: Optional[int] = None
+    parallel_deflate: bool = False
+
+    @property
+    def dimensions(self) -> Optional[Tuple[int, int]]:
+        if not self.size:
+            return None
+        width, height = self.size.split("x")
+        return int(width), int(height)
+
+    @property
+    def key(self) -> AnyStr:
+        """Identifies outputs produced by this profile in the conversion cache"""
+        return f"{self.name}/{self.size or 'original'}/{self.resize_mode}/{self.filter}"
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    """OutputFormat describes one encoded output of a conversion
+    Args:
+        format: png, jpeg, webp or avif
+        quality: compression quality (1-100) of lossy formats, None for png
+    """
+    format: str
+    quality: Optional[int] = None
+
+    @property
+    def key(self) -> AnyStr:
+        """Identifies outputs of this format in the conversion cache"""
+        return self.format if self.quality is None else f"{self.format}:{self.quality}"
+
+
+PROFILES: Dict[str, ConversionProfile] = {
+    "quality": ConversionProfile("quality", filter=RESAMPLING_FILTER or "lanczos"),
+    "fast": ConversionProfile("fast", filter=RESAMPLING_FILTER or "triangle", jpeg_size_hint=True),
+    "fast_write": ConversionProfile("fast_write", filter=RESAMPLING_FILTER or "triangle",
+                                    jpeg_size_hint=True, png_compression_level=1, png_filter=0),
+    "small_output": ConversionProfile("small_output", filter=RESAMPLING_FILTER or "lanczos",
+                                      png_compression_level=9, png_filter=5,
+                                      png_bit_depth=8, png_colors=256),
+    "parallel": ConversionProfile("parallel", filter=RESAMPLING_FILTER or "lanczos",
+                                  png_compression_level=6, png_filter=5, parallel_deflate=True),
+}
+
+
+def get_conversion_profile(name: str = None) -> ConversionProfile:
+    """
+    Get conversion profile by name
+
+    Args:
+        name: name of profile, defaults to CONVERSION_PROFILE
+
+    Returns:
+        ConversionProfile: conversion profile
+    """
+    return PROFILES[name or CONVERSION_PROFILE]
+
+
+def parse_output_formats(value: Union[str, List[str], None] = None) -> List[OutputFormat]:
+    """
+    Parse requested output formats, e.g. "webp:80,png". The first format is
+    the primary output recorded on the file itself.
+
+    Args:
+        value: comma separated string or list of format keys, defaults to OUTPUT_FORMATS
+
+    Returns:
+        list: output formats without duplicates
+
+    Raises:
+        ValueError: unknown format or invalid quality
+    """
+    keys = value.split(",") if isinstance(value, str) else value
+    keys = [key.strip().lower() for key in keys or [] if key.strip()] or OUTPUT_FORMATS.split(",")
+
+    outputs = {}
+    for key in keys:
+        fmt, _, quality = key.partition(":")
+        fmt = "jpeg" if fmt == "jpg" else fmt
+        if fmt not in OUTPUT_FORMAT_CHOICES:
+            raise ValueError(f"Unknown output format {fmt}. "
+                             f"Available formats are {', '.join(OUTPUT_FORMAT_CHOICES)}")
+        if fmt == "png":
+            # png is lossless, its compression is set by the conversion profile
+            outputs.setdefault(fmt, OutputFormat(fmt))
+            continue
+        if quality and not (quality.isdigit() and 1 <= int(quality) <= 100):
+            raise ValueError(f"Quality of {fmt} must be between 1 and 100")
+        outputs.setdefault(fmt, OutputFormat(fmt, int(quality) if quality else OUTPUT_QUALITY))
+
+    return list(outputs.values())
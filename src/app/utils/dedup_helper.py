@@ -0,0 +1,219 @@
+# Packages
+from typing import AnyStr, Optional, Tuple
+from sqlalchemy import update, delete
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+
+# Modules
+from app.models import BlobsTable, ConversionsTable
+from app.utils.helper import Helper
+from app.utils.storage_helper import StorageHelper
+
+
+class DedupHelper:
+    """
+    Helper class for content addressed storage. Originals and converted
+    outputs are shared between files rows and reference counted, the last
+    release removes the file from storage. Files are removed before the
+    transaction commits, so a concurrent acquire either keeps the row alive
+    or recreates it after the file is gone, in which case settle_blob
+    stores it again.
+    """
+
+    @staticmethod
+    def get_content_uri(content_hash: str, extension: str) -> AnyStr:
+        """
+        Get storage uri of content addressed file
+
+        Args:
+            content_hash: hex digest of contents
+            extension: extension name
+
+        Returns:
+            AnyStr: storage uri of file
+        """
+        return StorageHelper.get_uri(f"{content_hash}.{extension}")
+
+    @staticmethod
+    def acquire_blob(
+            db: Session,
+            content_hash: str,
+            content_uri: str
+    ) -> Tuple[AnyStr, bool]:
+        """
+        Take a reference on content addressed original. The original is
+        stored by the caller beforehand (StorageHelper.store), off the
+        transaction, and settled once the reference is committed.
+
+        Args:
+            db: sqlalchemy instance
+            content_hash: hex digest of contents
+            content_uri: content addressed storage uri of file
+
+        Returns:
+            tuple: storage uri of stored original and whether this is its
+            first reference
+        """
+        statement = insert(BlobsTable).values(
+            content_hash=content_hash, path=content_uri, ref_count=1
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[BlobsTable.content_hash],
+            set_={"ref_count": BlobsTable.ref_count + 1},
+        ).returning(BlobsTable.path, BlobsTable.ref_count)
+        row = db.execute(statement).one()
+        return row.path, row.ref_count == 1
+
+    @staticmethod
+    def settle_blob(
+            file_path: str,
+            content_uri: str,
+            stored: bool,
+            path: str,
+            fresh: bool
+    ) -> None:
+        """
+        Make sure the original of a committed reference is in storage and
+        discard the spooled file
+
+        Args:
+            file_path: path of spooled file, moved into storage if it was stored
+            content_uri: content addressed storage uri of file
+            stored: whether the spooled file was stored before acquiring
+            path: storage uri of stored original, returned by acquire_blob
+            fresh: whether the reference was the first one
+        """
+        if path == content_uri and fresh and not stored and not StorageHelper.exists(path):
+            # the last reference was released between storing and acquiring
+            StorageHelper.put_file(file_path, path)
+            return
+        if stored and path != content_uri:
+            # contents are recorded at a uri of another backend
+            StorageHelper.remove(content_uri)
+        Helper.remove_file(file_path)
+
+    @staticmethod
+    def release_blob(db: Session, content_hash: str) -> None:
+        """
+        Drop a reference on content addressed original and remove it from
+        storage when it is no longer referenced
+
+        Args:
+            db: sqlalchemy instance
+            content_hash: hex digest of contents
+        """
+        statement = update(BlobsTable).where(
+            BlobsTable.content_hash == content_hash
+        ).values(ref_count=BlobsTable.ref_count - 1).returning(
+            BlobsTable.ref_count, BlobsTable.path
+        )
+        row = db.execute(statement).first()
+        if row is not None and row.ref_count <= 0:
+            db.execute(delete(BlobsTable).where(BlobsTable.content_hash == content_hash))
+            StorageHelper.remove(row.path)
+
+    @staticmethod
+    def acquire_conversion(
+            db: Session,
+            content_hash: str,
+            resolution: str,
+            fmt: str,
+            profile: str
+    ) -> Optional[Row]:
+        """
+        Take a reference on existing conversion
+
+        Args:
+            db: sqlalchemy instance
+            content_hash: hex digest of original contents
+            resolution: resolution of converted output
+            fmt: format of converted output
+            profile: key of conversion profile
+
+        Returns:
+            Row: output_path, output_width and output_height of converted
+            output or None if it does not exist yet
+        """
+        statement = update(ConversionsTable).where(
+            ConversionsTable.content_hash == content_hash,
+            ConversionsTable.resolution == resolution,
+            ConversionsTable.format == fmt,
+            ConversionsTable.profile == profile,
+        ).values(ref_count=ConversionsTable.ref_count + 1).returning(
+            ConversionsTable.output_path,
+            ConversionsTable.output_width,
+            ConversionsTable.output_height,
+        )
+        return db.execute(statement).first()
+
+    @staticmethod
+    def register_conversion(
+            db: Session,
+            content_hash: str,
+            resolution: str,
+            fmt: str,
+            profile: str,
+            output_path: str,
+            output_width: int = None,
+            output_height: int = None
+    ) -> None:
+        """
+        Record a freshly written conversion and take a reference on it
+
+        Args:
+            db: sqlalchemy instance
+            content_hash: hex digest of original contents
+            resolution: resolution of converted output
+            fmt: format of converted output
+            profile: key of conversion profile
+            output_path: storage uri of converted output
+            output_width: width of converted output
+            output_height: height of converted output
+        """
+        statement = insert(ConversionsTable).values(
+            content_hash=content_hash, resolution=resolution, format=fmt,
+            profile=profile, output_path=output_path,
+            output_width=output_width, output_height=output_height, ref_count=1
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[ConversionsTable.content_hash,
+                            ConversionsTable.resolution,
+                            ConversionsTable.format,
+                            ConversionsTable.profile],
+            set_={"ref_count": ConversionsTable.ref_count + 1},
+        )
+        db.execute(statement)
+
+    @staticmethod
+    def release_conversion(
+            db: Session,
+            content_hash: str,
+            resolution: str,
+            fmt: str,
+            profile: str
+    ) -> None:
+        """
+        Drop a reference on conversion and remove the output from storage
+        when it is no longer referenced
+
+        Args:
+            db: sqlalchemy instance
+            content_hash: hex digest of original contents
+            resolution: resolution of converted output
+            fmt: format of converted output
+            profile: key of conversion profile
+        """
+        condition = (
+            (ConversionsTable.content_hash == content_hash)
+            & (ConversionsTable.resolution == resolution)
+            & (ConversionsTable.format == fmt)
+            & (ConversionsTable.profile == profile)
+        )
+        statement = update(ConversionsTable).where(condition).values(
+            ref_count=ConversionsTable.ref_count - 1
+        ).returning(ConversionsTable.ref_count, ConversionsTable.output_path)
+        row = db.execute(statement).first()
+        if row is not None and row.ref_count <= 0:
+            db.execute(delete(ConversionsTable).where(condition))
+            StorageHelper.remove(row.output_path)
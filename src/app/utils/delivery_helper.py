@@ -0,0 +1,219 @@
+# Packages
+import os
+import re
+import hashlib
+import anyio
+from typing import AnyStr, Dict, List, Optional, Tuple
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Modules
+from app.config import CONTENT_HASH_ALGORITHM
+from app.utils.storage_helper import StorageHelper, StorageStat
+
+# Originals ({hash}.{ext}) and their conversions ({hash}_{profile}_converted.png)
+# are named after their contents and never change
+CONTENT_ADDRESSED_NAME = re.compile(
+    rf"^[0-9a-f]{{{hashlib.new(CONTENT_HASH_ALGORITHM).digest_size * 2}}}[._]"
+)
+SEND_CHUNK_SIZE = 256 * 1024
+
+
+class DeliveryHelper:
+    """
+    Helper class for conditional and partial responses of stored files
+    """
+
+    @staticmethod
+    def is_content_addressed(file_name: str) -> bool:
+        return CONTENT_ADDRESSED_NAME.match(file_name) is not None
+
+    @staticmethod
+    def get_etag(file_name: str, stat: StorageStat) -> AnyStr:
+        """
+        Get strong etag of stored file. Content addressed files use their
+        name, files written by workers (pdf pages) use size and mtime since
+        they are replaced atomically.
+
+        Args:
+            file_name: name of file
+            stat: stat of file, os.stat_result or StorageStat
+
+        Returns:
+            AnyStr: quoted etag
+        """
+        if DeliveryHelper.is_content_addressed(file_name):
+            return f'"{os.path.splitext(file_name)[0]}"'
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    @staticmethod
+    def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+        """
+        Weak comparison of If-None-Match header with etag
+
+        Args:
+            if_none_match: value of If-None-Match header
+            etag: quoted etag
+
+        Returns:
+            bool: True if client copy is current
+        """
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+    @staticmethod
+    def get_accel_path(file_path: str, roots: List[Tuple[str, Optional[str]]]) -> Optional[str]:
+        """
+        Get X-Accel-Redirect path of file below one of the roots served by
+        nginx. The deepest root containing the file is used.
+
+        Args:
+            file_path: local path of file
+            roots: directory and internal location prefix of served roots,
+                roots without prefix are not served by nginx
+
+        Returns:
+            str: path of file in the internal location or None when the
+                file is not below a served root
+        """
+        file_path = os.path.realpath(file_path)
+        matches = []
+        for directory, prefix in roots:
+            directory = os.path.realpath(directory)
+            if prefix and os.path.commonpath([directory, file_path]) == directory:
+                matches.append((directory, prefix))
+        if not matches:
+            return None
+        directory, prefix = max(matches, key=lambda match: len(match[0]))
+        return f"{prefix.rstrip('/')}/{os.path.relpath(file_path, directory)}"
+
+    @staticmethod
+    def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+        """
+        Parse single byte range of Range header. Multiple ranges are not
+        supported and served as a full response.
+
+        Args:
+            range_header: value of Range header
+            size: size of file
+
+        Returns:
+            tuple: first and last byte (inclusive) or None for full response
+
+        Raises:
+            ValueError: range is not satisfiable
+        """
+        if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+            return None
+
+        start, separator, end = range_header[len("bytes="):].strip().partition("-")
+        if not separator or not (start + end).isascii() or not (start + end).isdigit():
+            # malformed ranges are ignored
+            return None
+
+        if not start:
+            # suffix range, last n bytes
+            if int(end) == 0 or size == 0:
+                raise ValueError(f"Range {range_header} not satisfiable")
+            return max(size - int(end), 0), size - 1
+
+        first = int(start)
+        last = int(end) if end else size - 1
+        if end and last < first:
+            return None
+        if first >= size:
+            raise ValueError(f"Range {range_header} not satisfiable")
+        return first, min(last, size - 1)
+
+
+class SendfileResponse(Response):
+    """
+    Response streaming a byte range of file. Uses the zero-copy sendfile
+    extension of the ASGI server when it is advertised, otherwise the file
+    is read in chunks off the event loop.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            offset: int,
+            count: int,
+            status_code: int = 200,
+            headers: Dict = None,
+            send_body: bool = True
+    ) -> None:
+        super().__init__(status_code=status_code,
+                         headers={**(headers or {}), "content-length": str(count)})
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code,
+                    "headers": self.raw_headers})
+        if not self.send_body or not self.count:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        with open(self.path, "rb", buffering=0) as file:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": file,
+                            "offset": self.offset, "count": self.count})
+                return
+
+            position, end = self.offset, self.offset + self.count
+            while position < end:
+                chunk = await anyio.to_thread.run_sync(
+                    os.pread, file.fileno(), min(SEND_CHUNK_SIZE, end - position), position
+                )
+                if not chunk:
+                    break
+                position += len(chunk)
+                await send({"type": "http.response.body", "body": chunk,
+                            "more_body": position < end})
+
+            if position < end:
+                # file shrank while streaming
+                await send({"type": "http.response.body", "body": b""})
+
+
+class StorageResponse(Response):
+    """
+    Response streaming a byte range of an object of remote storage. The
+    range is fetched with a single ranged read whose chunks are received
+    off the event loop.
+    """
+
+    def __init__(
+            self,
+            uri: str,
+            offset: int,
+            count: int,
+            status_code: int = 200,
+            headers: Dict = None,
+            send_body: bool = True
+    ) -> None:
+        super().__init__(status_code=status_code,
+                         headers={**(headers or {}), "content-length": str(count)})
+        self.uri = uri
+        self.offset = offset
+        self.count = count
+        self.send_body = send_body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code,
+                    "headers": self.raw_headers})
+        if not self.send_body or not self.count:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        chunks = StorageHelper.iter_range(self.uri, self.offset, self.count)
+        try:
+            while chunk := await anyio.to_thread.run_sync(next, chunks, b""):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            chunks.close()
+        await send({"type": "http.response.body", "body": b""})
@@ -0,0 +1,270 @@
+# Packages
+import os
+import glob
+import math
+import time
+import zlib
+import fcntl
+import asyncio
+import logging
+import dataclasses
+from typing import AnyStr, Callable, Dict, List, Tuple
+
+# Modules
+from app.config import DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_SIZE, DERIVATIVE_QUALITY
+from app.models import FilesTable
+from app.utils.async_helper import AsyncHelper
+from app.utils.conversion_profile import ConversionProfile, PROFILES
+from app.utils.probe_helper import ProbeHelper
+from app.utils.storage_helper import StorageHelper
+from app.utils.wand_helper import WandHelper
+
+# Renders of different keys share a bounded set of lock files
+LOCK_BUCKETS = 256
+# Eviction frees space down to this share of DERIVATIVE_CACHE_SIZE
+EVICTION_TARGET = 0.9
+
+
+class DerivativeHelper:
+    """
+    Helper class for choosing the source and profile of derivatives
+    """
+
+    @staticmethod
+    def get_file_name(file: FilesTable, width: int, height: int, mode: str, fmt: str) -> AnyStr:
+        """
+        Get cache file name of derivative. Names start with the name of the
+        original, so files sharing content share their derivatives.
+
+        Args:
+            file: FilesTable instance
+            width: target width
+            height: target height
+            mode: resize mode
+            fmt: format of derivative
+
+        Returns:
+            AnyStr: file name of derivative
+        """
+        stem = os.path.splitext(os.path.basename(file.path))[0]
+        return f"{stem}_{width}x{height}_{mode}.{fmt}"
+
+    @staticmethod
+    def get_profile(width: int, height: int, mode: str) -> ConversionProfile:
+        """
+        Get conversion profile of derivative, jpeg sources are decoded at
+        the smallest libjpeg scale which is still large enough
+
+        Args:
+            width: target width
+            height: target height
+            mode: resize mode
+
+        Returns:
+            ConversionProfile: profile of derivative
+        """
+        return dataclasses.replace(PROFILES["quality"], name="derivative", size=f"{width}x{height}",
+                                   resize_mode=mode, jpeg_size_hint=True)
+
+    @staticmethod
+    def get_required_size(
+            source_width: int,
+            source_height: int,
+            width: int,
+            height: int,
+            mode: str
+    ) -> Tuple[int, int]:
+        """
+        Get the smallest size, with the aspect ratio of the original, from
+        which the derivative can be rendered without upscaling
+
+        Args:
+            source_width: width of original
+            source_height: height of original
+            width: target width
+            height: target height
+            mode: resize mode
+
+        Returns:
+            tuple: required width and height
+        """
+        if mode == "fit":
+            ratio = min(width / source_width, height / source_height)
+        else:
+            ratio = max(width / source_width, height / source_height)
+        ratio = min(ratio, 1)
+        return math.ceil(source_width * ratio), math.ceil(source_height * ratio)
+
+    @staticmethod
+    def select_source(file: FilesTable, width: int, height: int, mode: str) -> AnyStr:
+        """
+        Select the smallest rendered image of file large enough for the
+        derivative: the converted png output or a png fit derivative, falling
+        back to the original. Candidates must keep the aspect ratio of the
+        original.
+
+        Args:
+            file: FilesTable instance
+            width: target width
+            height: target height
+            mode: resize mode
+
+        Returns:
+            AnyStr: storage uri or derivative path of source image
+        """
+        if not file.width or not file.height:
+            return file.path
+
+        candidates: List[Tuple[str, int, int]] = []
+        if file.output_path and file.output_path.endswith(".png") \
+                and file.output_width and file.output_height:
+            candidates.append((file.output_path, file.output_width, file.output_height))
+
+        stem = os.path.splitext(os.path.basename(file.path))[0]
+        for path in glob.glob(os.path.join(DERIVATIVE_CACHE_DIR, glob.escape(stem) + "_*_fit.png")):
+            try:
+                metadata = ProbeHelper.probe(path)
+            except OSError:
+                continue
+            candidates.append((path, metadata.width, metadata.height))
+
+        required_width, required_height = DerivativeHelper.get_required_size(
+            file.width, file.height, width, height, mode
+        )
+        aspect = file.width / file.height
+        best, best_area = file.path, file.width * file.height
+        for path, candidate_width, candidate_height in candidates:
+            if not candidate_width or not candidate_height \
+                    or abs(candidate_width / candidate_height - aspect) > aspect * 0.01:
+                continue
+            area = candidate_width * candidate_height
+            if candidate_width >= required_width and candidate_height >= required_height \
+                    and area < best_area and StorageHelper.exists(path):
+                best, best_area = path, area
+
+        return best
+
+    @staticmethod
+    def render(file: FilesTable, width: int, height: int, mode: str, fmt: str, path: str) -> None:
+        """
+        Render derivative of file from the selected source
+
+        Args:
+            file: FilesTable instance
+            width: target width
+            height: target height
+            mode: resize mode
+            fmt: format of derivative
+            path: path of derivative
+        """
+        source_path = DerivativeHelper.select_source(file, width, height, mode)
+        profile = DerivativeHelper.get_profile(width, height, mode)
+        pixels = file.width * file.height if file.width and file.height else None
+        with StorageHelper.reader(source_path) as local_path, WandHelper.resource_limits(pixels):
+            WandHelper.render_derivative(local_path, path, profile, fmt, DERIVATIVE_QUALITY)
+        logging.info(f"Rendered derivative {os.path.basename(path)} from {source_path}")
+
+
+class DerivativeCache:
+    """
+    Size bounded LRU of rendered derivatives on disk. Concurrent requests
+    for the same derivative await one render within the process, and a
+    file lock keeps other processes from rendering it a second time.
+    """
+
+    def __init__(self, directory: str = DERIVATIVE_CACHE_DIR, max_bytes: int = DERIVATIVE_CACHE_SIZE):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    async def get_or_render(self, file_name: str, render: Callable[[str], None]) -> AnyStr:
+        """
+        Get path of cached derivative, rendering it on a miss
+
+        Args:
+            file_name: file name of derivative
+            render: blocking function writing the derivative to given path
+
+        Returns:
+            AnyStr: path of derivative
+        """
+        path = os.path.join(self._directory, file_name)
+        if self._touch(path):
+            return path
+
+        future = self._pending.get(file_name)
+        if future is None:
+            future = asyncio.ensure_future(AsyncHelper.run_in_executor(self._render, path, render))
+            self._pending[file_name] = future
+            future.add_done_callback(lambda _: self._pending.pop(file_name, None))
+
+        # a client going away does not cancel the render others wait for
+        await asyncio.shield(future)
+        return path
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        """
+        Mark cached derivative as recently used, mtime is kept since it is
+        part of the etag
+
+        Args:
+            path: path of derivative
+
+        Returns:
+            bool: True if derivative is cached
+        """
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _render(self, path: str, render: Callable[[str], None]) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+        bucket = zlib.crc32(os.path.basename(path).encode()) % LOCK_BUCKETS
+        with open(os.path.join(self._directory, f".lock-{bucket}"), "wb") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another process may have rendered it while we waited
+                if not os.path.exists(path):
+                    render(path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove least recently used derivatives once the cache outgrows
+        DERIVATIVE_CACHE_SIZE
+        """
+        entries = []
+        total = 0
+        with os.scandir(self._directory) as iterator:
+            for entry in iterator:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self._max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self._max_bytes * EVICTION_TARGET:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        logging.info(f"Evicted derivatives down to {total} bytes")
+
+
+derivative_cache = DerivativeCache()
@@ -18,3 +18,18 @@ class ExtensionNotAllowed(HTTPException):
             headers = {"WWW-Authenticate": "Bearer"}
 
         super().__init__(status_code=status_code, detail=detail, headers=headers)
+
+
+class AdminTokenInvalid(HTTPException):
+    """
+    This exception is raised when X-Admin-Token does not match
+     ADMIN_TOKEN or ADMIN_TOKEN is not set
+    """
+
+    def __init__(
+            self,
+            status_code: int,
+            detail: str,
+            headers=None
+    ) -> None:
+        super().__init__(status_code=status_code, detail=detail, headers=headers)
@@ -1,11 +1,20 @@
 # Packages
+import os
 import base64
+import hashlib
 import string
 import random
-from typing import Any, Dict, Optional, AnyStr
+import tempfile
+import uuid
+import aiofiles
+import aiofiles.os
+from typing import Any, Dict, Optional, AnyStr, Tuple
 from dataclasses import dataclass, field, asdict
 from fastapi import UploadFile
 
+# Modules
+from app.config import UPLOAD_CHUNK_SIZE, CONTENT_HASH_ALGORITHM
+
 
 @dataclass
 class ReturnValue:
@@ -41,6 +50,23 @@ class Helper:
         return ''.join(random.choices(string.ascii_letters +
                                       string.digits, k=l))
 
+    @staticmethod
+    def is_valid_uuid(value: str) -> bool:
+        """
+        Check whether value is a valid uuid
+
+        Args:
+            value: value to be checked
+
+        Returns:
+            bool: True if value is a valid uuid
+        """
+        try:
+            uuid.UUID(str(value))
+        except ValueError:
+            return False
+        return True
+
     @staticmethod
     def get_file_extension(file: UploadFile) -> AnyStr:
         """
@@ -65,6 +91,92 @@ class Helper:
         with open(file_path, "wb+") as fb:
             fb.write(file_data)
 
+    @staticmethod
+    def spool_file(
+            file: UploadFile,
+            file_path: str,
+            chunk_size: int = UPLOAD_CHUNK_SIZE
+    ) -> Tuple[int, AnyStr]:
+        """
+        Streams an uploaded file into local storage in fixed size chunks.
+        Data is written into a temporary file next to the destination and
+        atomically renamed, so readers never see a partially written file.
+        Content hash is computed from the same chunks.
+
+        Args:
+            file: UploadFile instance
+            file_path: filename including path to be store
+            chunk_size: number of bytes copied per read
+
+        Returns:
+            tuple: number of bytes written and hex digest of contents
+        """
+        directory = os.path.dirname(file_path) or "."
+        digest = hashlib.new(CONTENT_HASH_ALGORITHM)
+        size = 0
+        file.file.seek(0)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as fb:
+                while chunk := file.file.read(chunk_size):
+                    digest.update(chunk)
+                    fb.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        return size, digest.hexdigest()
+
+    @staticmethod
+    async def spool_file_async(
+            file: UploadFile,
+            file_path: str,
+            chunk_size: int = UPLOAD_CHUNK_SIZE
+    ) -> Tuple[int, AnyStr]:
+        """
+        Async variant of spool_file, chunks are read from the upload and
+        written to storage without blocking the event loop
+
+        Args:
+            file: UploadFile instance
+            file_path: filename including path to be store
+            chunk_size: number of bytes copied per read
+
+        Returns:
+            tuple: number of bytes written and hex digest of contents
+        """
+        directory = os.path.dirname(file_path) or "."
+        digest = hashlib.new(CONTENT_HASH_ALGORITHM)
+        size = 0
+        await file.seek(0)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+        os.close(fd)
+        try:
+            async with aiofiles.open(tmp_path, "wb") as fb:
+                while chunk := await file.read(chunk_size):
+                    digest.update(chunk)
+                    await fb.write(chunk)
+                    size += len(chunk)
+            await aiofiles.os.rename(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        return size, digest.hexdigest()
+
+    @staticmethod
+    def remove_file(file_path: str) -> None:
+        """
+        Removes file from local storage if it exists
+
+        Args:
+            file_path: filename including path
+        """
+        if file_path and os.path.exists(file_path):
+            os.unlink(file_path)
+
     @staticmethod
     def encode_bytes_to_base64_string(data: bytes) -> AnyStr:
         """
@@ -99,7 +211,7 @@ class Helper:
         Returns:
             bytes: contents of file
         """
-        with open(file_path) as file:
+        with open(file_path, "rb") as file:
             return file.read()
 
     @staticmethod
@@ -0,0 +1,215 @@
+# Packages
+import os
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AnyStr, Dict, Iterable, Iterator, List, Optional, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge, Histogram, \
+    generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+# Modules
+from app.config import METRICS_MULTIPROCESS
+
+# Size buckets of files, labels of stage histograms
+SIZE_BUCKETS = ((100 * 1024, "<100KB"), (1024 ** 2, "<1MB"), (10 * 1024 ** 2, "<10MB"), (100 * 1024 ** 2, "<100MB"))
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "image_converter_stage_seconds",
+    "Duration of pipeline stages: request_parse, spool, probe, store, db_insert, publish, queue_wait, "
+    "fetch, decode, transform, encode and status_commit",
+    ["stage", "file_type", "size_bucket"],
+    buckets=STAGE_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    "image_converter_in_flight",
+    "Requests and tasks in flight",
+    ["kind"],
+    multiprocess_mode="livesum",
+)
+
+# File type and size bucket of the file being processed by the current task or request
+_labels: ContextVar[Tuple[str, str]] = ContextVar("metric_labels", default=("unknown", "unknown"))
+# Collectors computing their metrics on scrape
+_collectors: List = []
+
+
+class MetricsHelper:
+    """
+    Helper class for Prometheus metrics of API and workers. Stages are
+    labeled with type and size bucket of the file they process.
+    """
+
+    @staticmethod
+    def get_size_bucket(size: Optional[int]) -> AnyStr:
+        if size is None:
+            return "unknown"
+        for limit, label in SIZE_BUCKETS:
+            if size < limit:
+                return label
+        return f">={SIZE_BUCKETS[-1][1][1:]}"
+
+    @staticmethod
+    def get_labels() -> Tuple[str, str]:
+        return _labels.get()
+
+    @staticmethod
+    def set_labels(labels: Optional[Tuple[str, str]]) -> None:
+        """
+        Set labels of stages of the current task, None resets them
+
+        Args:
+            labels: file type and size bucket
+        """
+        _labels.set(labels or ("unknown", "unknown"))
+
+    @staticmethod
+    @contextmanager
+    def labels(file_type: Optional[str], size: Optional[int]) -> Iterator[None]:
+        """
+        Label stages measured within the block with file type and size bucket
+
+        Args:
+            file_type: type of file (png, jpeg, pdf, etc.)
+            size: size of file in bytes
+        """
+        token = _labels.set((file_type or "unknown", MetricsHelper.get_size_bucket(size)))
+        try:
+            yield
+        finally:
+            _labels.reset(token)
+
+    @staticmethod
+    @contextmanager
+    def file_labels(file_path: str, file_type: str = None) -> Iterator[None]:
+        """
+        Label stages measured within the block with type and size of file
+
+        Args:
+            file_path: path of file
+            file_type: type of file, defaults to extension of file_path
+        """
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = None
+        file_type = file_type or os.path.splitext(file_path)[1][1:].lower().replace("jpg", "jpeg")
+        with MetricsHelper.labels(file_type, size):
+            yield
+
+    @staticmethod
+    @contextmanager
+    def stage(name: str) -> Iterator[None]:
+        """
+        Measure duration of stage, failed stages are measured as well
+
+        Args:
+            name: name of stage
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            MetricsHelper.observe(name, time.perf_counter() - started)
+
+    @staticmethod
+    def observe(name: str, seconds: float, labels: Tuple[str, str] = None) -> None:
+        STAGE_SECONDS.labels(name, *(labels or _labels.get())).observe(seconds)
+
+    @staticmethod
+    def get_headers(file_type: Optional[str], size: Optional[int]) -> Dict:
+        """
+        Get message headers carrying labels of file to the worker, the
+        queue wait of the task is labeled with them
+
+        Args:
+            file_type: type of file
+            size: size of file in bytes
+
+        Returns:
+            dict: celery message headers
+        """
+        return {"metric_file_type": file_type or "unknown",
+                "metric_size_bucket": MetricsHelper.get_size_bucket(size)}
+
+    @staticmethod
+    def get_registry() -> CollectorRegistry:
+        """
+        Get registry to be exported. Processes forked by gunicorn or the
+        prefork pool write their metrics into PROMETHEUS_MULTIPROC_DIR,
+        which is aggregated on every scrape.
+
+        Returns:
+            CollectorRegistry: registry of metrics
+        """
+        if not METRICS_MULTIPROCESS:
+            return REGISTRY
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in _collectors:
+            registry.register(collector)
+        return registry
+
+    @staticmethod
+    def register(collector) -> None:
+        """
+        Register collector computing its metrics on scrape
+
+        Args:
+            collector: prometheus collector
+        """
+        _collectors.append(collector)
+        if not METRICS_MULTIPROCESS:
+            REGISTRY.register(collector)
+
+    @staticmethod
+    def render() -> Tuple[bytes, str]:
+        """
+        Render metrics in Prometheus text format
+
+        Returns:
+            tuple: body and content type
+        """
+        return generate_latest(MetricsHelper.get_registry()), CONTENT_TYPE_LATEST
+
+
+class QueueDepthCollector:
+    """
+    Reports messages ready and consumers of broker queues on scrape. The
+    queues are declared passively, so scraping never creates them.
+    """
+
+    def __init__(self, celery_app, queue_names: Iterable[str]):
+        self._celery_app = celery_app
+        self._queue_names = list(queue_names)
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        depth = GaugeMetricFamily("image_converter_queue_depth", "Messages ready in broker queue",
+                                  labels=["queue"])
+        consumers = GaugeMetricFamily("image_converter_queue_consumers", "Consumers of broker queue",
+                                      labels=["queue"])
+        try:
+            with self._celery_app.connection_for_read() as connection:
+                for name in self._queue_names:
+                    # a missing queue closes the channel, so every queue gets its own
+                    channel = connection.channel()
+                    try:
+                        _, message_count, consumer_count = channel.queue_declare(queue=name, passive=True)
+                        depth.add_metric([name], message_count)
+                        consumers.add_metric([name], consumer_count)
+                    except Exception as e:
+                        logging.debug(f"Queue {name} not available: {e}")
+                    finally:
+                        try:
+                            channel.close()
+                        except Exception:
+                            pass
+        except Exception as e:
+            logging.warning(f"Failed to read queue depth: {e}")
+
+        yield depth
+        yield consumers
+
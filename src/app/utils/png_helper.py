@@ -0,0 +1,170 @@
+# Packages
+import os
+import zlib
+import shutil
+import struct
+import tempfile
+import threading
+import subprocess
+from typing import BinaryIO, Iterator, List, Tuple
+
+# Modules
+from app.config import PARALLEL_DEFLATE_THREADS
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+IDAT_CHUNK_SIZE = 1024 * 1024
+
+
+class PngHelper:
+    """
+    Helper class for rewriting the image data of png files
+    """
+
+    @staticmethod
+    def is_parallel_deflate_available() -> bool:
+        """
+        Check whether multithreaded deflate (pigz) is installed
+
+        Returns:
+            bool: True if pigz is available
+        """
+        return shutil.which("pigz") is not None
+
+    @staticmethod
+    def _read_chunk_headers(file: BinaryIO) -> List[Tuple[bytes, int, int]]:
+        """
+        Read chunk headers of png file, chunk data is skipped
+
+        Args:
+            file: png file opened in binary mode
+
+        Returns:
+            list: list of chunk type, offset and length of chunk data
+        """
+        if file.read(8) != PNG_SIGNATURE:
+            raise ValueError(f"{file.name} is not a png file")
+
+        chunks = []
+        while header := file.read(8):
+            length, chunk_type = struct.unpack(">I4s", header)
+            chunks.append((chunk_type, file.tell(), length))
+            file.seek(length + 4, 1)
+        return chunks
+
+    @staticmethod
+    def _read_data(file: BinaryIO, offset: int, length: int) -> Iterator[bytes]:
+        """
+        Read chunk data in blocks of at most IDAT_CHUNK_SIZE bytes
+
+        Args:
+            file: png file opened in binary mode
+            offset: offset of chunk data
+            length: length of chunk data
+
+        Returns:
+            Iterator: blocks of chunk data
+        """
+        file.seek(offset)
+        while length > 0:
+            block = file.read(min(length, IDAT_CHUNK_SIZE))
+            if not block:
+                raise ValueError(f"{file.name} is truncated")
+            length -= len(block)
+            yield block
+
+    @staticmethod
+    def _write_chunk(file, chunk_type: bytes, data: bytes) -> None:
+        file.write(struct.pack(">I", len(data)))
+        file.write(chunk_type)
+        file.write(data)
+        file.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+    @staticmethod
+    def _inflate(source: BinaryIO, idat: List[Tuple[bytes, int, int]], sink: BinaryIO) -> None:
+        """
+        Inflate image data of IDAT chunks into sink block by block
+
+        Args:
+            source: png file opened in binary mode
+            idat: IDAT chunk headers
+            sink: writable file, closed once all data is written
+        """
+        decompressor = zlib.decompressobj()
+        try:
+            for _, offset, length in idat:
+                for block in PngHelper._read_data(source, offset, length):
+                    while block:
+                        sink.write(decompressor.decompress(block, IDAT_CHUNK_SIZE))
+                        block = decompressor.unconsumed_tail
+            if not decompressor.eof:
+                raise ValueError(f"{source.name} has truncated image data")
+        finally:
+            sink.close()
+
+    @staticmethod
+    def recompress(
+            file_path: str,
+            level: int = 6,
+            threads: int = PARALLEL_DEFLATE_THREADS
+    ) -> None:
+        """
+        Recompress image data of png file with multithreaded pigz. The file
+        is expected to be written with compression level 0 so inflating it
+        is a plain copy, filtering chosen by the encoder is kept. Image data
+        is streamed through pigz in blocks of IDAT_CHUNK_SIZE, it is never
+        held in memory as a whole.
+
+        Args:
+            file_path: path of png file
+            level: zlib compression level
+            threads: number of compression threads
+        """
+        directory = os.path.dirname(file_path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+        try:
+            with open(file_path, "rb") as source, os.fdopen(fd, "wb") as file:
+                chunks = PngHelper._read_chunk_headers(source)
+                idat = [chunk for chunk in chunks if chunk[0] == b"IDAT"]
+                if not idat:
+                    raise ValueError(f"{file_path} has no image data")
+                first = chunks.index(idat[0])
+                last = chunks.index(idat[-1])
+
+                file.write(PNG_SIGNATURE)
+                for chunk_type, offset, length in chunks[:first]:
+                    PngHelper._write_chunk(file, chunk_type, b"".join(PngHelper._read_data(source, offset, length)))
+
+                process = subprocess.Popen(["pigz", "-z", f"-{level}", "-p", str(threads), "-c"],
+                                           stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                errors = []
+
+                def inflate():
+                    try:
+                        PngHelper._inflate(source, idat, process.stdin)
+                    except BaseException as error:
+                        errors.append(error)
+
+                # pigz is fed from a thread while its output is read here,
+                # either side blocks once its pipe is full. source is only
+                # read by the thread until it is joined.
+                feeder = threading.Thread(target=inflate, name="png-inflate", daemon=True)
+                feeder.start()
+                try:
+                    while data := process.stdout.read(IDAT_CHUNK_SIZE):
+                        PngHelper._write_chunk(file, b"IDAT", data)
+                finally:
+                    process.stdout.close()
+                    feeder.join()
+                    process.wait()
+                if errors:
+                    raise errors[0]
+                if process.returncode:
+                    raise subprocess.CalledProcessError(process.returncode, process.args)
+
+                # chunks between IDAT chunks are not allowed, the rest follows the image data
+                for chunk_type, offset, length in chunks[last + 1:]:
+                    PngHelper._write_chunk(file, chunk_type, b"".join(PngHelper._read_data(source, offset, length)))
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
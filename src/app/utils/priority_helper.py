@@ -0,0 +1,57 @@
+# Packages
+import math
+from typing import Type
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+# Modules
+from app.models import FilesTable
+from app.config import QUEUE_MAX_PRIORITY, SMALL_JOB_COST, TENANT_FAIR_SHARE
+
+IN_FLIGHT_STATUSES = ("uploading", "uploaded", "processing")
+
+
+class PriorityHelper:
+    """
+    Helper class for RabbitMQ priorities of tasks. Cheap jobs go first and
+    tenants with a large backlog yield to the others.
+    """
+
+    @staticmethod
+    def get_tenant_backlog(db: Session, file_model: Type[FilesTable], tenant_id: str) -> int:
+        """
+        Count in-flight files of tenant
+
+        Args:
+            db: sqlalchemy instance
+            file_model: FilesTable instance
+            tenant_id: tenant id
+
+        Returns:
+            int: number of files not completed or failed yet
+        """
+        return db.query(func.count(file_model.id)).filter(
+            file_model.tenant_id == tenant_id,
+            file_model.status.in_(IN_FLIGHT_STATUSES)
+        ).scalar()
+
+    @staticmethod
+    def get_priority(size: int, pages: int = 1, backlog: int = 0) -> int:
+        """
+        Get priority of task from its estimated cost and tenant backlog
+
+        Args:
+            size: size of file in bytes
+            pages: number of pages of file
+            backlog: number of in-flight files of tenant
+
+        Returns:
+            int: priority between 0 (last) and QUEUE_MAX_PRIORITY - 1 (first)
+        """
+        cost = max(size or 0, 1) * max(pages or 1, 1)
+        priority = QUEUE_MAX_PRIORITY - 1
+        if cost > SMALL_JOB_COST:
+            priority -= math.ceil(math.log(cost / SMALL_JOB_COST, 4))
+        if backlog > TENANT_FAIR_SHARE:
+            priority -= math.ceil(math.log2(backlog / TENANT_FAIR_SHARE))
+        return max(priority, 0)
@@ -0,0 +1,495 @@
+# Packages
+import re
+import struct
+from typing import AnyStr, BinaryIO, Dict, List, Optional, Tuple
+from dataclasses import dataclass, asdict
+
+# Modules
+from app.utils.wand_helper import WandHelper
+
+# Density assumed by ImageMagick when the file does not define one
+DEFAULT_DPI = 72
+# startxref is within the last 1024 bytes of a pdf file, objects and
+# trailers of the page tree are read in windows of PDF_READ_SIZE
+PDF_TAIL_SIZE = 1024
+PDF_READ_SIZE = 64 * 1024
+# Bound on incremental updates followed through /Prev and on levels of the
+# page tree descended for the media box
+PDF_MAX_XREF_SECTIONS = 256
+PDF_MAX_TREE_DEPTH = 32
+# Bound on arrays and dictionaries nested in one object
+PDF_MAX_NESTING_DEPTH = 64
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+PDF_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+PDF_XREF_SUBSECTION = re.compile(rb"\s*(\d+)\s+(\d+)\s*")
+PDF_XREF_ENTRY = re.compile(rb"(\d{10}) (\d{5}) ([nf])")
+PDF_OBJECT_HEADER = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj\s*")
+PDF_REFERENCE = re.compile(rb"(\d+)\s+(\d+)\s+R")
+PDF_INTEGER = re.compile(rb"\d+")
+PDF_MEDIA_BOX = re.compile(rb"\[\s*([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s*\]")
+PDF_WHITESPACE = b"\x00\t\n\x0c\r "
+PDF_DELIMITERS = b"()<>[]{}/%"
+
+
+@dataclass
+class ImageMetadata:
+    """ImageMetadata holds the values read from file headers
+    Args:
+        format: format of file (png, jpeg, pdf)
+        width: width in pixels (points for pdf)
+        height: height in pixels (points for pdf)
+        resolution: density of file (e.g. 72x72)
+        page_count: number of pages of pdf file
+        media_box: media box of first pdf page
+    """
+    format: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    resolution: Optional[str] = None
+    page_count: Optional[int] = None
+    media_box: Optional[List[float]] = None
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class ProbeHelper:
+    """
+    Reads image metadata from file headers without decoding pixel data.
+    Formats which are not understood fall back to pinging the file with
+    Wand.
+    """
+
+    @staticmethod
+    def probe(file_path: str) -> ImageMetadata:
+        """
+        Probe metadata of file
+
+        Args:
+            file_path: path of file
+
+        Returns:
+            ImageMetadata: metadata of file
+        """
+        with open(file_path, "rb") as file:
+            head = file.read(8)
+            file.seek(0)
+            try:
+                if head.startswith(PNG_SIGNATURE):
+                    metadata = ProbeHelper._probe_png(file)
+                elif head.startswith(b"\xff\xd8"):
+                    metadata = ProbeHelper._probe_jpeg(file)
+                elif head.startswith(b"%PDF"):
+                    metadata = ProbeHelper._probe_pdf(file)
+                else:
+                    metadata = None
+            except (struct.error, ValueError):
+                metadata = None
+
+        if metadata is None:
+            metadata = ImageMetadata(**WandHelper.get_metadata(file_path))
+
+        return metadata
+
+    @staticmethod
+    def _format_resolution(x: float, y: float) -> AnyStr:
+        return f"{int(round(x))}x{int(round(y))}"
+
+    @staticmethod
+    def _probe_png(file: BinaryIO) -> Optional[ImageMetadata]:
+        """
+        Read IHDR and pHYs chunks of png file
+
+        Args:
+            file: png file opened in binary mode
+
+        Returns:
+            ImageMetadata: metadata of file or None if IHDR is missing
+        """
+        file.seek(len(PNG_SIGNATURE))
+        metadata = None
+        resolution = ProbeHelper._format_resolution(DEFAULT_DPI, DEFAULT_DPI)
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type == b"IHDR":
+                width, height = struct.unpack(">II", file.read(8))
+                metadata = ImageMetadata("png", width, height)
+                file.seek(length - 8 + 4, 1)
+            elif chunk_type == b"pHYs":
+                ppu_x, ppu_y, unit = struct.unpack(">IIB", file.read(9))
+                if unit == 1:
+                    # pixels per meter
+                    resolution = ProbeHelper._format_resolution(ppu_x * 0.0254, ppu_y * 0.0254)
+                file.seek(length - 9 + 4, 1)
+            elif chunk_type in (b"IDAT", b"IEND"):
+                # pHYs must appear before the image data
+                break
+            else:
+                file.seek(length + 4, 1)
+
+        if metadata is not None:
+            metadata.resolution = resolution
+        return metadata
+
+    @staticmethod
+    def _probe_jpeg(file: BinaryIO) -> Optional[ImageMetadata]:
+        """
+        Read SOF, JFIF and EXIF density segments of jpeg file
+
+        Args:
+            file: jpeg file opened in binary mode
+
+        Returns:
+            ImageMetadata: metadata of file or None if SOF is missing
+        """
+        file.seek(2)
+        size = None
+        jfif_resolution = None
+        exif_resolution = None
+        while size is None:
+            marker = file.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                break
+            code = marker[1]
+            if code == 0xFF:
+                # fill byte
+                file.seek(-1, 1)
+                continue
+            if code in (0x01, *range(0xD0, 0xD8)):
+                # standalone markers
+                continue
+            if code in (0xD9, 0xDA):
+                break
+
+            length = struct.unpack(">H", file.read(2))[0]
+            segment = file.read(length - 2)
+            if code in JPEG_SOF_MARKERS:
+                height, width = struct.unpack(">HH", segment[1:5])
+                size = (width, height)
+            elif code == 0xE0 and segment.startswith(b"JFIF\x00"):
+                units, x, y = struct.unpack(">BHH", segment[7:12])
+                if units and x and y:
+                    scale = 2.54 if units == 2 else 1
+                    jfif_resolution = (x * scale, y * scale)
+            elif code == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+                exif_resolution = ProbeHelper._read_exif_resolution(segment[6:])
+
+        if size is None:
+            return None
+
+        x, y = exif_resolution or jfif_resolution or (DEFAULT_DPI, DEFAULT_DPI)
+        return ImageMetadata("jpeg", size[0], size[1], ProbeHelper._format_resolution(x, y))
+
+    @staticmethod
+    def _read_exif_resolution(tiff: bytes) -> Optional[Tuple[float, float]]:
+        """
+        Read XResolution, YResolution and ResolutionUnit from IFD0 of exif
+
+        Args:
+            tiff: tiff structure of exif segment
+
+        Returns:
+            tuple: density in dots per inch or None if not defined
+        """
+        endian = "<" if tiff[:2] == b"II" else ">"
+        offset = struct.unpack(f"{endian}I", tiff[4:8])[0]
+        count = struct.unpack(f"{endian}H", tiff[offset:offset + 2])[0]
+        values = {}
+        unit = 2
+        for i in range(count):
+            entry = tiff[offset + 2 + i * 12:offset + 14 + i * 12]
+            tag, _, _, value = struct.unpack(f"{endian}HHI4s", entry)
+            if tag in (0x011A, 0x011B):
+                value_offset = struct.unpack(f"{endian}I", value)[0]
+                numerator, denominator = struct.unpack(f"{endian}II", tiff[value_offset:value_offset + 8])
+                if denominator:
+                    values[tag] = numerator / denominator
+            elif tag == 0x0128:
+                unit = struct.unpack(f"{endian}H", value[:2])[0]
+
+        if 0x011A not in values or 0x011B not in values:
+            return None
+
+        scale = 2.54 if unit == 3 else 1
+        return values[0x011A] * scale, values[0x011B] * scale
+
+    @staticmethod
+    def _probe_pdf(file: BinaryIO) -> Optional[ImageMetadata]:
+        """
+        Read page count and media box from pdf page tree. Only the objects
+        on the way from the trailer to the root of the page tree
+        (/Root -> /Pages -> /Count) and down to the first page are read,
+        nothing is rendered. The page count is left unset when the tree is
+        not reachable through cross-reference tables, e.g. when it is
+        stored in compressed object streams, and split_pdf counts pages
+        with Wand instead.
+
+        Args:
+            file: pdf file opened in binary mode
+
+        Returns:
+            ImageMetadata: metadata of file
+        """
+        metadata = ImageMetadata("pdf", resolution=ProbeHelper._format_resolution(DEFAULT_DPI, DEFAULT_DPI))
+        try:
+            page_count, media_box = PdfReader(file).read_page_tree()
+        except (struct.error, ValueError, KeyError):
+            return metadata
+
+        metadata.page_count = page_count
+        if media_box:
+            metadata.media_box = media_box
+            metadata.width = int(round(abs(media_box[2] - media_box[0])))
+            metadata.height = int(round(abs(media_box[3] - media_box[1])))
+        return metadata
+
+
+class PdfReader:
+    """
+    Minimal reader of pdf objects addressed by cross-reference tables.
+    The newest cross-reference section, the one startxref points to, is
+    searched first, so objects replaced by incremental updates resolve to
+    their latest version. Malformed files raise ValueError.
+    """
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+        self._sections: List[Tuple[int, int, int]] = []
+        self._trailer: Dict[bytes, bytes] = {}
+
+    def read_page_tree(self) -> Tuple[int, Optional[List[float]]]:
+        """
+        Read page count of root of page tree and media box of first page
+
+        Returns:
+            tuple: page count and media box (None if not found)
+        """
+        self._read_xref()
+        catalog = self.read_object(self._trailer[b"/Root"])
+        pages = self.read_object(catalog[b"/Pages"])
+        if pages.get(b"/Type") != b"/Pages":
+            raise ValueError("Root of page tree is not a /Pages node")
+        count = pages[b"/Count"]
+        if not PDF_INTEGER.fullmatch(count):
+            raise ValueError(f"Page count is not an integer: {count!r}")
+
+        # media box is inherited, the nearest node defining it wins
+        node = pages
+        media_box = node.get(b"/MediaBox")
+        for _ in range(PDF_MAX_TREE_DEPTH):
+            if node.get(b"/Type") != b"/Pages":
+                break
+            kids = PDF_REFERENCE.search(node.get(b"/Kids", b""))
+            if not kids:
+                break
+            node = self.read_object(kids.group(0))
+            media_box = node.get(b"/MediaBox", media_box)
+
+        match = PDF_MEDIA_BOX.fullmatch(media_box) if media_box else None
+        return int(count), [float(value) for value in match.groups()] if match else None
+
+    def read_object(self, reference: bytes) -> Dict[bytes, bytes]:
+        """
+        Read dictionary of indirect object
+
+        Args:
+            reference: indirect reference (e.g. b"12 0 R")
+
+        Returns:
+            dict: raw values of dictionary by key
+        """
+        match = PDF_REFERENCE.fullmatch(reference)
+        if not match:
+            raise ValueError(f"Not an indirect reference: {reference!r}")
+        number, generation = int(match.group(1)), int(match.group(2))
+        offset = self._find_object(number)
+        data = self._read_at(offset, PDF_READ_SIZE)
+        header = PDF_OBJECT_HEADER.match(data)
+        if not header or (int(header.group(1)), int(header.group(2))) != (number, generation):
+            raise ValueError(f"Object {number} {generation} not found at offset {offset}")
+        return self.parse_dict(data, header.end())[0]
+
+    def _read_at(self, offset: int, size: int) -> bytes:
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def _read_xref(self) -> None:
+        """
+        Read subsections of every cross-reference table from the newest to
+        the oldest one along with the newest trailer
+        """
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        tail = self._read_at(max(0, size - PDF_TAIL_SIZE), PDF_TAIL_SIZE)
+        matches = PDF_STARTXREF.findall(tail)
+        if not matches:
+            raise ValueError("startxref not found")
+
+        offset = int(matches[-1])
+        seen = set()
+        while offset not in seen and len(seen) < PDF_MAX_XREF_SECTIONS:
+            seen.add(offset)
+            trailer = self._read_xref_section(offset)
+            if not self._trailer:
+                self._trailer = trailer
+            if b"/Prev" not in trailer:
+                break
+            offset = int(trailer[b"/Prev"])
+
+    def _read_xref_section(self, offset: int) -> Dict[bytes, bytes]:
+        """
+        Read subsections of cross-reference table, entries are not read
+        until an object is looked up
+
+        Args:
+            offset: offset of cross-reference table
+
+        Returns:
+            dict: trailer of cross-reference table
+        """
+        if self._read_at(offset, 4) != b"xref":
+            # cross-reference streams are compressed
+            raise ValueError(f"No cross-reference table at offset {offset}")
+
+        position = offset + 4
+        while True:
+            window = self._read_at(position, 64)
+            if window.lstrip(PDF_WHITESPACE).startswith(b"trailer"):
+                data = self._read_at(position, PDF_READ_SIZE)
+                return self.parse_dict(data, data.index(b"<<"))[0]
+            match = PDF_XREF_SUBSECTION.match(window)
+            if not match:
+                raise ValueError(f"Malformed cross-reference table at offset {offset}")
+            first, count = int(match.group(1)), int(match.group(2))
+            # entries are 20 bytes long, end of line included
+            self._sections.append((first, count, position + match.end()))
+            position += match.end() + count * 20
+
+    def _find_object(self, number: int) -> int:
+        """
+        Find offset of object in the newest cross-reference table listing it
+
+        Args:
+            number: object number
+
+        Returns:
+            int: offset of object
+        """
+        for first, count, position in self._sections:
+            if first <= number < first + count:
+                entry = PDF_XREF_ENTRY.match(self._read_at(position + (number - first) * 20, 20))
+                if not entry:
+                    raise ValueError(f"Malformed cross-reference entry of object {number}")
+                if entry.group(3) != b"n":
+                    raise ValueError(f"Object {number} is free")
+                return int(entry.group(1))
+        raise ValueError(f"Object {number} is not listed in cross-reference tables")
+
+    @staticmethod
+    def parse_dict(data: bytes, position: int, depth: int = 0) -> Tuple[Dict[bytes, bytes], int]:
+        """
+        Parse dictionary into raw values of its keys, nested dictionaries,
+        arrays and strings are kept as is
+
+        Args:
+            data: pdf data
+            position: position of "<<" in data
+            depth: arrays and dictionaries enclosing the dictionary
+
+        Returns:
+            tuple: raw values by key and position after the dictionary
+
+        Raises:
+            ValueError: dictionary is malformed or nested too deeply
+        """
+        if not data.startswith(b"<<", position):
+            raise ValueError(f"No dictionary at position {position}")
+        if depth > PDF_MAX_NESTING_DEPTH:
+            raise ValueError(f"Dictionary at position {position} is nested too deeply")
+        position += 2
+        entries = {}
+        while True:
+            position = PdfReader._skip_whitespace(data, position)
+            if data.startswith(b">>", position):
+                return entries, position + 2
+            end = PdfReader._skip_value(data, position, depth)
+            key = data[position:end]
+            if not key.startswith(b"/"):
+                raise ValueError(f"Dictionary key is not a name: {key!r}")
+
+            start = PdfReader._skip_whitespace(data, end)
+            reference = PDF_REFERENCE.match(data, start)
+            position = reference.end() if reference else PdfReader._skip_value(data, start, depth)
+            entries[key] = data[start:position]
+
+    @staticmethod
+    def _skip_whitespace(data: bytes, position: int) -> int:
+        while position < len(data):
+            if data[position] in PDF_WHITESPACE:
+                position += 1
+            elif data[position] == ord("%"):
+                end = data.find(b"\n", position)
+                position = len(data) if end < 0 else end + 1
+            else:
+                return position
+        raise ValueError("Unexpected end of data")
+
+    @staticmethod
+    def _skip_value(data: bytes, position: int, depth: int = 0) -> int:
+        """
+        Skip one pdf object (name, number, string, array or dictionary)
+
+        Args:
+            data: pdf data
+            position: position of object
+            depth: arrays and dictionaries enclosing the object
+
+        Returns:
+            int: position after the object
+        """
+        if data.startswith(b"<<", position):
+            return PdfReader.parse_dict(data, position, depth + 1)[1]
+
+        char = data[position:position + 1]
+        if char == b"<":
+            end = data.find(b">", position)
+            if end < 0:
+                raise ValueError("Unterminated hex string")
+            return end + 1
+        if char == b"[":
+            if depth > PDF_MAX_NESTING_DEPTH:
+                raise ValueError(f"Array at position {position} is nested too deeply")
+            position += 1
+            while True:
+                position = PdfReader._skip_whitespace(data, position)
+                if data.startswith(b"]", position):
+                    return position + 1
+                position = PdfReader._skip_value(data, position, depth + 1)
+        if char == b"(":
+            depth = 0
+            while position < len(data):
+                if data[position] == ord("\\"):
+                    position += 2
+                    continue
+                if data[position] == ord("("):
+                    depth += 1
+                elif data[position] == ord(")"):
+                    depth -= 1
+                    if not depth:
+                        return position + 1
+                position += 1
+            raise ValueError("Unterminated string")
+        if not char or char in b")>]{}":
+            raise ValueError(f"Unexpected {char!r} at position {position}")
+
+        # names, numbers and keywords run until whitespace or a delimiter
+        end = position + 1
+        while end < len(data) and data[end] not in PDF_WHITESPACE and data[end] not in PDF_DELIMITERS:
+            end += 1
+        return end
@@ -0,0 +1,51 @@
+"""Reports output size and conversion time of every conversion profile
+
+Usage: python -m app.utils.profile_report image.jpg [image.png ...]
+"""
+# Packages
+import os
+import sys
+import json
+import time
+import tempfile
+from typing import Dict, List
+
+# Modules
+from app.utils.conversion_profile import PROFILES
+from app.utils.wand_helper import WandHelper
+
+
+def report_profiles(file_path: str) -> List[Dict]:
+    """
+    Convert file with every profile and measure the size/time trade-off
+
+    Args:
+        file_path: path of file
+
+    Returns:
+        list: decode and convert seconds, output bytes and dimensions per profile
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, profile in PROFILES.items():
+            new_file_path = os.path.join(directory, f"{name}.png")
+            started = time.perf_counter()
+            with WandHelper.read_image(file_path, profile) as img:
+                decoded = time.perf_counter()
+                output = WandHelper.convert_image(img, new_file_path, profile)
+            finished = time.perf_counter()
+
+            results.append({"file": file_path,
+                            "profile": name,
+                            "decode_seconds": round(decoded - started, 4),
+                            "convert_seconds": round(finished - decoded, 4),
+                            "bytes": os.path.getsize(new_file_path),
+                            **output})
+
+    return results
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        for result in report_profiles(path):
+            print(json.dumps(result))
@@ -0,0 +1,213 @@
+# Packages
+import os
+import re
+import json
+import time
+import random
+import pstats
+import cProfile
+import logging
+import resource
+import threading
+from io import StringIO
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import AnyStr, Dict, Iterator, Optional
+
+# Modules
+from app.config import PROFILE_DIR, PROFILE_SAMPLE_RATE
+from app.utils.wand_helper import PROCESS_LIMITS, limits
+
+# ImageMagick resources sampled while a profiled task runs
+MAGICK_RESOURCES = ("memory", "map", "area", "disk", "file")
+MAGICK_SAMPLE_INTERVAL = 0.01
+PROFILE_TOP_FUNCTIONS = 40
+# Requests carrying ADMIN_TOKEN in this header are profiled
+PROFILE_HEADER = "X-Profile"
+UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class ProfilingSettings:
+    """
+    Share of tasks to profile, switched at runtime and optionally expiring
+    """
+
+    def __init__(self, rate: float = 0.0):
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._expires_at: Optional[float] = None
+
+    def set(self, rate: float, duration: float = None) -> Dict:
+        """
+        Profile share of tasks from now on
+
+        Args:
+            rate: share of tasks between 0 (off) and 1 (every task)
+            duration: seconds after which profiling switches off, None for no limit
+
+        Returns:
+            dict: current settings
+        """
+        if not 0 <= rate <= 1:
+            raise ValueError("Rate must be between 0 and 1")
+        with self._lock:
+            self._rate = rate
+            self._expires_at = time.time() + duration if duration and rate else None
+        return self.get()
+
+    def get(self) -> Dict:
+        with self._lock:
+            if self._expires_at is not None and time.time() >= self._expires_at:
+                self._rate, self._expires_at = 0.0, None
+            return {"rate": self._rate, "expires_at": self._expires_at}
+
+    def should_profile(self) -> bool:
+        rate = self.get()["rate"]
+        return rate > 0 and random.random() < rate
+
+
+class MagickUsageSampler:
+    """
+    Samples ImageMagick resource usage in a background thread and keeps
+    the peak of every resource. Usage is process wide, so conversions
+    running in other threads are included.
+    """
+
+    def __init__(self, interval: float = MAGICK_SAMPLE_INTERVAL):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="magick-sampler", daemon=True)
+        self.peaks = {name: 0 for name in MAGICK_RESOURCES}
+
+    def __enter__(self) -> "MagickUsageSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            for name in MAGICK_RESOURCES:
+                try:
+                    self.peaks[name] = max(self.peaks[name], int(limits.resource(name)))
+                except (ValueError, TypeError):
+                    pass
+            if self._stop.wait(self._interval):
+                return
+
+
+class ProfilingHelper:
+    """
+    Helper class for opt-in profiling of tasks and requests. A cProfile
+    trace (pstats format, e.g. for snakeviz) and a json summary with the
+    file id, cpu times and ImageMagick resource usage are written to
+    PROFILE_DIR.
+    """
+
+    @staticmethod
+    def find_file_id(value: str) -> Optional[str]:
+        match = UUID_PATTERN.search(value or "")
+        return match.group(0) if match else None
+
+    @staticmethod
+    def get_base_path(kind: str, name: str, file_id: Optional[str]) -> AnyStr:
+        """
+        Get path of profile without extension
+
+        Args:
+            kind: task or request
+            name: task name or request path
+            file_id: file id of task or request
+
+        Returns:
+            AnyStr: path in PROFILE_DIR
+        """
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")[:80]
+        return os.path.join(PROFILE_DIR, f"{timestamp}-{kind}-{name}-{file_id or 'none'}")
+
+    @staticmethod
+    @contextmanager
+    def sampled(kind: str, name: str, file_id: Optional[str] = None) -> Iterator[Optional[Dict]]:
+        """
+        Profile block if it is sampled at the current rate
+
+        Args:
+            kind: task or request
+            name: task name or request path
+            file_id: file id of task or request
+
+        Returns:
+            dict: summary of profile, None if the block is not profiled
+        """
+        if not profiling_settings.should_profile():
+            yield None
+            return
+        with ProfilingHelper.profile(kind, name, file_id) as summary:
+            yield summary
+
+    @staticmethod
+    @contextmanager
+    def profile(kind: str, name: str, file_id: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Profile block with cProfile and sample ImageMagick resource usage.
+        Only the calling thread is profiled.
+
+        Args:
+            kind: task or request
+            name: task name or request path
+            file_id: file id of task or request
+
+        Returns:
+            dict: summary of profile, extended by the caller before it is written
+        """
+        summary = {"kind": kind, "name": name, "file_id": file_id, "pid": os.getpid(),
+                   "thread": threading.current_thread().name}
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with MagickUsageSampler() as sampler:
+            profiler.enable()
+            try:
+                yield summary
+            finally:
+                profiler.disable()
+                seconds = time.perf_counter() - started
+                ended = resource.getrusage(resource.RUSAGE_THREAD)
+                summary.update({
+                    "seconds": round(seconds, 6),
+                    "user_cpu_seconds": round(ended.ru_utime - usage.ru_utime, 6),
+                    "system_cpu_seconds": round(ended.ru_stime - usage.ru_stime, 6),
+                    "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                })
+        summary["magick_peak_usage"] = sampler.peaks
+        summary["magick_limits"] = PROCESS_LIMITS
+        ProfilingHelper.write(profiler, summary)
+
+    @staticmethod
+    def write(profiler: cProfile.Profile, summary: Dict) -> None:
+        """
+        Write trace and summary of profile, failures are logged only
+
+        Args:
+            profiler: disabled profiler
+            summary: summary of profile
+        """
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            base_path = ProfilingHelper.get_base_path(summary["kind"], summary["name"], summary["file_id"])
+            profiler.dump_stats(f"{base_path}.prof")
+
+            top = StringIO()
+            pstats.Stats(profiler, stream=top).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+            summary["top_functions"] = top.getvalue()
+            with open(f"{base_path}.json", "w") as file:
+                json.dump(summary, file, indent=2)
+            logging.info(f"Profile of {summary['kind']} {summary['name']} written to {base_path}.prof")
+        except OSError as e:
+            logging.warning(f"Failed to write profile: {e}")
+
+
+profiling_settings = ProfilingSettings(PROFILE_SAMPLE_RATE)
@@ -0,0 +1,500 @@
+# Packages
+import os
+import time
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import AnyStr, Callable, Iterator, NamedTuple, Optional, Tuple
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# Modules
+from app.config import STORAGE_BACKEND, STATIC_FILES_DIR, S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION, \
+    S3_MAX_POOL_CONNECTIONS, S3_MULTIPART_CHUNK_SIZE, S3_TRANSFER_CONCURRENCY, STORAGE_CACHE_DIR, \
+    STORAGE_CACHE_SIZE
+from app.utils.metrics_helper import MetricsHelper
+
+LOCAL_SCHEME = "file://"
+S3_SCHEME = "s3://"
+# Downloads of different objects share a bounded set of locks
+LOCK_BUCKETS = 256
+# Eviction frees space down to this share of STORAGE_CACHE_SIZE
+EVICTION_TARGET = 0.9
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class StorageStat(NamedTuple):
+    """Size and modification time of stored object, named like os.stat_result"""
+    st_size: int
+    st_mtime_ns: int
+
+
+class StorageCache:
+    """
+    Size bounded LRU of objects read from remote storage, kept on local
+    disk so repeated conversions of the same source are not downloaded
+    again. Concurrent reads of the same object wait for one download within
+    the process. Objects in use by this process are never evicted.
+    """
+
+    def __init__(self, directory: str = STORAGE_CACHE_DIR, max_bytes: int = STORAGE_CACHE_SIZE):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._locks = [threading.Lock() for _ in range(LOCK_BUCKETS)]
+        self._in_use_lock = threading.Lock()
+        self._in_use: Counter = Counter()
+
+    @property
+    def directory(self) -> AnyStr:
+        os.makedirs(self._directory, exist_ok=True)
+        return self._directory
+
+    def get_path(self, uri: str) -> AnyStr:
+        """
+        Get cache path of object, the extension is kept for ImageMagick
+
+        Args:
+            uri: storage uri of object
+
+        Returns:
+            AnyStr: path of cached object
+        """
+        name = hashlib.sha256(uri.encode()).hexdigest()[:40]
+        return os.path.join(self._directory, name + os.path.splitext(uri)[1])
+
+    @contextmanager
+    def open(self, uri: str, fetch: Callable[[str], None]) -> Iterator[str]:
+        """
+        Get local copy of object, downloading it on a miss
+
+        Args:
+            uri: storage uri of object
+            fetch: blocking function downloading the object to given path
+
+        Returns:
+            AnyStr: path of cached object, valid within the block
+        """
+        path = self.get_path(uri)
+        with self._in_use_lock:
+            self._in_use[path] += 1
+        try:
+            if not self._touch(path):
+                with self._locks[zlib.crc32(path.encode()) % LOCK_BUCKETS]:
+                    # another thread may have downloaded it while we waited
+                    if not os.path.exists(path):
+                        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".", suffix=".part")
+                        os.close(fd)
+                        try:
+                            with MetricsHelper.stage("fetch"):
+                                fetch(tmp_path)
+                            os.replace(tmp_path, path)
+                        except BaseException:
+                            os.unlink(tmp_path)
+                            raise
+                        self.evict()
+            yield path
+        finally:
+            with self._in_use_lock:
+                self._in_use[path] -= 1
+                if self._in_use[path] <= 0:
+                    del self._in_use[path]
+
+    def adopt(self, uri: str, file_path: str) -> None:
+        """
+        Move file just written to storage into the cache
+
+        Args:
+            uri: storage uri of object
+            file_path: path of local copy, on the file system of the cache
+        """
+        os.replace(file_path, self.get_path(uri))
+        self.evict()
+
+    def discard(self, uri: str) -> None:
+        try:
+            os.unlink(self.get_path(uri))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def evict(self) -> None:
+        """
+        Remove least recently used objects once the cache outgrows
+        STORAGE_CACHE_SIZE
+        """
+        entries = []
+        total = 0
+        with os.scandir(self._directory) as iterator:
+            for entry in iterator:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self._max_bytes:
+            return
+
+        entries.sort()
+        with self._in_use_lock:
+            in_use = set(self._in_use)
+        for _, size, path in entries:
+            if total <= self._max_bytes * EVICTION_TARGET:
+                break
+            if path in in_use:
+                continue
+            try:
+                os.unlink(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        logging.info(f"Evicted storage cache down to {total} bytes")
+
+
+class LocalStorage:
+    """
+    Objects in a directory shared by API and workers. Plain paths, as
+    written before storage URIs, are accepted wherever a URI is.
+    """
+
+    def __init__(self, directory: str = STATIC_FILES_DIR):
+        self._directory = directory
+
+    @property
+    def spool_dir(self) -> AnyStr:
+        # spooled uploads are renamed into place, so they live on the same file system
+        return self._directory
+
+    def get_uri(self, key: str) -> AnyStr:
+        return LOCAL_SCHEME + os.path.abspath(os.path.join(self._directory, key))
+
+    @staticmethod
+    def get_path(uri: str) -> AnyStr:
+        return uri[len(LOCAL_SCHEME):] if uri.startswith(LOCAL_SCHEME) else uri
+
+    def exists(self, uri: str) -> bool:
+        return os.path.exists(self.get_path(uri))
+
+    def stat(self, uri: str) -> StorageStat:
+        stat = os.stat(self.get_path(uri))
+        return StorageStat(stat.st_size, stat.st_mtime_ns)
+
+    @contextmanager
+    def reader(self, uri: str) -> Iterator[str]:
+        yield self.get_path(uri)
+
+    @contextmanager
+    def writer(self, uri: str) -> Iterator[str]:
+        """
+        Write object through a temp file next to it, renamed into place once
+        the block completes
+
+        Args:
+            uri: storage uri of object
+
+        Returns:
+            AnyStr: path of temp file to be written within the block
+        """
+        file_path = self.get_path(uri)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", prefix=".", suffix=".part")
+        os.close(fd)
+        try:
+            yield tmp_path
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def put_file(self, file_path: str, uri: str) -> None:
+        os.replace(file_path, self.get_path(uri))
+
+    def remove(self, uri: str) -> None:
+        file_path = self.get_path(uri)
+        if file_path and os.path.exists(file_path):
+            os.unlink(file_path)
+
+    def iter_range(self, uri: str, offset: int, count: int) -> Iterator[bytes]:
+        with open(self.get_path(uri), "rb") as file:
+            file.seek(offset)
+            while count > 0 and (chunk := file.read(min(READ_CHUNK_SIZE, count))):
+                count -= len(chunk)
+                yield chunk
+
+
+class S3Storage:
+    """
+    Objects in an S3 compatible store. Objects larger than
+    S3_MULTIPART_CHUNK_SIZE are uploaded in parts and downloaded with
+    parallel ranged reads. Every process keeps its own client, whose
+    connection pool is shared by its threads. Reads go through the local
+    cache and objects written by the process are added to it.
+    """
+
+    def __init__(self, bucket: str, prefix: str, cache: StorageCache):
+        self._bucket = bucket
+        self._prefix = prefix
+        self._cache = cache
+        self._client_lock = threading.Lock()
+        self._client: Optional[Tuple[int, object]] = None
+        self._transfer = TransferConfig(
+            multipart_threshold=S3_MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=S3_TRANSFER_CONCURRENCY,
+        )
+
+    @property
+    def client(self):
+        # clients are not shared with forked processes
+        with self._client_lock:
+            if self._client is None or self._client[0] != os.getpid():
+                client = boto3.session.Session().client(
+                    "s3",
+                    endpoint_url=S3_ENDPOINT_URL,
+                    region_name=S3_REGION,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": 5, "mode": "standard"},
+                        # MinIO and most stand-ins do not serve bucket subdomains
+                        s3={"addressing_style": "path" if S3_ENDPOINT_URL else "auto"},
+                    ),
+                )
+                self._client = (os.getpid(), client)
+            return self._client[1]
+
+    @property
+    def spool_dir(self) -> AnyStr:
+        # spooled uploads are adopted by the cache once uploaded, so they live
+        # on its file system but out of reach of eviction
+        directory = os.path.join(self._cache.directory, ".spool")
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def get_uri(self, key: str) -> AnyStr:
+        return f"{S3_SCHEME}{self._bucket}/{self._prefix}{key}"
+
+    @staticmethod
+    def parse_uri(uri: str) -> Tuple[str, str]:
+        bucket, _, key = uri[len(S3_SCHEME):].partition("/")
+        return bucket, key
+
+    def exists(self, uri: str) -> bool:
+        try:
+            self.stat(uri)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stat(self, uri: str) -> StorageStat:
+        bucket, key = self.parse_uri(uri)
+        try:
+            head = self.client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                raise FileNotFoundError(f"Object {uri} not found in storage") from e
+            raise
+        return StorageStat(head["ContentLength"], int(head["LastModified"].timestamp() * 1e9))
+
+    @contextmanager
+    def reader(self, uri: str) -> Iterator[str]:
+        bucket, key = self.parse_uri(uri)
+
+        def fetch(file_path: str) -> None:
+            started = time.perf_counter()
+            try:
+                self.client.download_file(bucket, key, file_path, Config=self._transfer)
+            except ClientError as e:
+                if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                    raise FileNotFoundError(f"Object {uri} not found in storage") from e
+                raise
+            logging.info(f"Downloaded {uri} in {time.perf_counter() - started:.3f}s")
+
+        with self._cache.open(uri, fetch) as file_path:
+            yield file_path
+
+    @contextmanager
+    def writer(self, uri: str) -> Iterator[str]:
+        """
+        Write object through a temp file in the cache, uploaded once the
+        block completes
+
+        Args:
+            uri: storage uri of object
+
+        Returns:
+            AnyStr: path of temp file to be written within the block
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache.directory, prefix=".", suffix=".part")
+        os.close(fd)
+        try:
+            yield tmp_path
+            self.put_file(tmp_path, uri)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def put_file(self, file_path: str, uri: str) -> None:
+        """
+        Upload local file, which is moved into the cache afterwards
+
+        Args:
+            file_path: path of local file, on the file system of the cache
+            uri: storage uri of object
+        """
+        bucket, key = self.parse_uri(uri)
+        with MetricsHelper.stage("store"):
+            self.client.upload_file(file_path, bucket, key, Config=self._transfer)
+        self._cache.adopt(uri, file_path)
+
+    def remove(self, uri: str) -> None:
+        bucket, key = self.parse_uri(uri)
+        self.client.delete_object(Bucket=bucket, Key=key)
+        self._cache.discard(uri)
+
+    def iter_range(self, uri: str, offset: int, count: int) -> Iterator[bytes]:
+        bucket, key = self.parse_uri(uri)
+        body = self.client.get_object(Bucket=bucket, Key=key,
+                                      Range=f"bytes={offset}-{offset + count - 1}")["Body"]
+        try:
+            yield from body.iter_chunks(READ_CHUNK_SIZE)
+        finally:
+            body.close()
+
+
+class StorageHelper:
+    """
+    Helper class for storage of originals and converted outputs. Files are
+    addressed by storage URI, new files are written to STORAGE_BACKEND and
+    existing ones are read from the backend of their URI.
+    """
+
+    @staticmethod
+    def get_driver(uri: str = None):
+        """
+        Get storage driver of URI
+
+        Args:
+            uri: storage uri or plain local path, None for STORAGE_BACKEND
+
+        Returns:
+            LocalStorage or S3Storage
+        """
+        if uri is None:
+            return storage
+        return s3_storage if uri.startswith(S3_SCHEME) else local_storage
+
+    @staticmethod
+    def is_local() -> bool:
+        return storage is local_storage
+
+    @staticmethod
+    def get_uri(key: str) -> AnyStr:
+        return storage.get_uri(key)
+
+    @staticmethod
+    def get_sibling_uri(uri: str, name: str) -> AnyStr:
+        """
+        Get URI of object named name next to uri
+
+        Args:
+            uri: storage uri or plain local path
+            name: name of sibling
+
+        Returns:
+            AnyStr: storage uri of sibling
+        """
+        directory, separator, _ = uri.rpartition("/")
+        return f"{directory}{separator}{name}"
+
+    @staticmethod
+    def get_spool_path(name: str) -> AnyStr:
+        return os.path.join(storage.spool_dir, name)
+
+    @staticmethod
+    def exists(uri: str) -> bool:
+        return StorageHelper.get_driver(uri).exists(uri)
+
+    @staticmethod
+    def stat(uri: str) -> StorageStat:
+        return StorageHelper.get_driver(uri).stat(uri)
+
+    @staticmethod
+    def reader(uri: str):
+        """
+        Get local path of object for reading within the block, objects of
+        remote storage are read through the cache
+
+        Args:
+            uri: storage uri or plain local path
+
+        Returns:
+            context manager of local path
+        """
+        return StorageHelper.get_driver(uri).reader(uri)
+
+    @staticmethod
+    def writer(uri: str):
+        """
+        Get local path to write object to, stored once the block completes
+        so readers never see a partially written object
+
+        Args:
+            uri: storage uri or plain local path
+
+        Returns:
+            context manager of local path
+        """
+        return StorageHelper.get_driver(uri).writer(uri)
+
+    @staticmethod
+    def put_file(file_path: str, uri: str) -> None:
+        StorageHelper.get_driver(uri).put_file(file_path, uri)
+
+    @staticmethod
+    def store(file_path: str, uri: str) -> bool:
+        """
+        Store spooled file unless the object exists already
+
+        Args:
+            file_path: path of spooled file, moved into storage when stored
+            uri: storage uri of object
+
+        Returns:
+            bool: True if the file was stored
+        """
+        if StorageHelper.exists(uri):
+            return False
+        StorageHelper.put_file(file_path, uri)
+        return True
+
+    @staticmethod
+    def remove(uri: Optional[str]) -> None:
+        if uri:
+            StorageHelper.get_driver(uri).remove(uri)
+
+    @staticmethod
+    def iter_range(uri: str, offset: int, count: int) -> Iterator[bytes]:
+        return StorageHelper.get_driver(uri).iter_range(uri, offset, count)
+
+
+storage_cache = StorageCache()
+local_storage = LocalStorage()
+s3_storage = S3Storage(S3_BUCKET, S3_PREFIX, storage_cache)
+storage = s3_storage if STORAGE_BACKEND == "s3" else local_storage
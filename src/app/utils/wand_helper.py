@@ -1,7 +1,85 @@
 # Packages
-from typing import AnyStr
-from wand.image import Image
-from wand.sequence import SingleImage, Sequence
+import os
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import AnyStr, Dict, Iterator, List, Tuple
+
+# Modules
+from app.config import (
+    IMAGE_MEMORY_LIMIT, LARGE_IMAGE_PIXELS, MAGICK_BYTES_PER_PIXEL, MAGICK_DISK_LIMIT,
+    MAGICK_THREAD_LIMIT, MAGICK_TEMPORARY_PATH, PROCESS_CONVERSION_SLOTS, PROCESS_MEMORY_BUDGET,
+)
+from app.utils.conversion_profile import ConversionProfile, OutputFormat, get_conversion_profile
+from app.utils.metrics_helper import MetricsHelper
+from app.utils.png_helper import PngHelper
+from app.utils.storage_helper import StorageHelper
+
+# Disk backed pixel cache location must be known before ImageMagick starts
+os.environ.setdefault("MAGICK_TEMPORARY_PATH", MAGICK_TEMPORARY_PATH)
+
+from wand.color import Color  # noqa: E402
+from wand.image import Image  # noqa: E402
+from wand.resource import limits  # noqa: E402
+from wand.sequence import SingleImage  # noqa: E402
+
+# ImageMagick limits are process wide, so they are set once for all threads
+# and conversions running at once are bounded by conversion slots instead
+PROCESS_LIMITS = {
+    "memory": PROCESS_MEMORY_BUDGET,
+    "map": PROCESS_MEMORY_BUDGET * 2,
+    # pixel caches of images larger than LARGE_IMAGE_PIXELS are kept on disk,
+    # ImageMagick 6 accounts the area in bytes of pixel cache
+    "area": min(PROCESS_MEMORY_BUDGET, LARGE_IMAGE_PIXELS * MAGICK_BYTES_PER_PIXEL),
+    "disk": MAGICK_DISK_LIMIT,
+    "thread": MAGICK_THREAD_LIMIT,
+}
+_limits_lock = threading.Lock()
+_limits_applied = False
+
+
+class ConversionSlots:
+    """
+    Counting semaphore whose holders take several slots at once. Waiters
+    are served in arrival order, so conversions of large images are not
+    starved by a steady flow of small ones.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._free = slots
+        self._next_ticket = 0
+        self._serving = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def acquire(self, count: int = 1) -> Iterator[None]:
+        """
+        Hold slots for the duration of the block
+
+        Args:
+            count: number of slots, at most the number of slots
+        """
+        count = max(1, min(count, self.slots))
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._condition.wait_for(lambda: self._serving == ticket and self._free >= count)
+            self._serving += 1
+            self._free -= count
+            # the next waiter may fit into the remaining slots
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._free += count
+                self._condition.notify_all()
+
+
+conversion_slots = ConversionSlots(PROCESS_CONVERSION_SLOTS)
 
 
 class WandHelper:
@@ -10,70 +88,386 @@ class WandHelper:
     """
 
     @staticmethod
-    def get_resolution(file: bytes) -> AnyStr:
+    def apply_limits() -> None:
+        """Set ImageMagick resource limits of the process once"""
+        global _limits_applied
+        with _limits_lock:
+            if not _limits_applied:
+                for name, value in PROCESS_LIMITS.items():
+                    limits[name] = value
+                _limits_applied = True
+
+    @staticmethod
+    @contextmanager
+    def resource_limits(pixels: int = None) -> Iterator[Dict]:
         """
-        Get resolution of file
+        Bound ImageMagick memory and CPU for the duration of a conversion.
+        Conversions of the process share PROCESS_CONVERSION_SLOTS slots
+        of IMAGE_MEMORY_LIMIT bytes each, others wait for theirs. An image
+        takes as many slots as its pixel cache needs, so all of them fit
+        into PROCESS_MEMORY_BUDGET together. Images larger than
+        LARGE_IMAGE_PIXELS, and any pixel cache beyond the memory limit of
+        the process, are cached on disk (MAGICK_TEMPORARY_PATH) and take a
+        single slot.
+
         Args:
-            file: contents of file
+            pixels: estimated number of pixels of the image, unknown
+                images take a single slot
+
+        Returns:
+            dict: limits of the process and slots taken by the conversion
+        """
+        WandHelper.apply_limits()
+        slots = 1
+        if pixels and pixels <= LARGE_IMAGE_PIXELS:
+            slots = math.ceil(pixels * MAGICK_BYTES_PER_PIXEL / IMAGE_MEMORY_LIMIT)
+        with conversion_slots.acquire(slots):
+            if pixels:
+                logging.info(f"Converting {pixels} pixels ({pixels * MAGICK_BYTES_PER_PIXEL} bytes) "
+                             f"with {min(slots, conversion_slots.slots)} slots")
+            yield {**PROCESS_LIMITS, "slots": min(slots, conversion_slots.slots)}
+
+    @staticmethod
+    def get_resolution(file_path: str) -> AnyStr:
+        """
+        Get resolution of file. The image is only pinged so pixel data
+        is never decoded.
+
+        Args:
+            file_path: path of file
 
         Returns:
             AnyStr: resolution of file (e.g. 100x100)
         """
-        with Image(blob=file) as img:
+        with Image.ping(filename=file_path) as img:
             return f"{int(img.resolution[0])}x{int(img.resolution[1])}"
 
     @staticmethod
-    def pdf_to_image(file: bytes) -> Sequence:
+    def get_metadata(file_path: str) -> Dict:
         """
-        Extract images from pdf
+        Get format, dimensions, resolution and page count of file by
+        pinging it
 
         Args:
-            file: contents of pdf file
+            file_path: path of file
 
         Returns:
-            Sequence: list of images
+            dict: metadata of file
         """
-        with Image(blob=file) as img:
-            return img.sequence
+        with Image.ping(filename=file_path) as img:
+            return {"format": (img.format or "").lower(),
+                    "width": img.width,
+                    "height": img.height,
+                    "resolution": f"{int(img.resolution[0])}x{int(img.resolution[1])}",
+                    "page_count": len(img.sequence)}
 
     @staticmethod
-    def get_blob(
+    def save_image(
             image: SingleImage,
+            file_path: str,
             fmt: str = "png",
-            resolution: str = None,
-    ) -> bytes:
+    ) -> None:
         """
-        Get blob contents of file
+        Write single image into storage, readers never see a partially
+        written file
 
         Args:
             image: SingleImage instance
-            fmt: format of blob
-            resolution: resolution
+            file_path: storage uri of file
+            fmt: format of file
+        """
+        with Image(image) as img:
+            WandHelper._save_atomically(img, file_path, fmt)
+
+    @staticmethod
+    def _save_atomically(img: Image, file_path: str, fmt: str) -> int:
+        """
+        Save image into storage, it is stored once completely written
+
+        Args:
+            img: Image instance
+            file_path: storage uri of file
+            fmt: format of file
 
         Returns:
-             bytes: blob contents of file
+            int: size of file in bytes
         """
-        with Image(image) as img:
-            if resolution:
-                img.resolution = list(map(int, resolution.split("x")))
-            return img.make_blob(fmt)
+        with StorageHelper.writer(file_path) as path:
+            WandHelper._write_image(img, path, fmt)
+            return os.path.getsize(path)
+
+    @staticmethod
+    def _write_image(img: Image, path: str, fmt: str) -> None:
+        """
+        Encode image straight into file at local path. The format is given
+        as prefix of the file name (png:/path), unlike make_blob(fmt) the
+        image is not cloned to change its format and the encoded file is
+        never held in a Python bytes object.
+
+        Args:
+            img: Image instance
+            path: local path of file
+            fmt: format of file
+        """
+        with MetricsHelper.stage("encode"):
+            img.save(filename=f"{fmt}:{path}")
 
     @staticmethod
-    def convert_to_png(
+    def get_page_count(file_path: str) -> int:
+        """
+        Get number of pages of pdf file without rasterizing them
+
+        Args:
+            file_path: path of pdf file
+
+        Returns:
+            int: number of pages
+        """
+        with Image.ping(filename=file_path) as pdf:
+            return len(pdf.sequence)
+
+    @staticmethod
+    def rasterize_pdf_page(
             file_path: str,
+            page_index: int,
             new_file_path: str,
-            resolution: str = None
-    ) -> None:
+            fmt: str = "png",
+            converted_outputs: List[Tuple[OutputFormat, str]] = None,
+            profile: ConversionProfile = None,
+    ) -> Dict:
         """
-        Convert file into png format and its resolution
+        Rasterize a single page of pdf file. Only the requested page is
+        decoded by using ImageMagick page selection (file.pdf[n]). When
+        converted_outputs are given they are written from the same decoded
+        page.
+
         Args:
-            file_path: path of file
+            file_path: local path of pdf file, see StorageHelper.reader
+            page_index: zero based page index
+            new_file_path: storage uri of rasterized page
+            fmt: format of rasterized page
+            converted_outputs: list of output format and storage uri of converted output
+            profile: conversion profile of converted outputs
+
+        Returns:
+            dict: resolution (e.g. 72x72), width and height of page along
+            with output_width and output_height of converted outputs
+        """
+        with MetricsHelper.stage("decode"):
+            page = Image(filename=f"{file_path}[{page_index}]")
+        with page:
+            metadata = {"resolution": f"{int(page.resolution[0])}x{int(page.resolution[1])}",
+                        "width": page.width,
+                        "height": page.height}
+            WandHelper._save_atomically(page, new_file_path, fmt)
+            if converted_outputs:
+                metadata.update(WandHelper.encode_outputs(page, converted_outputs, profile))
+
+            return metadata
+
+    @staticmethod
+    def resize(img: Image, profile: ConversionProfile) -> None:
+        """
+        Resize image to target pixel dimensions of profile
+
+        Args:
+            img: Image instance
+            profile: conversion profile
+        """
+        dimensions = profile.dimensions
+        if not dimensions:
+            return
+
+        width, height = dimensions
+        if profile.resize_mode == "exact":
+            img.resize(width, height, filter=profile.filter)
+        elif profile.resize_mode == "fill":
+            ratio = max(width / img.width, height / img.height)
+            img.resize(max(1, round(img.width * ratio)), max(1, round(img.height * ratio)),
+                       filter=profile.filter)
+            img.crop(width=width, height=height, gravity="center")
+        else:
+            ratio = min(width / img.width, height / img.height)
+            img.resize(max(1, round(img.width * ratio)), max(1, round(img.height * ratio)),
+                       filter=profile.filter)
+
+    @staticmethod
+    def convert_image(
+            img: Image,
+            new_file_path: str,
+            profile: ConversionProfile = None
+    ) -> Dict:
+        """
+        Convert already decoded image into png format with pixel dimensions
+        and resolution of profile
+        Args:
+            img: Image instance
             new_file_path: new path of file
-            resolution: resolution
+            profile: conversion profile, defaults to CONVERSION_PROFILE
+
+        Returns:
+            dict: output_width and output_height of converted png
         """
+        return WandHelper.encode_outputs(img, [(OutputFormat("png"), new_file_path)], profile)
 
-        with Image(filename=file_path) as img:
-            if resolution:
-                img.resolution = list(map(int, resolution.split("x")))
+    @staticmethod
+    def encode_outputs(
+            img: Image,
+            outputs: List[Tuple[OutputFormat, str]],
+            profile: ConversionProfile = None
+    ) -> Dict:
+        """
+        Resize already decoded image once and encode it into every output
+        format. Lossy formats only set the compression quality, restored
+        once they are written, and png may reduce depth and colors of the
+        image, so png is encoded last and pixels are copied only to flatten
+        alpha for jpeg.
+
+        Args:
+            img: Image instance
+            outputs: list of output format and storage uri of output
+            profile: conversion profile, defaults to CONVERSION_PROFILE
+
+        Returns:
+            dict: output_width and output_height of converted outputs
+        """
+        profile = profile or get_conversion_profile()
+        with MetricsHelper.stage("transform"):
+            WandHelper.resize(img, profile)
+            if profile.resolution:
+                img.resolution = list(map(int, profile.resolution.split("x")))
+
+        for output, file_path in sorted(outputs, key=lambda item: item[0].format == "png"):
+            started = time.perf_counter()
+            if output.format == "png":
+                size = WandHelper.encode_png(img, file_path, profile)
+            elif output.format == "jpeg" and img.alpha_channel:
+                # jpeg has no alpha, flatten a copy so other outputs keep it
+                with img.clone() as flat:
+                    flat.background_color = Color("white")
+                    flat.alpha_channel = "remove"
+                    flat.compression_quality = output.quality
+                    size = WandHelper._save_atomically(flat, file_path, output.format)
+            else:
+                # png takes zlib level and filter from the quality left on the image
+                source_quality = img.compression_quality
+                img.compression_quality = output.quality
+                try:
+                    size = WandHelper._save_atomically(img, file_path, output.format)
+                finally:
+                    img.compression_quality = source_quality
+            logging.info(f"Encoded {img.width}x{img.height} {output.key} with profile {profile.name} in "
+                         f"{time.perf_counter() - started:.3f}s, {size} bytes")
 
-            img.save(filename=new_file_path)
+        return {"output_width": img.width, "output_height": img.height}
+
+    @staticmethod
+    def encode_png(img: Image, file_path: str, profile: ConversionProfile) -> int:
+        """
+        Write image as png with compression level, filter, bit depth and
+        palette of profile. With parallel_deflate the encoder only filters
+        the rows and pigz compresses them on the share of cores of a
+        conversion slot before the file is stored.
+
+        Args:
+            img: Image instance
+            file_path: storage uri of png file
+            profile: conversion profile
+
+        Returns:
+            int: size of file in bytes
+        """
+        parallel = profile.parallel_deflate and PngHelper.is_parallel_deflate_available()
+        level = 0 if parallel else profile.png_compression_level
+        if level is not None:
+            img.options["png:compression-level"] = str(level)
+        if profile.png_filter is not None:
+            img.options["png:compression-filter"] = str(profile.png_filter)
+        if profile.png_bit_depth:
+            img.depth = profile.png_bit_depth
+        if profile.png_colors:
+            img.quantize(profile.png_colors, dither=False)
+
+        with StorageHelper.writer(file_path) as path:
+            WandHelper._write_image(img, path, "png")
+            if parallel:
+                with MetricsHelper.stage("encode"):
+                    PngHelper.recompress(path, profile.png_compression_level or 6)
+            return os.path.getsize(path)
+
+    @staticmethod
+    def read_image(file_path: str, profile: ConversionProfile = None) -> Image:
+        """
+        Read image for conversion. Profiles with jpeg_size_hint pass the
+        target size to libjpeg (jpeg:size) which then decodes jpeg files at
+        1/2, 1/4 or 1/8 scale when that is still larger than the target.
+
+        Args:
+            file_path: path of file
+            profile: conversion profile
+
+        Returns:
+            Image: decoded image, caller is responsible for closing it
+        """
+        img = Image()
+        try:
+            if profile and profile.jpeg_size_hint and profile.size:
+                img.options["jpeg:size"] = profile.size
+            with MetricsHelper.stage("decode"):
+                img.read(filename=file_path)
+        except BaseException:
+            img.close()
+            raise
+
+        return img
+
+    @staticmethod
+    def render_derivative(
+            source_path: str,
+            file_path: str,
+            profile: ConversionProfile,
+            fmt: str,
+            quality: int
+    ) -> Tuple[int, int]:
+        """
+        Render resized copy of image in png, jpeg or webp format
+
+        Args:
+            source_path: path of source image
+            file_path: path of derivative
+            profile: conversion profile holding target size and resize mode
+            fmt: format of derivative
+            quality: compression quality of lossy formats
+
+        Returns:
+            tuple: width and height of derivative
+        """
+        with WandHelper.read_image(source_path, profile) as img:
+            WandHelper.resize(img, profile)
+            if fmt == "png":
+                WandHelper.encode_png(img, file_path, profile)
+            else:
+                img.compression_quality = quality
+                WandHelper._save_atomically(img, file_path, fmt)
+            return img.width, img.height
+
+    @staticmethod
+    def convert_file(
+            file_path: str,
+            outputs: List[Tuple[OutputFormat, str]],
+            profile: ConversionProfile = None
+    ) -> Dict:
+        """
+        Decode file once and write every requested output format with pixel
+        dimensions and resolution of profile
+        Args:
+            file_path: local path of file, see StorageHelper.reader
+            outputs: list of output format and storage uri of output
+            profile: conversion profile, defaults to CONVERSION_PROFILE
+
+        Returns:
+            dict: output_width and output_height of converted outputs
+        """
+        profile = profile or get_conversion_profile()
+        with WandHelper.read_image(file_path, profile) as img:
+            return WandHelper.encode_outputs(img, outputs, profile)
@@ -1,16 +1,23 @@
-import asyncio
 import os
+import math
+import time
 import logging
+import threading
 
 from celery import Celery, Task
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, before_task_publish, \
+    task_prerun, task_postrun
+from celery.worker.control import control_command
+from prometheus_client import multiprocess, start_http_server
+from kombu import Queue
 from celery.utils.log import get_task_logger
 from sqlalchemy.orm import Session
 
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-
-# load database after the event loop is set in case of async DB drivers
-from app.database import db_instance  # noqa: E402
+from app.database import db_instance
+from app.config import WORKER_CONCURRENCY, WORKER_DB_POOL_SIZE, WORKER_POOL, QUEUE_MAX_PRIORITY, BATCH_SIZE, \
+    WORKER_METRICS_PORT, METRICS_MULTIPROCESS, WORKER_QUEUES
+from app.utils.metrics_helper import MetricsHelper, IN_FLIGHT
+from app.utils.profiling_helper import ProfilingHelper, profiling_settings
 
 logger = get_task_logger(__name__)
 
@@ -26,41 +33,134 @@ celery_app = Celery(
 
 celery_app.config_from_object(
     {
-        "worker_prefetch_multiplier": 1,
+        # batches are buffered unacknowledged, so the prefetch window of a worker consuming
+        # only batches must hold a full one. Others prefetch one message per thread, messages
+        # held waiting for a conversion slot could not be overtaken by higher priorities.
+        "worker_prefetch_multiplier": max(1, math.ceil(BATCH_SIZE / WORKER_CONCURRENCY))
+        if WORKER_QUEUES == ["batch"] else 1,
         "worker_send_task_events": True,
         "task_send_sent_event": True,
         "timezone": "UTC",
-        "task_routes": {},
-        "task_default_priority": 1,
+        # tasks run in the publishing process, stand-in for RabbitMQ and workers in benchmarks
+        "task_always_eager": os.getenv("CELERY_TASK_ALWAYS_EAGER", "false").lower() == "true",
+        # ingest (cheap bookkeeping), convert (images) and pdf (page rasterization)
+        # are consumed by independently scaled workers (-Q)
+        "task_queues": [
+            Queue("celery"),
+            Queue("ingest", queue_arguments={"x-max-priority": QUEUE_MAX_PRIORITY}),
+            Queue("convert", queue_arguments={"x-max-priority": QUEUE_MAX_PRIORITY}),
+            Queue("pdf", queue_arguments={"x-max-priority": QUEUE_MAX_PRIORITY}),
+            Queue("batch", queue_arguments={"x-max-priority": QUEUE_MAX_PRIORITY}),
+        ],
+        "task_routes": {
+            "app.workers.tasks.upload_file": {"queue": "ingest"},
+            "app.workers.tasks.split_pdf": {"queue": "ingest"},
+            "app.workers.tasks.process_image": {"queue": "convert"},
+            "app.workers.tasks.convert_to_png": {"queue": "convert"},
+            "app.workers.tasks.rasterize_pdf_pages": {"queue": "pdf"},
+            "app.workers.tasks.process_image_batch": {"queue": "batch"},
+        },
+        "task_default_priority": QUEUE_MAX_PRIORITY // 2,
+        # tasks in flight per worker, conversions among them are bounded by
+        # PROCESS_CONVERSION_SLOTS so every process fits its ImageMagick pixel budget
+        "worker_pool": WORKER_POOL,
+        "worker_concurrency": WORKER_CONCURRENCY,
     }
 )
 
 
+@worker_init.connect
+def configure_worker_engine(**kwargs):
+    # one connection per task running at once, prefork children resize below
+    db_instance.configure_engine(WORKER_DB_POOL_SIZE or WORKER_CONCURRENCY, max_overflow=1)
+
+
+@worker_process_init.connect
+def configure_child_engine(**kwargs):
+    # a prefork child runs one task at a time, connections of the parent
+    # are left alone since their sockets are shared
+    db_instance.configure_engine(WORKER_DB_POOL_SIZE or 1, max_overflow=1, dispose=False)
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT, registry=MetricsHelper.get_registry())
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    if METRICS_MULTIPROCESS:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+@before_task_publish.connect
+def stamp_task_headers(headers=None, **kwargs):
+    # queue wait is measured from publish time, tasks published by tasks
+    # inherit labels of the file being processed
+    headers["sent_at"] = time.time()
+    file_type, size_bucket = MetricsHelper.get_labels()
+    headers.setdefault("metric_file_type", file_type)
+    headers.setdefault("metric_size_bucket", size_bucket)
+
+
+@task_prerun.connect
+def observe_queue_wait(task=None, **kwargs):
+    labels = (task.request.get("metric_file_type") or "unknown",
+              task.request.get("metric_size_bucket") or "unknown")
+    MetricsHelper.set_labels(labels)
+    sent_at = task.request.get("sent_at")
+    if sent_at:
+        MetricsHelper.observe("queue_wait", max(time.time() - sent_at, 0), labels)
+    IN_FLIGHT.labels(task.name).inc()
+
+
+@task_postrun.connect
+def clear_task_metrics(task=None, **kwargs):
+    MetricsHelper.set_labels(None)
+    IN_FLIGHT.labels(task.name).dec()
+
+
+@control_command(
+    args=[("rate", float), ("duration", float)],
+    signature="<rate> [duration]",
+)
+def set_profiling(state, rate: float = 0.0, duration: float = None):
+    """Profile share of tasks of this worker, for duration seconds if given"""
+    # runs in the consuming process, so prefork children keep PROFILE_SAMPLE_RATE
+    try:
+        return {"ok": profiling_settings.set(rate, duration)}
+    except ValueError as e:
+        return {"error": str(e)}
+
+
 class BaseDbTask(Task):
-    _db_session: Session = None
+    """
+    Task running within a session scope. The session exists for a single
+    run of the task and is committed, or rolled back if the task raised,
+    and returned to the pool as soon as the task returns.
+    """
+    _local = threading.local()
 
     @property
-    def session(self):
-        if self._db_session is None:
-            self._db_session = db_instance.initialize_session()
+    def session(self) -> Session:
+        return self._local.session
+
+    @staticmethod
+    def get_file_id(args, kwargs):
+        return None
 
-        return self._db_session
+    def __call__(self, *args, **kwargs):
+        with ProfilingHelper.sampled("task", self.name, self.get_file_id(args, kwargs)):
+            with db_instance.session_scope() as session:
+                self._local.session = session
+                try:
+                    return super().__call__(*args, **kwargs)
+                finally:
+                    self._local.session = None
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         logging.exception(f"task {task_id} failed args:{args} {exc}")
-        try:
-            self.session.rollback()
-        except Exception:
-            raise Exception("Failed to rollback session on retry")
-
-    def after_return(self, status, retval, task_id, args, kwargs, einfo):
-        try:
-            self.session.commit()
-        except Exception:
-            self.session.rollback()
-        finally:
-            logging.info(f"Closing db session {id(self.session)}")
-            self.session.close()
 
 
 if __name__ == "__main__":
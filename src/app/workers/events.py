@@ -0,0 +1,129 @@
+# Packages
+import time
+import socket
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set
+from kombu import Exchange, Queue
+
+# Modules
+from app.workers.celery import celery_app
+
+# Status transitions of files are broadcast to every API process
+EVENTS_EXCHANGE = Exchange("file_events", type="fanout", durable=False, auto_delete=False)
+TERMINAL_STATUSES = ("completed", "failure", "deleted")
+
+
+class EventPublisher:
+    """
+    Publishes file status transitions from workers
+    """
+
+    @staticmethod
+    def publish_status(file_id: str, status: str, pdf_id: Optional[str] = None) -> None:
+        """
+        Publish status transition of file. Publishing is best effort, a
+        broker failure never fails the task which changed the status.
+
+        Args:
+            file_id: file id
+            status: new status of file
+            pdf_id: pdf file id if the file is a pdf page
+        """
+        event = {"file_id": str(file_id), "status": status,
+                 "pdf_id": str(pdf_id) if pdf_id else None}
+        try:
+            with celery_app.producer_or_acquire() as producer:
+                producer.publish(event, exchange=EVENTS_EXCHANGE, declare=[EVENTS_EXCHANGE],
+                                 serializer="json", retry=True)
+        except Exception:
+            logging.exception(f"Failed to publish status {status} of file {file_id}")
+
+
+class EventSubscriber:
+    """
+    Consumes file status transitions in a background thread and fans them
+    out to the asyncio queues of subscribed clients of this process
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_event_loop()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._consume, name="file-events", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def add_listener(self, listener: Callable[[Dict], None]) -> None:
+        """
+        Call listener with every event received by this process
+
+        Args:
+            listener: callable receiving the event
+        """
+        self._listeners.append(listener)
+
+    def subscribe(self, file_id: str) -> asyncio.Queue:
+        """
+        Subscribe to events of file or of every page of pdf file
+
+        Args:
+            file_id: file id
+
+        Returns:
+            asyncio.Queue: queue receiving events
+        """
+        queue = asyncio.Queue()
+        self._subscribers[file_id].add(queue)
+        return queue
+
+    def unsubscribe(self, file_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(file_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[file_id]
+
+    def _consume(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                with celery_app.connection_for_read() as connection:
+                    # server named queue which goes away with this process
+                    queue = Queue(exchange=EVENTS_EXCHANGE, exclusive=True, auto_delete=True)
+                    with connection.Consumer(queue, callbacks=[self._on_message],
+                                             accept=["json"], no_ack=True):
+                        while not self._stopped.is_set():
+                            try:
+                                connection.drain_events(timeout=1)
+                            except socket.timeout:
+                                pass
+            except Exception:
+                logging.exception("File events consumer failed, reconnecting")
+                time.sleep(1)
+
+    def _on_message(self, body: Dict, message) -> None:
+        self._loop.call_soon_threadsafe(self._dispatch, body)
+
+    def _dispatch(self, event: Dict) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                logging.exception(f"File events listener {listener} failed")
+
+        for key in (event.get("file_id"), event.get("pdf_id")):
+            for queue in self._subscribers.get(key, ()):
+                queue.put_nowait(event)
+
+
+event_subscriber = EventSubscriber()
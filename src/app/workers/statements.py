@@ -0,0 +1,65 @@
+# Packages
+from sqlalchemy import bindparam, exists, func, update
+
+# Modules
+from app.models import FilesTable
+
+# Statements of the hot paths of workers. They are built once at import and
+# only bind parameters per call, so SQLAlchemy serves their compiled form from
+# the engine's compiled cache. Each of them is a single round trip.
+# Parameter names must differ from column names of the SET clause.
+
+files = FilesTable.__table__
+pages = files.alias("pages")
+
+# Mark file as uploaded, returns its pdf id
+MARK_UPLOADED = update(files).where(files.c.id == bindparam("file_id")).values(
+    status="uploaded", path=bindparam("file_path")
+).returning(files.c.pdf_id)
+
+# Mark file as processing and return what its conversion needs
+START_PROCESSING = update(files).where(files.c.id == bindparam("file_id")).values(
+    status="processing"
+).returning(files.c.path, files.c.width, files.c.height, files.c.content_hash, files.c.pdf_id)
+
+# Record conversion of file, the primary output may be a cached conversion
+# recorded on upload. Executed once per batch with a row of parameters per file.
+COMPLETE_CONVERSIONS = update(files).where(files.c.id == bindparam("file_id")).values(
+    status="completed",
+    path=bindparam("file_path"),
+    output_path=func.coalesce(files.c.output_path, bindparam("primary_output_path")),
+    output_resolution=bindparam("profile_resolution"),
+    output_width=bindparam("converted_width"),
+    output_height=bindparam("converted_height"),
+    output_profile=bindparam("profile_key"),
+)
+
+# Same as COMPLETE_CONVERSIONS for a single file, returns content hash and pdf id
+COMPLETE_CONVERSION = COMPLETE_CONVERSIONS.returning(files.c.content_hash, files.c.pdf_id)
+
+# Record rasterized pdf page, executed once per range with a row of parameters per page
+UPDATE_PAGE = update(files).where(files.c.id == bindparam("page_id")).values(
+    status=bindparam("page_status"),
+    path=bindparam("page_path"),
+    resolution=bindparam("page_resolution"),
+    width=bindparam("page_width"),
+    height=bindparam("page_height"),
+    output_path=bindparam("primary_output_path"),
+    output_resolution=bindparam("profile_resolution"),
+    output_width=bindparam("converted_width"),
+    output_height=bindparam("converted_height"),
+    output_profile=bindparam("profile_key"),
+)
+
+# Mark file as failed, returns its pdf id
+MARK_FAILED = update(files).where(files.c.id == bindparam("file_id")).values(
+    status="failure"
+).returning(files.c.pdf_id)
+
+# Mark pdf as completed if none of its pages is pending, returns its id only
+# for the update which completed it
+COMPLETE_PDF = update(files).where(
+    files.c.id == bindparam("pdf_file_id"),
+    files.c.status != "completed",
+    ~exists().where(pages.c.pdf_id == bindparam("pdf_file_id"), pages.c.status != "completed"),
+).values(status="completed").returning(files.c.id)
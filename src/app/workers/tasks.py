@@ -1,16 +1,32 @@
 # Packages
-from typing import Type, AnyStr
+import os
+import time
+from typing import Type, AnyStr, Dict, List, Optional, Tuple
 import logging
-import asyncio
+from celery import group
+from celery_batches import Batches
 from fastapi import status
+from sqlalchemy import insert, select, update
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 # Modules
-from app.models import FilesTable
-from app.config import CONVERTED_IMAGE_RESOLUTION
-from app.utils.helper import ReturnValue, Helper
+from app.database import db_instance
+from app.models import FilesTable, FileOutputsTable, string_uuid
+from app.config import PDF_PAGES_PER_TASK, FUSED_PROCESSING, BATCH_SIZE, BATCH_MAX_WAIT_MS
+from app.utils.helper import ReturnValue
 from app.utils.wand_helper import WandHelper
-from app.workers.celery import celery_app, BaseDbTask, loop
+from app.utils.dedup_helper import DedupHelper
+from app.utils.metrics_helper import MetricsHelper
+from app.utils.profiling_helper import ProfilingHelper
+from app.utils.storage_helper import StorageHelper
+from app.utils.priority_helper import PriorityHelper
+from app.utils.conversion_profile import ConversionProfile, OutputFormat, get_conversion_profile, \
+    parse_output_formats
+from app.workers.celery import celery_app, BaseDbTask
+from app.workers.events import EventPublisher
+from app.workers.statements import MARK_UPLOADED, START_PROCESSING, COMPLETE_CONVERSION, COMPLETE_CONVERSIONS, \
+    UPDATE_PAGE, MARK_FAILED, COMPLETE_PDF
 
 
 class Tasks:
@@ -19,85 +35,542 @@ class Tasks:
     """
 
     @staticmethod
-    async def run_async_test_task(session: Session):
+    def run_test_task(session: Session):
         # session is the db session from sqlalchemy
         logging.info("Entering test task (next message will appear in 5 seconds)")
-        await asyncio.sleep(5)
+        time.sleep(5)
         logging.info("Exiting test task")
 
     @staticmethod
-    async def run_upload_file(
+    def run_upload_file(
             db: Session,
             file_model: Type[FilesTable],
             file_id: str,
-            file_data: bytes,
             file_path: str,
     ) -> AnyStr:
         """
-        Upload file
+        Mark file as uploaded once the API has spooled it into storage
 
         Args:
             db: sqlalchemy instance
             file_model: FilesTable instance
             file_id: file id
-            file_data: contents of file
-            file_path: path of file
+            file_path: storage uri of file
 
         Returns:
             AnyStr: file id
         """
-        file_ = db.query(file_model).filter(file_model.id == file_id).one()
-        if not file_:
+        # Uploading
+        if not StorageHelper.exists(file_path):
+            raise FileNotFoundError(f"File {file_path} not found in storage")
+
+        updated = db.execute(MARK_UPLOADED, {"file_id": file_id, "file_path": file_path}).first()
+        Tasks.commit_status(db)
+        if not updated:
             logging.error(f"File {file_id} not found in database")
             return ReturnValue(False, status.HTTP_404_NOT_FOUND,
                                f"File {file_id} not found in database")
 
-        # Uploading
-        Helper.save_file(file_data, file_path)
-        file_.status = "uploaded"
-        file_.path = file_path
-        db.commit()
+        EventPublisher.publish_status(file_id, "uploaded", updated.pdf_id)
         return file_id
 
     @staticmethod
-    async def run_convert_to_png(
+    def run_convert_to_png(
             db: Session,
             file_model: Type[FilesTable],
-            file_id: str
+            file_id: str,
+            profile_name: str = None,
+            formats: List[str] = None
     ) -> AnyStr:
         """
-        Convert image file into png
+        Convert image file into every requested output format
         Args:
             db: sqlalchemy instance
             file_model: FilesTable instance
             file_id: file id
+            profile_name: name of conversion profile
+            formats: output format keys (e.g. webp:80), defaults to OUTPUT_FORMATS
 
         Returns:
             AnyStr: file id
         """
-        file = db.query(file_model).filter(file_model.id == file_id).one()
+        # Change status to processing, returns the fields conversion needs
+        file = db.execute(START_PROCESSING, {"file_id": file_id}).first()
+        Tasks.commit_status(db)
         if not file:
             logging.error(f"File {file_id} not found in database")
             return ReturnValue(False, status.HTTP_404_NOT_FOUND,
                                f"File {file_id} not found in database")
 
-        # Change status to processing
-        file.status = "processing"
-        db.commit()
+        EventPublisher.publish_status(file_id, "processing", file.pdf_id)
 
         # Conversion
         file_path = file.path
-        new_file_path = f"{file_path.split('.')[0]}_converted.png"
-        resolution = CONVERTED_IMAGE_RESOLUTION
-        WandHelper.convert_to_png(file_path, new_file_path, resolution)
+        profile = get_conversion_profile(profile_name)
+        outputs = Tasks.get_outputs(file_path, profile, formats)
+        with StorageHelper.reader(file_path) as local_path, \
+                WandHelper.resource_limits(Tasks.estimate_pixels(file.width, file.height)):
+            output = WandHelper.convert_file(local_path, outputs, profile)
 
         # Update records
-        file.output_path = new_file_path
-        file.output_resolution = resolution
-        file.status = "completed"
-        db.commit()
+        db.execute(COMPLETE_CONVERSION, Tasks.get_conversion_params(file_id, file_path, profile,
+                                                                    outputs, output))
+        Tasks.save_outputs(db, file_id, file.content_hash, profile, outputs, output)
+        Tasks.commit_status(db)
+        EventPublisher.publish_status(file_id, "completed", file.pdf_id)
+
+        if file.pdf_id:
+            Tasks.complete_pdf(db, file_model, file.pdf_id)
+        return file_id
+
+    @staticmethod
+    def run_process_image(
+            db: Session,
+            file_model: Type[FilesTable],
+            file_id: str,
+            file_path: str,
+            pixels: int = None,
+            profile_name: str = None,
+            formats: List[str] = None
+    ) -> AnyStr:
+        """
+        Fused replacement of upload_file and convert_to_png. The image is
+        decoded once, every output format is written from it and all fields
+        of the file are written with a single UPDATE.
+
+        Args:
+            db: sqlalchemy instance
+            file_model: FilesTable instance
+            file_id: file id
+            file_path: storage uri of file
+            pixels: estimated number of pixels of the image
+            profile_name: name of conversion profile
+            formats: output format keys (e.g. webp:80), defaults to OUTPUT_FORMATS
+
+        Returns:
+            AnyStr: file id
+        """
+        profile = get_conversion_profile(profile_name)
+        outputs = Tasks.get_outputs(file_path, profile, formats)
+        # the source is fetched before a conversion slot is taken
+        with StorageHelper.reader(file_path) as local_path, WandHelper.resource_limits(pixels):
+            output = WandHelper.convert_file(local_path, outputs, profile)
+
+        updated = db.execute(COMPLETE_CONVERSION, Tasks.get_conversion_params(
+            file_id, file_path, profile, outputs, output
+        )).first()
+        if updated:
+            Tasks.save_outputs(db, file_id, updated.content_hash, profile, outputs, output)
+        Tasks.commit_status(db)
+        if not updated:
+            logging.error(f"File {file_id} not found in database")
+            return ReturnValue(False, status.HTTP_404_NOT_FOUND,
+                               f"File {file_id} not found in database")
+
+        EventPublisher.publish_status(file_id, "completed")
+        return file_id
+
+    @staticmethod
+    def run_process_image_batch(
+            db: Session,
+            file_model: Type[FilesTable],
+            jobs: List[List]
+    ) -> List[List]:
+        """
+        Batched process_image for small images. The batch holds a single
+        conversion slot for all of its images and writes their records in
+        one transaction. Images failing to convert are handed back to be
+        retried one by one.
+
+        Args:
+            db: sqlalchemy instance
+            file_model: FilesTable instance
+            jobs: process_image arguments (file id, storage uri, pixels,
+                profile name, formats) of every image, optionally followed
+                by message headers
+
+        Returns:
+            list: arguments of jobs which failed to convert
+        """
+        converted = []
+        failed = []
+        with WandHelper.resource_limits():
+            for job in jobs:
+                file_id, file_path, _, profile_name, formats = (list(job) + [None] * 5)[:5]
+                try:
+                    profile = get_conversion_profile(profile_name)
+                    outputs = Tasks.get_outputs(file_path, profile, formats)
+                    with StorageHelper.reader(file_path) as local_path, MetricsHelper.file_labels(local_path):
+                        output = WandHelper.convert_file(local_path, outputs, profile)
+                except Exception:
+                    logging.exception(f"Failed to convert {file_id} in batch")
+                    failed.append(job)
+                    continue
+                converted.append((file_id, file_path, profile, outputs, output))
+
+        if not converted:
+            return failed
+
+        # Deleted files are skipped, their outputs would violate the foreign key
+        content_hashes = dict(db.execute(
+            select(file_model.id, file_model.content_hash).where(
+                file_model.id.in_([file_id for file_id, *_ in converted])
+            )
+        ).all())
+        db.execute(COMPLETE_CONVERSIONS, [Tasks.get_conversion_params(*item) for item in converted])
+        for file_id, _, profile, outputs, output in converted:
+            if file_id in content_hashes:
+                Tasks.save_outputs(db, file_id, content_hashes[file_id], profile, outputs, output)
+        Tasks.commit_status(db)
+
+        for file_id in content_hashes:
+            EventPublisher.publish_status(file_id, "completed")
+        logging.info(f"Converted batch of {len(converted)} images, {len(failed)} failed")
+        return failed
+
+    @staticmethod
+    def fail_file(
+            db: Session,
+            file_model: Type[FilesTable],
+            file_id: str
+    ) -> None:
+        """
+        Mark file as failed once its task gave up retrying
+
+        Args:
+            db: sqlalchemy instance
+            file_model: FilesTable instance
+            file_id: file id
+        """
+        updated = db.execute(MARK_FAILED, {"file_id": file_id}).first()
+        Tasks.commit_status(db)
+        if updated:
+            EventPublisher.publish_status(file_id, "failure", updated.pdf_id)
+
+    @staticmethod
+    def commit_status(db: Session) -> None:
+        """
+        Commit status updates of task, measured as status_commit stage
+
+        Args:
+            db: sqlalchemy instance
+        """
+        with MetricsHelper.stage("status_commit"):
+            db.commit()
+
+    @staticmethod
+    def get_conversion_params(
+            file_id: str,
+            file_path: str,
+            profile: ConversionProfile,
+            outputs: List[Tuple[OutputFormat, str]],
+            output: Dict
+    ) -> Dict:
+        """
+        Get parameters of COMPLETE_CONVERSION statement
+
+        Args:
+            file_id: file id
+            file_path: storage uri of file
+            profile: conversion profile
+            outputs: list of output format and storage uri of converted output
+            output: output_width and output_height of converted outputs
+
+        Returns:
+            dict: statement parameters
+        """
+        return {"file_id": file_id, "file_path": file_path, "primary_output_path": outputs[0][1],
+                "profile_resolution": profile.resolution, "profile_key": profile.key,
+                "converted_width": output["output_width"], "converted_height": output["output_height"]}
+
+    @staticmethod
+    def estimate_pixels(width: int, height: int) -> Optional[int]:
+        """
+        Estimate pixel budget of a job from probed dimensions
+
+        Args:
+            width: width of image
+            height: height of image
+
+        Returns:
+            int: number of pixels or None if dimensions are unknown
+        """
+        if width and height:
+            return width * height
+        return None
+
+    @staticmethod
+    def get_converted_file_path(
+            file_path: str,
+            profile: ConversionProfile,
+            output: OutputFormat = None
+    ) -> AnyStr:
+        """
+        Get storage uri of converted output for file. Outputs of different
+        profiles, resolutions, formats and qualities never share a uri, like
+        their rows in conversions.
+
+        Args:
+            file_path: storage uri of file
+            profile: conversion profile
+            output: output format, defaults to png
+
+        Returns:
+            AnyStr: storage uri of converted output
+        """
+        base = f"{os.path.splitext(file_path)[0]}_{profile.key.replace('/', '-')}"
+        if profile.resolution:
+            base = f"{base}-r{profile.resolution}"
+        if output is None or output.quality is None:
+            return f"{base}_converted.{output.format if output else 'png'}"
+        return f"{base}-q{output.quality}_converted.{output.format}"
+
+    @staticmethod
+    def get_outputs(
+            file_path: str,
+            profile: ConversionProfile,
+            formats: List[str] = None
+    ) -> List[Tuple[OutputFormat, str]]:
+        """
+        Get requested output formats of file along with their storage uris
+
+        Args:
+            file_path: storage uri of file
+            profile: conversion profile
+            formats: output format keys, defaults to OUTPUT_FORMATS
+
+        Returns:
+            list: output format and storage uri of converted output
+        """
+        return [(output, Tasks.get_converted_file_path(file_path, profile, output))
+                for output in parse_output_formats(formats)]
+
+    @staticmethod
+    def save_outputs(
+            db: Session,
+            file_id: str,
+            content_hash: Optional[str],
+            profile: ConversionProfile,
+            outputs: List[Tuple[OutputFormat, str]],
+            output: Dict
+    ) -> None:
+        """
+        Record converted outputs of file and take a reference on their
+        conversions. Outputs recorded by a previous attempt of a retried
+        task are skipped, so no reference is taken twice.
+
+        Args:
+            db: sqlalchemy instance
+            file_id: file id
+            content_hash: hex digest of original contents, None for pdf pages
+            profile: conversion profile
+            outputs: list of output format and storage uri of converted output
+            output: output_width and output_height of converted outputs
+        """
+        rows = [{"id": string_uuid(), "file_id": file_id, "format": fmt.format,
+                 "quality": fmt.quality, "path": path, "resolution": profile.resolution,
+                 "width": output["output_width"], "height": output["output_height"],
+                 "profile": profile.key}
+                for fmt, path in outputs]
+        statement = pg_insert(FileOutputsTable).values(rows).on_conflict_do_nothing(
+            index_elements=[FileOutputsTable.file_id, FileOutputsTable.format]
+        ).returning(FileOutputsTable.format)
+        inserted = set(db.execute(statement).scalars().all())
+
+        if content_hash:
+            for fmt, path in outputs:
+                if fmt.format in inserted:
+                    DedupHelper.register_conversion(db, content_hash, profile.resolution, fmt.key,
+                                                    profile.key, path, **output)
+
+    @staticmethod
+    def complete_pdf(
+            db: Session,
+            file_model: Type[FilesTable],
+            pdf_id: str
+    ) -> None:
+        """
+        Mark pdf file as completed once all of its pages are converted,
+        checked and written by a single statement. Pages commit their own
+        status before calling this, so the last page to finish always
+        observes every sibling as completed.
+
+        Args:
+            db: sqlalchemy instance
+            file_model: FilesTable instance
+            pdf_id: pdf file id
+        """
+        completed = db.execute(COMPLETE_PDF, {"pdf_file_id": pdf_id}).first()
+        Tasks.commit_status(db)
+        if completed:
+            EventPublisher.publish_status(pdf_id, "completed")
+
+    @staticmethod
+    def run_split_pdf(
+            db: Session,
+            file_model: Type[FilesTable],
+            file_id: str,
+            file_path: str,
+            profile_name: str = None,
+            formats: List[str] = None
+    ) -> AnyStr:
+        """
+        Read page count of pdf file, create a record for every page and fan
+        out rasterization of page ranges across workers of the pdf queue.
+        Ranges are prioritized by size and page count of the pdf and the
+        backlog of the tenant including the new pages.
+
+        Args:
+            db: sqlalchemy instance
+            file_model: FilesTable instance
+            file_id: pdf file id
+            file_path: storage uri of pdf file
+            profile_name: name of conversion profile
+            formats: output format keys of pages, defaults to OUTPUT_FORMATS
+
+        Returns:
+            AnyStr: file id
+        """
+        pdf = db.query(
+            file_model.name, file_model.page_count, file_model.width, file_model.height,
+            file_model.tenant_id
+        ).filter(file_model.id == file_id).one()
+        page_count = pdf.page_count
+        if not page_count:
+            with StorageHelper.reader(file_path) as local_path:
+                page_count = WandHelper.get_page_count(local_path)
+
+        # Retried tasks reuse pages created by the previous attempt
+        existing = {int(page_num): page_id for page_num, page_id in
+                    db.query(file_model.page_num, file_model.id).filter(file_model.pdf_id == file_id)}
+        records = []
+        pages = []
+        for i in range(page_count):
+            filename = f"{pdf.name.split('.pdf')[0]}_image_{i + 1}.png"
+            page_path = StorageHelper.get_sibling_uri(file_path, filename)
+            page_id = existing.get(i + 1)
+            if page_id is None:
+                page_id = string_uuid()
+                records.append({"id": page_id, "name": filename, "type": "png",
+                                "page_num": i + 1, "pdf_id": file_id,
+                                "tenant_id": pdf.tenant_id, "status": "uploading"})
+            pages.append([i, page_id, page_path])
+
+        if records:
+            db.execute(insert(file_model).values(records))
+        db.execute(update(file_model).where(file_model.id == file_id).values(
+            status="processing", path=file_path, page_count=page_count
+        ))
+        Tasks.commit_status(db)
+        EventPublisher.publish_status(file_id, "processing")
+
+        # Pdf dimensions are in points which rasterize 1:1 at 72 dpi
+        pixels = Tasks.estimate_pixels(pdf.width, pdf.height)
+        priority = PriorityHelper.get_priority(
+            StorageHelper.stat(file_path).st_size, page_count,
+            PriorityHelper.get_tenant_backlog(db, file_model, pdf.tenant_id)
+        )
+        group(
+            rasterize_pdf_pages.si(file_id, file_path, pages[i:i + PDF_PAGES_PER_TASK],
+                                   pixels, profile_name, formats, priority).set(priority=priority)
+            for i in range(0, len(pages), PDF_PAGES_PER_TASK)
+        ).apply_async()
         return file_id
 
+    @staticmethod
+    def run_rasterize_pdf_pages(
+            db: Session,
+            file_model: Type[FilesTable],
+            pdf_file_id: str,
+            file_path: str,
+            pages: List,
+            pixels: int = None,
+            profile_name: str = None,
+            formats: List[str] = None,
+            priority: int = None
+    ) -> List:
+        """
+        Rasterize range of pdf pages and convert them into every output
+        format, either in the same pass (fused processing) or by queueing
+        convert_to_png
+
+        Args:
+            db: sqlalchemy instance
+            file_model: FilesTable instance
+            pdf_file_id: pdf file id
+            file_path: storage uri of pdf file
+            pages: list of [page index, page file id, page storage uri]
+            pixels: estimated number of pixels of a page
+            profile_name: name of conversion profile
+            formats: output format keys, defaults to OUTPUT_FORMATS
+            priority: priority of queued convert_to_png tasks
+
+        Returns:
+            list: page file ids
+        """
+        profile = get_conversion_profile(profile_name)
+        params = []
+        with StorageHelper.reader(file_path) as pdf_path, WandHelper.resource_limits(pixels):
+            for page_index, page_id, page_path in pages:
+                if FUSED_PROCESSING:
+                    # Original and converted outputs of page are written from one decode
+                    outputs = Tasks.get_outputs(page_path, profile, formats)
+                    metadata = WandHelper.rasterize_pdf_page(
+                        pdf_path, page_index, page_path,
+                        converted_outputs=outputs,
+                        profile=profile
+                    )
+                    Tasks.save_outputs(db, page_id, None, profile, outputs, metadata)
+                    converted = {"page_status": "completed", "primary_output_path": outputs[0][1],
+                                 "profile_resolution": profile.resolution, "profile_key": profile.key,
+                                 "converted_width": metadata["output_width"],
+                                 "converted_height": metadata["output_height"]}
+                else:
+                    metadata = WandHelper.rasterize_pdf_page(pdf_path, page_index, page_path)
+                    converted = {"page_status": "uploaded", "primary_output_path": None,
+                                 "profile_resolution": None, "profile_key": None,
+                                 "converted_width": None, "converted_height": None}
+
+                params.append({"page_id": page_id, "page_path": page_path,
+                               "page_resolution": metadata["resolution"],
+                               "page_width": metadata["width"], "page_height": metadata["height"],
+                               **converted})
+
+        # Pages of the range are updated in one batch and committed together
+        # before conversion is queued
+        db.execute(UPDATE_PAGE, params)
+        Tasks.commit_status(db)
+        files_id = [page_id for _, page_id, _ in pages]
+        for page_id in files_id:
+            EventPublisher.publish_status(page_id, "completed" if FUSED_PROCESSING else "uploaded",
+                                          pdf_file_id)
+        if FUSED_PROCESSING:
+            Tasks.complete_pdf(db, file_model, pdf_file_id)
+        else:
+            for page_id in files_id:
+                convert_to_png.apply_async((page_id, profile.name, formats), priority=priority)
+
+        return files_id
+
+
+class FileTask(BaseDbTask):
+    """
+    Task whose first argument is a file id, the file is marked as failed
+    once the task gives up retrying
+    """
+
+    @staticmethod
+    def get_file_id(args, kwargs):
+        return args[0] if args else kwargs.get("file_id", kwargs.get("pdf_file_id"))
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        super().on_failure(exc, task_id, args, kwargs, einfo)
+        file_id = self.get_file_id(args, kwargs)
+        if file_id:
+            # the session of the task is closed once it raised
+            with db_instance.session_scope() as session:
+                Tasks.fail_file(session, FilesTable, file_id)
+
 
 @celery_app.task(
     bind=True,
@@ -111,8 +584,7 @@ class Tasks:
 )
 def run_test_task(self):
     try:
-        # Example of async task running within celery
-        loop.run_until_complete(Tasks.run_async_test_task(self.session))
+        Tasks.run_test_task(self.session)
     except Exception as exc:
         logging.exception("exception while running task. retrying")
         raise self.retry(exc=exc)
@@ -122,7 +594,7 @@ def run_test_task(self):
     bind=True,
     max_retries=3,
     acks_late=True,
-    base=BaseDbTask,
+    base=FileTask,
     retry_jitter=True,
     retry_backoff=True,
     default_retry_delay=5,
@@ -131,16 +603,10 @@ def run_test_task(self):
 def upload_file(
         self,
         file_id: str,
-        file_data_str: str,
         file_path: str
 ):
     try:
-        # Example of async task running within celery
-        file_data = Helper.decode_base64_string_to_bytes(file_data_str)
-        loop.run_until_complete(Tasks.run_upload_file(
-            self.session, FilesTable,
-            file_id, file_data, file_path
-        ))
+        Tasks.run_upload_file(self.session, FilesTable, file_id, file_path)
     except Exception as exc:
         logging.exception("exception while running upload_file task. retrying")
         raise self.retry(exc=exc)
@@ -150,18 +616,125 @@ def upload_file(
     bind=True,
     max_retries=3,
     acks_late=True,
-    base=BaseDbTask,
+    base=FileTask,
     retry_jitter=True,
     retry_backoff=True,
     default_retry_delay=5,
     reject_on_worker_lost=True,
 )
-def convert_to_png(self, file_id: str):
+def convert_to_png(self, file_id: str, profile_name: str = None, formats: List[str] = None):
+    # name is kept for queued messages, every output format is written
     try:
-        # Example of async task running within celery
-        loop.run_until_complete(Tasks.run_convert_to_png(
-            self.session, FilesTable, file_id
-        ))
+        Tasks.run_convert_to_png(
+            self.session, FilesTable, file_id, profile_name, formats
+        )
     except Exception as exc:
         logging.exception("exception while running convert_to_png task. retrying")
         raise self.retry(exc=exc)
+
+
+@celery_app.task(
+    bind=True,
+    max_retries=3,
+    acks_late=True,
+    base=FileTask,
+    retry_jitter=True,
+    retry_backoff=True,
+    default_retry_delay=5,
+    reject_on_worker_lost=True,
+)
+def split_pdf(self, file_id: str, file_path: str, profile_name: str = None, formats: List[str] = None):
+    try:
+        Tasks.run_split_pdf(
+            self.session, FilesTable, file_id, file_path, profile_name, formats
+        )
+    except Exception as exc:
+        logging.exception("exception while running split_pdf task. retrying")
+        raise self.retry(exc=exc)
+
+
+@celery_app.task(
+    bind=True,
+    max_retries=3,
+    acks_late=True,
+    base=FileTask,
+    retry_jitter=True,
+    retry_backoff=True,
+    default_retry_delay=5,
+    reject_on_worker_lost=True,
+)
+def rasterize_pdf_pages(
+        self,
+        pdf_file_id: str,
+        file_path: str,
+        pages: List,
+        pixels: int = None,
+        profile_name: str = None,
+        formats: List[str] = None,
+        priority: int = None
+):
+    try:
+        Tasks.run_rasterize_pdf_pages(
+            self.session, FilesTable, pdf_file_id, file_path, pages, pixels, profile_name, formats,
+            priority
+        )
+    except Exception as exc:
+        logging.exception(f"exception while rasterizing pages of pdf {pdf_file_id}. retrying")
+        raise self.retry(exc=exc)
+
+
+@celery_app.task(
+    acks_late=True,
+    base=Batches,
+    flush_every=BATCH_SIZE,
+    flush_interval=BATCH_MAX_WAIT_MS / 1000,
+)
+def process_image_batch(requests: List):
+    # requests are buffered process_image calls followed by their message headers,
+    # failed images are retried one by one with the priority and headers they were sent with
+    jobs = [request.args for request in requests]
+    try:
+        with ProfilingHelper.sampled("task", "process_image_batch") as profile, \
+                db_instance.session_scope() as session:
+            if profile is not None:
+                profile["file_ids"] = [job[0] for job in jobs]
+            failed = Tasks.run_process_image_batch(session, FilesTable, jobs)
+    except Exception:
+        logging.exception("exception while running process_image_batch task. retrying images one by one")
+        failed = jobs
+
+    failed_jobs = {id(job) for job in failed}
+    for request in requests:
+        if id(request.args) in failed_jobs:
+            process_image.apply_async(
+                list(request.args[:5]),
+                priority=request.delivery_info.get("priority"),
+                headers=request.args[5] if len(request.args) > 5 else None,
+            )
+
+
+@celery_app.task(
+    bind=True,
+    max_retries=3,
+    acks_late=True,
+    base=FileTask,
+    retry_jitter=True,
+    retry_backoff=True,
+    default_retry_delay=5,
+    reject_on_worker_lost=True,
+)
+def process_image(
+        self,
+        file_id: str,
+        file_path: str,
+        pixels: int = None,
+        profile_name: str = None,
+        formats: List[str] = None
+):
+    try:
+        Tasks.run_process_image(
+            self.session, FilesTable, file_id, file_path, pixels, profile_name, formats
+        )
+    except Exception as exc:
+        logging.exception("exception while running process_image task. retrying")
+        raise self.retry(exc=exc)
@@ -48,3 +48,10 @@ log_data = {
     "port": port,
 }
 print(json.dumps(log_data))
+
+
+def child_exit(server, worker):
+    # drop live gauges of exited workers from the aggregated metrics
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,14 @@
+# Packages
+import os
+import sys
+import types
+
+# Importing the app package connects to the database and creates its tables.
+# Unit tests only need its modules, so the package is registered without
+# running that bootstrap.
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+if "app" not in sys.modules:
+    package = types.ModuleType("app")
+    package.__path__ = [APP_DIR]
+    sys.modules["app"] = package
@@ -0,0 +1,63 @@
+# Packages
+import pytest
+
+# Modules
+from app.utils.delivery_helper import DeliveryHelper
+
+
+@pytest.mark.parametrize("range_header, size, expected", [
+    # suffix ranges, longer suffixes cover the whole file
+    ("bytes=-100", 1000, (900, 999)),
+    ("bytes=-2000", 1000, (0, 999)),
+    # open-ended ranges
+    ("bytes=500-", 1000, (500, 999)),
+    ("bytes=999-", 1000, (999, 999)),
+    ("bytes=0-99", 1000, (0, 99)),
+    ("bytes= 0-0", 1000, (0, 0)),
+    # last byte beyond the file is clamped
+    ("bytes=900-5000", 1000, (900, 999)),
+    # start after end is invalid and ignored
+    ("bytes=200-100", 1000, None),
+    # multiple ranges are served as a full response
+    ("bytes=0-1,5-6", 1000, None),
+    ("bytes=0-1, 5-", 1000, None),
+    # missing or malformed headers and other units
+    (None, 1000, None),
+    ("", 1000, None),
+    ("items=0-1", 1000, None),
+    ("bytes=abc", 1000, None),
+    ("bytes=1", 1000, None),
+    ("bytes=-", 1000, None),
+    ("bytes=1-2-3", 1000, None),
+    ("bytes=²-", 1000, None),
+])
+def test_parse_range(range_header, size, expected):
+    assert DeliveryHelper.parse_range(range_header, size) == expected
+
+
+@pytest.mark.parametrize("range_header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=5000-6000", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=0-", 0),
+    ("bytes=-100", 0),
+])
+def test_parse_range_not_satisfiable(range_header, size):
+    # served as 416 with the size of the file in Content-Range
+    with pytest.raises(ValueError):
+        DeliveryHelper.parse_range(range_header, size)
+
+
+@pytest.mark.parametrize("file_path, expected", [
+    ("/data/static/abc.png", "/protected/abc.png"),
+    # the deepest root containing the file is used
+    ("/data/static/derivatives/abc_64_fit.png", "/derivatives/abc_64_fit.png"),
+    ("/data/cache/abc_64_fit.png", None),
+    # paths leaving a root through .. are not below it
+    ("/data/static/../cache/abc.png", None),
+    ("/data/static-other/abc.png", None),
+])
+def test_get_accel_path(file_path, expected):
+    roots = [("/data/static", "/protected"), ("/data/static/derivatives", "/derivatives/"), ("/data/cache", None)]
+
+    assert DeliveryHelper.get_accel_path(file_path, roots) == expected
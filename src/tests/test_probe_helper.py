@@ -0,0 +1,83 @@
+# Packages
+import os
+
+import pytest
+
+# Modules
+from app.utils.probe_helper import PdfReader, ProbeHelper
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def fixture_path(name: str) -> str:
+    return os.path.join(FIXTURES_DIR, name)
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("image.png", {"format": "png", "width": 3, "height": 2, "resolution": "300x300"}),
+    ("jfif.jpg", {"format": "jpeg", "width": 3, "height": 2, "resolution": "300x300"}),
+    # exif density takes precedence over jfif
+    ("exif.jpg", {"format": "jpeg", "width": 3, "height": 2, "resolution": "150x150"}),
+])
+def test_probe_image_headers(name, expected):
+    metadata = ProbeHelper.probe(fixture_path(name))
+
+    assert {key: getattr(metadata, key) for key in expected} == expected
+    assert metadata.page_count is None
+
+
+@pytest.mark.parametrize("name, page_count, media_box", [
+    ("simple.pdf", 2, [0, 0, 612, 792]),
+    # the update replaced the root of the page tree, its stale version counts 3 pages
+    ("incremental.pdf", 2, [0, 0, 595, 842]),
+    # the root holds nested dictionaries, its child node counts 2 of 3 pages
+    ("nested.pdf", 3, [0, 0, 200, 100]),
+])
+def test_probe_pdf_page_tree(name, page_count, media_box):
+    metadata = ProbeHelper.probe(fixture_path(name))
+
+    assert metadata.format == "pdf"
+    assert metadata.page_count == page_count
+    assert metadata.media_box == media_box
+    assert (metadata.width, metadata.height) == (media_box[2], media_box[3])
+    assert metadata.resolution == "72x72"
+
+
+@pytest.mark.parametrize("name", [
+    "xref_stream.pdf",
+    # the catalog nests 3000 arrays
+    "deep.pdf",
+])
+def test_probe_pdf_unreadable_page_tree_leaves_page_count_unset(name):
+    metadata = ProbeHelper.probe(fixture_path(name))
+
+    assert metadata.format == "pdf"
+    assert metadata.page_count is None
+    assert metadata.width is None
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"<< /Type /Pages /Count 3 >>", {b"/Type": b"/Pages", b"/Count": b"3"}),
+    (b"<< /Kids [1 0 R 2 0 R] /Parent 4 0 R >>", {b"/Kids": b"[1 0 R 2 0 R]", b"/Parent": b"4 0 R"}),
+    (b"<</A<</B<</C 1>>>>/D(x >> \\) (y))/E<ab>>>", {b"/A": b"<</B<</C 1>>>>", b"/D": b"(x >> \\) (y))",
+                                                   b"/E": b"<ab>"}),
+    (b"<< % comment >>\n/Count 1 >>", {b"/Count": b"1"}),
+])
+def test_parse_dict(data, expected):
+    entries, end = PdfReader.parse_dict(data, 0)
+
+    assert entries == expected
+    assert end == len(data)
+
+
+@pytest.mark.parametrize("data", [
+    b"<< /Count 1",
+    b"<< 1 2 >>",
+    b"<< /Name (unterminated >>",
+    b"[1 2]",
+    pytest.param(b"<< /A " + b"[" * 3000 + b"]" * 3000 + b" >>", id="nested-arrays"),
+    pytest.param(b"<< /A " + b"<< /B " * 3000 + b">> " * 3001, id="nested-dicts"),
+])
+def test_parse_dict_rejects_malformed(data):
+    with pytest.raises(ValueError):
+        PdfReader.parse_dict(data, 0)
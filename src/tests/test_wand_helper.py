@@ -0,0 +1,35 @@
+# Packages
+import struct
+
+import pytest
+
+# Modules
+from app.utils.conversion_profile import get_conversion_profile, parse_output_formats
+from app.utils.wand_helper import Image, WandHelper
+
+
+def read_image_data(file_path: str) -> bytes:
+    """Compressed image data of png, other chunks hold timestamps"""
+    with open(file_path, "rb") as file:
+        data = file.read()
+    position, chunks = 8, []
+    while position < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        if chunk_type == b"IDAT":
+            chunks.append(data[position + 8:position + 8 + length])
+        position += length + 12
+    return b"".join(chunks)
+
+
+def encode_png(directory, formats: str, profile: str) -> bytes:
+    directory.mkdir()
+    outputs = [(output, str(directory / f"output.{output.format}")) for output in parse_output_formats(formats)]
+    with Image(width=64, height=64, pseudo="gradient:red-blue") as img:
+        WandHelper.encode_outputs(img, outputs, get_conversion_profile(profile))
+    return read_image_data(str(directory / "output.png"))
+
+
+@pytest.mark.parametrize("profile", ["quality", "fast"])
+@pytest.mark.parametrize("formats", ["webp:10,png", "jpeg:10,png", "webp:95,jpeg:10,png"])
+def test_png_is_independent_of_sibling_formats(tmp_path, profile, formats):
+    assert encode_png(tmp_path / "siblings", formats, profile) == encode_png(tmp_path / "alone", "png", profile)